@@ -8,5 +8,5 @@ mkdir -p staticfiles
 # Collect static files
 python manage.py collectstatic --noinput
 
-# Apply migrations (if you have a database)
-# python manage.py migrate
\ No newline at end of file
+# Apply migrations (geocode cache table)
+python manage.py migrate --noinput
\ No newline at end of file
@@ -1,2 +1,9 @@
 from django.contrib import admin
-# We don't need to register any models at this point
+
+from .models import GeocodeCacheEntry
+
+
+@admin.register(GeocodeCacheEntry)
+class GeocodeCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('normalized_address', 'found', 'lat', 'lng', 'expires_at')
+    search_fields = ('normalized_address',)
@@ -0,0 +1,209 @@
+"""
+Async Route Calculator module
+
+This module provides coroutine versions of the geocoding, suggestion and
+route calculations in route_calculator for the async views. Upstream
+calls are made with upstream.aget so a waiting plan holds no thread;
+database-backed cache lookups go through sync_to_async, and the caches,
+single-flight keys and result formats are the same as the sync versions.
+"""
+
+import asyncio
+
+from asgiref.sync import sync_to_async
+
+from . import upstream
+from .gazetteer import get_gazetteer
+from .geocode_cache import geocode_cache, normalize_address, MISS
+from .route_calculator import (
+    GeocodingError,
+    LocationNotFoundError,
+    _assemble_route,
+    _cached_legs,
+    _combine_route,
+    _format_suggestions,
+    _geocode_uncached,
+    _route_key,
+    _store_geocode,
+    _store_legs
+)
+from .routing import get_routing_backend
+from .singleflight import upstream_flight
+
+
+async def ageocode_address(address, priority='geocode'):
+    """
+    Async version of route_calculator.geocode_address
+
+    Args:
+        address: String address to geocode
+        priority: Nominatim scheduling class
+
+    Returns:
+        Dictionary with lat and lng
+    """
+    gazetteer = get_gazetteer()
+    if gazetteer is not None:
+        place = gazetteer.lookup(address)
+        if place is not None:
+            return {'address': address, **place}
+
+    cached = await sync_to_async(geocode_cache.get)(address)
+    if cached is MISS:
+        key = 'geocode:' + normalize_address(address)
+
+        cached = await sync_to_async(geocode_cache.get_stale)(address)
+        if cached is not MISS:
+            # Background refreshes run on the sync refresh pool
+            upstream_flight.refresh(key, lambda: _geocode_uncached(address, priority))
+        else:
+            cached = await upstream_flight.ado(key, lambda: _ageocode_uncached(address, priority))
+    if cached is None:
+        raise LocationNotFoundError(f"Location not found: {address}")
+
+    return {'address': address, **cached}
+
+
+async def _ageocode_uncached(address, priority):
+    """Geocode an address with Nominatim and store the answer in the cache"""
+    # Another worker may have resolved the address while we waited
+    cached = await sync_to_async(geocode_cache.get)(address, record_stats=False)
+    if cached is not MISS:
+        return cached
+
+    response = await upstream.aget(
+        'nominatim',
+        '/search',
+        params={
+            'q': address,
+            'format': 'json',
+            'limit': 1
+        },
+        priority=priority
+    )
+
+    return await sync_to_async(_store_geocode)(address, response.json())
+
+
+async def asuggest_locations(query, limit=5):
+    """
+    Async version of route_calculator.suggest_locations
+
+    Args:
+        query: Partial location name typed by the user
+        limit: Maximum number of suggestions
+
+    Returns:
+        List of dictionaries with display_name, lat and lng
+    """
+    gazetteer = get_gazetteer()
+    if gazetteer is not None:
+        suggestions = gazetteer.suggest(query, limit)
+        if suggestions:
+            return suggestions
+
+    return await upstream_flight.ado(
+        f'suggest:{limit}:' + normalize_address(query),
+        lambda: _asuggest_locations_upstream(query, limit)
+    )
+
+
+async def _asuggest_locations_upstream(query, limit):
+    """Get location suggestions from Nominatim"""
+    response = await upstream.aget(
+        'nominatim',
+        '/search',
+        params={
+            'q': query,
+            'format': 'json',
+            'limit': limit
+        },
+        priority='suggest'
+    )
+
+    return _format_suggestions(response.json())
+
+
+async def acalculate_route(current_location, pickup_location, dropoff_location, geometry='full', steps=False):
+    """
+    Async version of route_calculator.calculate_route
+
+    Args:
+        current_location: String address of starting point
+        pickup_location: String address of pickup location
+        dropoff_location: String address of dropoff location
+        geometry: Route geometry detail ('none', 'simplified' or 'full')
+        steps: Whether to fetch turn-by-turn steps for each leg
+
+    Returns:
+        Dictionary with route information
+    """
+    return await acalculate_multi_stop_route([
+        ('current', current_location),
+        ('pickup', pickup_location),
+        ('dropoff', dropoff_location)
+    ], geometry, steps)
+
+
+async def acalculate_multi_stop_route(addresses, geometry='full', steps=False):
+    """
+    Async version of route_calculator.calculate_multi_stop_route
+
+    Args:
+        addresses: List of (label, address) tuples in driving order
+        geometry: Route geometry detail
+        steps: Whether to fetch turn-by-turn steps for each leg
+
+    Returns:
+        Dictionary with route information (one segment per leg)
+    """
+    # Geocode all locations concurrently on the event loop
+    results = await asyncio.gather(
+        *(ageocode_address(address, 'route') for _, address in addresses),
+        return_exceptions=True
+    )
+
+    # Report geocoding failures in input order
+    for (label, address), result in zip(addresses, results):
+        if isinstance(result, Exception):
+            raise GeocodingError(label, address, result) from result
+    locations = list(results)
+
+    route = await acalculate_route_legs(locations, geometry, steps)
+
+    return _combine_route(locations, route)
+
+
+async def acalculate_route_legs(waypoints, geometry='full', steps=False):
+    """
+    Async version of route_calculator.calculate_route_legs
+
+    Args:
+        waypoints: List of dictionaries with lat and lng, in driving order
+        geometry: Route geometry detail
+        steps: Whether to fetch turn-by-turn steps for each leg
+
+    Returns:
+        Dictionary with one segment per leg, the encoded polyline of the
+        whole route and its decoded (n, 2) coordinate array
+    """
+    legs = _cached_legs(waypoints, geometry, steps)
+    route_polyline = None
+
+    if any(leg is MISS for leg in legs):
+        backend = get_routing_backend()
+        key = _route_key(backend, waypoints, geometry, steps)
+
+        legs = _cached_legs(waypoints, geometry, steps, stale=True)
+        if any(leg is MISS for leg in legs):
+            route = await upstream_flight.ado(key, lambda: backend.aroute(waypoints, geometry, steps))
+            _store_legs(waypoints, route, geometry)
+            legs, route_polyline = route
+        else:
+            upstream_flight.refresh(
+                key,
+                lambda: backend.route(waypoints, geometry, steps),
+                lambda route: _store_legs(waypoints, route, geometry)
+            )
+
+    return _assemble_route(waypoints, legs, route_polyline, geometry, steps)
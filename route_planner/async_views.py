@@ -0,0 +1,205 @@
+"""
+Async Views module
+
+This module provides native async versions of the route, geocode and
+suggestion views for use under an ASGI server. Requests waiting on
+Nominatim or OSRM hold no worker thread; the CPU-bound HOS schedule and
+log generation run in a thread pool. Requests go through DRF's parsers,
+authentication, permissions and throttles as configured in
+REST_FRAMEWORK, so request validation, response format and error
+handling match the sync views in views.py.
+"""
+
+from asgiref.sync import sync_to_async
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException, PermissionDenied, Throttled
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from .async_route_calculator import (
+    acalculate_route,
+    ageocode_address,
+    asuggest_locations
+)
+from .hos_calculator import ScheduleBudgetExceeded
+from .rate_limiter import RateLimitExceeded
+from .route_calculator import GeocodingError, LocationNotFoundError
+from .routing import get_route_detail
+from .serializers import TripRequestSerializer
+from .upstream import UpstreamError
+from .views import build_route_plan, upstream_unavailable_response
+
+
+class AsyncAPIView(View):
+    """Base class for async JSON views returning DRF Response objects"""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Same as DRF's APIView: the API does not use session auth
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        request = Request(
+            request,
+            parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+            authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        )
+        try:
+            # Authentication may hit the database, which is sync-only
+            await sync_to_async(self.initial)(request)
+            response = await super().dispatch(request, *args, **kwargs)
+        except APIException as e:
+            response = exception_handler(e, {'view': self, 'request': request})
+
+        if isinstance(response, Response):
+            # Rendered here since there is no APIView to negotiate content
+            response.accepted_renderer = JSONRenderer()
+            response.accepted_media_type = 'application/json'
+            response.renderer_context = {}
+            response.render()
+        return response
+
+    def initial(self, request):
+        """Authenticate, then run permission and throttle checks, as APIView does"""
+        request.user
+        for permission_class in api_settings.DEFAULT_PERMISSION_CLASSES:
+            permission = permission_class()
+            if not permission.has_permission(request, self):
+                raise PermissionDenied(getattr(permission, 'message', None))
+        for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES:
+            throttle = throttle_class()
+            if not throttle.allow_request(request, self):
+                raise Throttled(throttle.wait())
+
+
+class AsyncRouteCalculatorView(AsyncAPIView):
+    """Async API view for calculating routes with HOS compliance"""
+
+    async def post(self, request):
+        """Process route calculation request"""
+        serializer = TripRequestSerializer(data=request.data)
+
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        geometry, steps = get_route_detail(
+            'calculate_route',
+            serializer.validated_data.get('geometry'),
+            serializer.validated_data.get('steps')
+        )
+
+        try:
+            # Geocoding and routing wait on the event loop
+            route_data = await acalculate_route(
+                serializer.validated_data['current_location'],
+                serializer.validated_data['pickup_location'],
+                serializer.validated_data['dropoff_location'],
+                geometry,
+                steps
+            )
+
+            # HOS schedule and log sheets are CPU-bound; keep them off the loop
+            return await sync_to_async(build_route_plan, thread_sensitive=False)(
+                route_data,
+                serializer.cycle_hours(),
+                serializer.validated_data['enrich_stops'],
+                steps,
+                serializer.validated_data['allow_restart'],
+                serializer.validated_data['sleeper_berth']
+            )
+
+        except (UpstreamError, RateLimitExceeded) as e:
+            return upstream_unavailable_response(e)
+
+        except ScheduleBudgetExceeded as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+
+        except GeocodingError as e:
+            if isinstance(e.error, (UpstreamError, RateLimitExceeded)):
+                return upstream_unavailable_response(e)
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class AsyncGeocodeView(AsyncAPIView):
+    """Async API view for geocoding addresses"""
+
+    async def get(self, request):
+        """Geocode an address to coordinates"""
+        address = request.GET.get('address')
+
+        if not address:
+            return Response(
+                {'error': 'Address parameter is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            return Response(await ageocode_address(address))
+
+        except LocationNotFoundError:
+            return Response(
+                {'error': 'Location not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        except RateLimitExceeded as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
+
+        except UpstreamError as e:
+            return upstream_unavailable_response(e)
+
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class AsyncLocationSuggestionsView(AsyncAPIView):
+    """Async API view for getting location suggestions"""
+
+    async def get(self, request):
+        """Get suggestions for location input"""
+        query = request.GET.get('query')
+
+        if not query or len(query) < 3:
+            return Response([])
+
+        try:
+            return Response(await asuggest_locations(query, limit=5))
+
+        except RateLimitExceeded as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
+
+        except UpstreamError as e:
+            return upstream_unavailable_response(e)
+
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
@@ -0,0 +1,171 @@
+"""
+Gazetteer module
+
+This module provides an offline geocoder over a local file of known
+places (cities, ZIP centroids, truck stops). Names are kept in a sorted
+array so exact lookups and prefix suggestions are a binary search.
+"""
+
+import bisect
+import csv
+import heapq
+import os
+import threading
+
+from django.conf import settings
+
+from .geocode_cache import normalize_address
+
+
+class Gazetteer:
+    """In-memory place index with exact and prefix lookup"""
+
+    def __init__(self, path):
+        """
+        Load places from a CSV file
+
+        Args:
+            path: CSV with columns name, kind, lat, lng and optional
+                  display_name and rank (higher ranks are suggested first)
+        """
+        self.places = []
+        index = []
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                place = {
+                    'display_name': row.get('display_name') or row['name'],
+                    'kind': row.get('kind', ''),
+                    'lat': float(row['lat']),
+                    'lng': float(row['lng']),
+                    'rank': float(row.get('rank') or 0)
+                }
+                place_id = len(self.places)
+                self.places.append(place)
+                # Index both the short name and the full display name
+                for key in {normalize_address(row['name']), normalize_address(place['display_name'])}:
+                    index.append((key, place_id))
+
+        index.sort()
+        self.keys = [key for key, _ in index]
+        self.place_ids = [place_id for _, place_id in index]
+
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'suggestion_hits': 0,
+            'suggestion_misses': 0,
+        }
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _prefix_range(self, prefix):
+        """Return the index positions [start, end) of keys starting with prefix"""
+        start = bisect.bisect_left(self.keys, prefix)
+        if not prefix:
+            return start, len(self.keys)
+        # The first string past every key with this prefix
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return start, bisect.bisect_left(self.keys, upper, start)
+
+    def lookup(self, address):
+        """
+        Find a place whose name matches the address exactly
+
+        When several places share the name, the highest ranked one wins.
+
+        Args:
+            address: String address to look up
+
+        Returns:
+            Dictionary with lat, lng and display_name, or None
+        """
+        key = normalize_address(address)
+        start = bisect.bisect_left(self.keys, key)
+        end = bisect.bisect_right(self.keys, key, start)
+        if start < end:
+            self._count('hits')
+            place = max(
+                (self.places[self.place_ids[position]] for position in range(start, end)),
+                key=lambda place: place['rank']
+            )
+            return {
+                'lat': place['lat'],
+                'lng': place['lng'],
+                'display_name': place['display_name']
+            }
+        self._count('misses')
+        return None
+
+    def suggest(self, query, limit=5):
+        """
+        Find places whose name starts with the query
+
+        Every prefix match is ranked, highest rank first, then by name.
+
+        Args:
+            query: Partial location name typed by the user
+            limit: Maximum number of suggestions to return
+
+        Returns:
+            List of dictionaries with display_name, lat and lng
+        """
+        start, end = self._prefix_range(normalize_address(query))
+
+        # A place is indexed under at most two keys, so the best 2 * limit
+        # entries hold the best `limit` places
+        best = heapq.nsmallest(
+            2 * limit,
+            range(start, end),
+            key=lambda position: (-self.places[self.place_ids[position]]['rank'], self.keys[position])
+        )
+        ranked = []
+        for position in best:
+            place_id = self.place_ids[position]
+            if place_id not in ranked:
+                ranked.append(place_id)
+        ranked = ranked[:limit]
+
+        self._count('suggestion_hits' if ranked else 'suggestion_misses')
+        return [
+            {
+                'display_name': self.places[place_id]['display_name'],
+                'lat': self.places[place_id]['lat'],
+                'lng': self.places[place_id]['lng']
+            }
+            for place_id in ranked
+        ]
+
+    def get_stats(self):
+        """Return a snapshot of lookup counters"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['places'] = len(self.places)
+        return stats
+
+
+_gazetteer = None
+_gazetteer_loaded = False
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer():
+    """
+    Get the gazetteer configured in settings.GAZETTEER_PATH
+
+    Returns:
+        Gazetteer shared by the process, or None if no file is configured
+    """
+    global _gazetteer, _gazetteer_loaded
+    if _gazetteer_loaded:
+        return _gazetteer
+
+    with _gazetteer_lock:
+        if not _gazetteer_loaded:
+            path = getattr(settings, 'GAZETTEER_PATH', None)
+            if path and os.path.exists(path):
+                _gazetteer = Gazetteer(path)
+            _gazetteer_loaded = True
+        return _gazetteer
@@ -0,0 +1,331 @@
+"""
+Geocode Cache module
+
+This module provides a two-tier cache for geocoding results. The first
+tier is an in-process LRU with TTL, the second is the GeocodeCacheEntry
+table so that hits survive restarts and are shared across workers.
+Resolved locations are also kept in a geohash spatial index, so "is there
+a known place within X m" is answered locally.
+"""
+
+import datetime
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from .models import GeocodeCacheEntry
+from .spatial_index import SpatialIndex
+
+
+# Sentinel returned when neither tier has an entry for the address
+MISS = object()
+
+
+def normalize_address(address):
+    """
+    Normalize an address string into a cache key
+
+    Args:
+        address: String address as entered by the user
+
+    Returns:
+        Lowercased address with collapsed whitespace and punctuation
+    """
+    key = address.strip().lower()
+    key = re.sub(r'\s*,\s*', ', ', key)
+    key = re.sub(r'\s+', ' ', key)
+    return key.strip(' ,.')[:255]
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_size, ttl, stale_ttl=0, on_evict=None):
+        """
+        Initialize cache
+
+        Args:
+            max_size: Maximum number of entries
+            ttl: Default time to live in seconds
+            stale_ttl: Seconds an expired entry is kept for get_stale
+            on_evict: Optional callable(key, value) run, under the cache
+                      lock, for every entry dropped from the cache
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        """Remove an entry (the lock must be held)"""
+        value, _ = self._entries.pop(key)
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def get(self, key):
+        """Return the cached value for key, or MISS if absent or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISS
+            value, expires_at = entry
+            now = time.monotonic()
+            if expires_at <= now:
+                if expires_at + self.stale_ttl <= now:
+                    self._drop(key)
+                return MISS
+            self._entries.move_to_end(key)
+            return value
+
+    def get_stale(self, key):
+        """Return the value for key even if expired within stale_ttl, or MISS"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISS
+            value, expires_at = entry
+            if expires_at + self.stale_ttl <= time.monotonic():
+                self._drop(key)
+                return MISS
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, evicting the least recently used entry if full"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class GeocodeCache:
+    """Two-tier (memory + database) cache for geocoding results"""
+
+    def __init__(self):
+        """Initialize cache tiers from Django settings"""
+        self.ttl = getattr(settings, 'GEOCODE_CACHE_TTL', 60 * 60 * 24 * 30)
+        self.negative_ttl = getattr(settings, 'GEOCODE_NEGATIVE_CACHE_TTL', 60 * 10)
+        self.stale_ttl = getattr(settings, 'GEOCODE_CACHE_STALE_TTL', 60 * 60 * 24 * 7)
+        self.memory = LRUCache(
+            getattr(settings, 'GEOCODE_CACHE_MAX_SIZE', 1024),
+            self.ttl,
+            self.stale_ttl
+        )
+        self.spatial_index = SpatialIndex(getattr(settings, 'GEOCODE_SPATIAL_INDEX_MAX_SIZE', 100000))
+        self._spatial_index_loaded = False
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'memory_hits': 0,
+            'db_hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'stale_hits': 0,
+            'nearby_hits': 0,
+            'nearby_misses': 0,
+            'db_errors': 0,
+        }
+
+    def _count(self, name, record_stats=True):
+        if not record_stats:
+            return
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get(self, address, record_stats=True):
+        """
+        Look up an address in both tiers
+
+        Args:
+            address: String address to look up
+            record_stats: False for re-checks that should not count
+                          as a separate lookup
+
+        Returns:
+            Dictionary with lat, lng and display_name, None for a cached
+            "not found" answer, or MISS when nothing is cached
+        """
+        key = normalize_address(address)
+
+        value = self.memory.get(key)
+        if value is not MISS:
+            self._count('negative_hits' if value is None else 'memory_hits', record_stats)
+            return value
+
+        try:
+            entry = GeocodeCacheEntry.objects.filter(
+                normalized_address=key,
+                expires_at__gt=timezone.now()
+            ).first()
+        except DatabaseError:
+            self._count('db_errors')
+            entry = None
+
+        if entry is None:
+            self._count('misses', record_stats)
+            return MISS
+
+        remaining = (entry.expires_at - timezone.now()).total_seconds()
+        if not entry.found:
+            self.memory.set(key, None, min(remaining, self.negative_ttl))
+            self._count('negative_hits', record_stats)
+            return None
+
+        value = {
+            'lat': entry.lat,
+            'lng': entry.lng,
+            'display_name': entry.display_name
+        }
+        self.memory.set(key, value, min(remaining, self.ttl))
+        self.spatial_index.add(key, value['lat'], value['lng'], value)
+        self._count('db_hits', record_stats)
+        return value
+
+    def get_stale(self, address):
+        """
+        Look up an expired (but not yet discarded) result for an address
+
+        Used to answer from cache while the upstream is unavailable or
+        while a fresh answer is fetched in the background.
+
+        Args:
+            address: String address to look up
+
+        Returns:
+            Dictionary with lat, lng and display_name, or MISS
+        """
+        key = normalize_address(address)
+
+        value = self.memory.get_stale(key)
+        if value is MISS or value is None:
+            try:
+                entry = GeocodeCacheEntry.objects.filter(
+                    normalized_address=key,
+                    found=True,
+                    expires_at__gt=timezone.now() - datetime.timedelta(seconds=self.stale_ttl)
+                ).first()
+            except DatabaseError:
+                self._count('db_errors')
+                entry = None
+            if entry is None:
+                return MISS
+            value = {
+                'lat': entry.lat,
+                'lng': entry.lng,
+                'display_name': entry.display_name
+            }
+
+        self._count('stale_hits')
+        return value
+
+    def set(self, address, value):
+        """
+        Store a geocoding result in both tiers
+
+        Args:
+            address: String address that was geocoded
+            value: Dictionary with lat, lng and display_name, or None
+                   to cache a "not found" answer for the negative TTL
+        """
+        key = normalize_address(address)
+        ttl = self.negative_ttl if value is None else self.ttl
+        self.memory.set(key, value, ttl)
+        if value is None:
+            self.spatial_index.remove(key)
+        else:
+            self.spatial_index.add(key, value['lat'], value['lng'], value)
+        self._count('stores')
+
+        defaults = {
+            'found': value is not None,
+            'lat': value['lat'] if value else None,
+            'lng': value['lng'] if value else None,
+            'display_name': value['display_name'] if value else '',
+            'expires_at': timezone.now() + datetime.timedelta(seconds=ttl)
+        }
+        try:
+            GeocodeCacheEntry.objects.update_or_create(
+                normalized_address=key,
+                defaults=defaults
+            )
+        except DatabaseError:
+            self._count('db_errors')
+
+    def nearby(self, lat, lng, radius_meters):
+        """
+        Find the closest resolved location within a radius
+
+        Args:
+            lat: Latitude in degrees
+            lng: Longitude in degrees
+            radius_meters: Search radius
+
+        Returns:
+            Dictionary with address (normalized), lat, lng, display_name
+            and distance in meters, or None
+        """
+        if not self._spatial_index_loaded:
+            self._load_spatial_index()
+
+        match = self.spatial_index.nearest(lat, lng, radius_meters)
+        if match is None:
+            self._count('nearby_misses')
+            return None
+
+        key, _, _, value, distance = match
+        self._count('nearby_hits')
+        return {'address': key, **value, 'distance': distance}
+
+    def _load_spatial_index(self):
+        """Index the unexpired resolved locations already in the database"""
+        with self._stats_lock:
+            if self._spatial_index_loaded:
+                return
+            self._spatial_index_loaded = True
+
+        try:
+            rows = GeocodeCacheEntry.objects.filter(
+                found=True,
+                expires_at__gt=timezone.now()
+            ).order_by('-created_at').values_list(
+                'normalized_address', 'lat', 'lng', 'display_name'
+            )[:self.spatial_index.max_size]
+            for key, lat, lng, display_name in rows:
+                self.spatial_index.add(key, lat, lng, {
+                    'lat': lat,
+                    'lng': lng,
+                    'display_name': display_name
+                })
+        except DatabaseError:
+            self._count('db_errors')
+
+    def get_stats(self):
+        """Return a snapshot of hit/miss counters"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['negative_hits'] + stats['misses']
+        stats['memory_size'] = len(self.memory)
+        stats['spatial_index_size'] = len(self.spatial_index)
+        stats['hit_rate'] = (lookups - stats['misses']) / lookups if lookups else 0.0
+        return stats
+
+
+# Process-wide cache instance used by route_calculator and the views
+geocode_cache = GeocodeCache()
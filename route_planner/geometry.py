@@ -0,0 +1,220 @@
+"""
+Geometry module
+
+This module handles route geometry as NumPy coordinate arrays: vectorized
+encoding and decoding of Google encoded polylines, merging of per-leg
+geometries, and cumulative along-route distances.
+
+Coordinate arrays have shape (n, 2) and hold (lat, lng) rows in degrees.
+"""
+
+import numpy as np
+
+
+EARTH_RADIUS_MILES = 3958.8
+
+# A value needs k + 1 five-bit chunks once it reaches 2 ** (5 * k)
+CHUNK_THRESHOLDS = np.int64(1) << (5 * np.arange(1, 13, dtype=np.int64))
+
+
+def decode_polyline(encoded, precision=5):
+    """
+    Decode an encoded polyline into a coordinate array
+
+    Args:
+        encoded: Encoded polyline string
+        precision: Number of decimal places encoded (5 for OSRM/Google)
+
+    Returns:
+        NumPy array of shape (n, 2) with (lat, lng) rows
+    """
+    if not encoded:
+        return np.empty((0, 2))
+
+    chunks = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+
+    # A value ends at every chunk without the continuation bit
+    ends = (chunks & 0x20) == 0
+    value_ids = np.concatenate(([0], np.cumsum(ends)[:-1]))
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    shifts = 5 * (np.arange(len(chunks)) - starts[value_ids])
+
+    values = np.add.reduceat((chunks & 0x1f) << shifts, starts)
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / float(10 ** precision)
+
+
+def encode_polyline(coordinates, precision=5):
+    """
+    Encode a coordinate array as a polyline
+
+    Args:
+        coordinates: Array-like of (lat, lng) rows
+        precision: Number of decimal places to encode
+
+    Returns:
+        Encoded polyline string
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+    if not len(coordinates):
+        return ''
+
+    # Round half away from zero, as the reference algorithm does
+    scaled = coordinates * (10 ** precision)
+    integers = (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)).astype(np.int64)
+
+    deltas = np.diff(integers, axis=0, prepend=0).ravel()
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    # Split each value into 5-bit chunks, least significant first
+    chunk_count = 1 + (values[:, None] >= CHUNK_THRESHOLDS).sum(axis=1)
+    max_chunks = int(chunk_count.max())
+    positions = np.arange(max_chunks)
+    chunks = (values[:, None] >> (5 * positions)) & 0x1f
+    chunks |= np.where(positions < (chunk_count[:, None] - 1), 0x20, 0)
+
+    used = positions < chunk_count[:, None]
+    return (chunks[used] + 63).astype(np.uint8).tobytes().decode('ascii')
+
+
+def merge_geometries(geometries):
+    """
+    Join per-leg coordinate arrays end to end
+
+    Args:
+        geometries: List of (n, 2) coordinate arrays in driving order
+
+    Returns:
+        Single coordinate array; the point shared by consecutive legs
+        appears once
+    """
+    pieces = []
+    for geometry in geometries:
+        if not len(geometry):
+            continue
+        if pieces and np.array_equal(pieces[-1][-1], geometry[0]):
+            geometry = geometry[1:]
+        pieces.append(geometry)
+    return np.concatenate(pieces) if pieces else np.empty((0, 2))
+
+
+def merge_polylines(encoded_polylines):
+    """Join encoded polylines end to end into a single encoded polyline"""
+    return encode_polyline(merge_geometries([
+        decode_polyline(encoded) for encoded in encoded_polylines
+    ]))
+
+
+def split_at_points(coordinates, points, leg_distances):
+    """
+    Split a route geometry into legs at the waypoints it passes through
+
+    Args:
+        coordinates: (n, 2) coordinate array of the whole route
+        points: (k, 2) array of the intermediate waypoints, in order
+        leg_distances: Lengths of the k + 1 legs, in any unit; used to tell
+                       apart several passes of the route near one waypoint
+
+    Returns:
+        List of k + 1 coordinate arrays; consecutive legs share their
+        boundary vertex
+    """
+    distances = cumulative_distances(coordinates)
+    total = float(sum(leg_distances))
+    if total > 0:
+        expected = np.cumsum(leg_distances)[:-1] / total * distances[-1]
+    else:
+        expected = np.zeros(len(points))
+
+    pieces = []
+    start = 0
+    for point, target in zip(np.asarray(points, dtype=np.float64).reshape(-1, 2), expected):
+        # Vertices as close to the waypoint as the closest one (within
+        # polyline rounding), then the one nearest the expected position
+        offsets = np.abs(coordinates[start:] - point).max(axis=1)
+        matches = np.flatnonzero(offsets <= offsets.min() + 1e-5)
+        index = start + int(matches[np.argmin(np.abs(distances[start + matches] - target))])
+        pieces.append(coordinates[start:index + 1])
+        start = index
+    pieces.append(coordinates[start:])
+    return pieces
+
+
+def cumulative_distances(coordinates):
+    """
+    Compute the haversine distance driven up to every vertex
+
+    Args:
+        coordinates: (n, 2) coordinate array
+
+    Returns:
+        Array of length n with miles from the first vertex; 0 for the first
+    """
+    if len(coordinates) < 2:
+        return np.zeros(len(coordinates))
+
+    lat = np.radians(coordinates[:, 0])
+    lng = np.radians(coordinates[:, 1])
+    d_lat = np.diff(lat)
+    d_lng = np.diff(lng)
+
+    a = np.sin(d_lat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(d_lng / 2) ** 2
+    steps = 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    return np.concatenate(([0.0], np.cumsum(steps)))
+
+
+def point_at_distance(coordinates, distances, distance):
+    """
+    Find the point a given distance along a polyline
+
+    Args:
+        coordinates: (n, 2) coordinate array
+        distances: Cumulative distances of the vertices (see
+                   cumulative_distances), in the same unit as distance
+        distance: Distance along the route
+
+    Returns:
+        Tuple of (lat, lng) interpolated on the containing edge
+    """
+    index = int(np.searchsorted(distances, distance, side='right'))
+    if index <= 0:
+        return float(coordinates[0, 0]), float(coordinates[0, 1])
+    if index >= len(distances):
+        return float(coordinates[-1, 0]), float(coordinates[-1, 1])
+
+    start, end = distances[index - 1], distances[index]
+    fraction = (distance - start) / (end - start) if end > start else 0.0
+    lat, lng = coordinates[index - 1] + fraction * (coordinates[index] - coordinates[index - 1])
+    return float(lat), float(lng)
+
+
+def points_at_distances(coordinates, distances, targets):
+    """
+    Find the points at several distances along a polyline
+
+    Vectorized point_at_distance; gives the same coordinates.
+
+    Args:
+        coordinates: (n, 2) coordinate array
+        distances: Cumulative distances of the vertices
+        targets: Array of distances along the route
+
+    Returns:
+        (k, 2) array of (lat, lng) rows
+    """
+    targets = np.asarray(targets, dtype=np.float64)
+    index = np.searchsorted(distances, targets, side='right')
+    inner = np.minimum(np.maximum(index, 1), len(distances) - 1)
+
+    start = distances[inner - 1]
+    span = distances[inner] - start
+    moving = span > 0
+    fraction = np.where(moving, (targets - start) / np.where(moving, span, 1.0), 0.0)
+    before = coordinates[inner - 1]
+    points = before + fraction[:, None] * (coordinates[inner] - before)
+
+    # Before the first vertex or past the last one, clamp to the ends
+    points = np.where((index <= 0)[:, None], coordinates[0], points)
+    return np.where((index >= len(distances))[:, None], coordinates[-1], points)
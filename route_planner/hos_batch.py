@@ -0,0 +1,333 @@
+"""
+HOS Batch module
+
+This module evaluates HOS-compliant arrival times for many trips at once,
+for load assignment and what-if analysis across a fleet. Every trip steps
+through the same rules as HOSCalculator.build_schedule (without POI
+facilities) in lockstep, one drive or rest per step, with the duty clocks
+of all trips held in NumPy arrays and the rolling 70-hour/8-day record
+kept as one DutyCycle ring buffer row per trip. The arithmetic is the
+scheduler's own, so arrival times match it exactly; full schedules are
+only built for the trips that ask for one.
+"""
+
+import datetime
+
+import numpy as np
+from django.conf import settings
+
+from .hos_calculator import (
+    CYCLE_TOLERANCE,
+    DutyCycle,
+    HOSCalculator,
+    ScheduleBudgetExceeded,
+    hours_past_midnight
+)
+
+
+# Day held by an empty ring buffer slot
+EMPTY_DAY = np.iinfo(np.int64).min // 2
+
+
+def batch_hos_schedules(leg_durations, leg_distances, current_cycle_hours=0, handling=True,
+                        allow_restart=False, schedules=(), locations=None, start_time=None):
+    """
+    Evaluate HOS-compliant trips in bulk
+
+    Args:
+        leg_durations: (trips, legs) array of pure driving hours per leg; a
+            1-D array is one leg per trip
+        leg_distances: (trips, legs) array of leg distances in miles
+        current_cycle_hours: Hours used in the 70-hour/8-day cycle, for all
+            trips or one per trip; a (trips, days) array gives the hours of
+            each previous day, oldest first
+        handling: Whether to book the pickup and dropoff hours the way
+            build_schedule does (pickup before the first leg, dropoff
+            before the last); False for bare drives
+        allow_restart: Whether drivers may take a 34-hour restart when
+            their cycle runs out
+        schedules: Indices of the trips to build full dictionary schedules
+            for, as calculate_schedule returns them
+        locations: (trips, legs + 1, 2) array of lat/lng at the leg ends;
+            needed to build schedules
+        start_time: Datetime every trip departs at, which places the
+            cycle's midnights; the current hour if None
+
+    Returns:
+        Dictionary of per-trip arrays:
+            - eta_hours: Hours from departure to the end of the trip, NaN
+              when a leg duration is unknown
+            - stops: Number of stops, counted like the schedule's
+            - rests, restarts, breaks, fuel_stops: Stops of each kind
+            - remaining_cycle_hours: Cycle hours left on arrival
+            - feasible: False when a leg duration is unknown (NaN)
+        plus, when schedules are requested, 'schedules': a dictionary of
+        trip index to schedule dictionary (None for infeasible trips)
+
+    Raises:
+        ScheduleBudgetExceeded: If the batch takes more than
+            settings.HOS_MAX_STEPS steps; every step advances every
+            unfinished trip, so its run time grows with the fleet instead
+            of being bounded by HOS_TIME_BUDGET
+    """
+    durations = np.asarray(leg_durations, dtype=np.float64)
+    distances = np.asarray(leg_distances, dtype=np.float64)
+    if durations.ndim == 1:
+        durations = durations[:, None]
+        distances = distances[:, None]
+    if durations.shape != distances.shape:
+        raise ValueError('leg_durations and leg_distances must have the same shape')
+    trip_count, leg_count = durations.shape
+    if not leg_count:
+        raise ValueError('Trips need at least one leg')
+
+    if start_time is None:
+        start_time = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+    start_hour = hours_past_midnight(start_time)
+
+    # On-duty hours per day, as DutyCycle keeps them
+    history = np.asarray(current_cycle_hours, dtype=np.float64)
+    if history.ndim < 2:
+        history = history[..., None]  # A total, worked the day before the start
+    history = np.broadcast_to(history, (trip_count, history.shape[-1]))[:, -(DutyCycle.DAYS - 1):]
+    slot_hours = np.zeros((trip_count, DutyCycle.DAYS))
+    slot_days = np.full((trip_count, DutyCycle.DAYS), EMPTY_DAY, dtype=np.int64)
+    for day in range(-history.shape[1], 0):
+        slot_hours[:, day % DutyCycle.DAYS] = history[:, day]
+        slot_days[:, day % DutyCycle.DAYS] = day
+
+    def day_of(offset):
+        """Calendar days of hour offsets, as DutyCycle.day"""
+        return np.floor((offset + start_hour) / 24).astype(np.int64)
+
+    def used(index, day):
+        """On-duty hours of the 8 days ending with the given ones"""
+        hours = np.where(slot_days[index] > (day - DutyCycle.DAYS)[:, None], slot_hours[index], 0.0)
+        # Add the slots up in order, as DutyCycle.used does
+        total = hours[:, 0].copy()
+        for slot in range(1, DutyCycle.DAYS):
+            total += hours[:, slot]
+        return total
+
+    def available(index):
+        """Cycle hours left at the current time, as DutyCycle.available"""
+        hours = HOSCalculator.MAX_CYCLE_HOURS - used(index, day_of(current_time[index]))
+        return np.where(hours > CYCLE_TOLERANCE, hours, 0.0)
+
+    def book(index, hours):
+        """Record on-duty hours from the current time, split at midnight"""
+        start = current_time[index]
+        end = start + hours
+        first_day = day_of(start)
+        # No single activity spans more than two days
+        for day in (first_day, first_day + 1):
+            part = np.minimum(end, 24 * (day + 1) - start_hour) - np.maximum(start, 24 * day - start_hour)
+            booked = part > 0
+            trips = index[booked]
+            slot = day[booked] % DutyCycle.DAYS
+            stale = slot_days[trips, slot] != day[booked]
+            slot_hours[trips[stale], slot[stale]] = 0.0
+            slot_days[trips, slot] = day[booked]
+            slot_hours[trips, slot] += part[booked]
+
+    def next_leg(index):
+        """Move trips that finished a leg on to the next one"""
+        leg[index] += 1
+        index = index[leg[index] < leg_count]
+        remaining_distance[index] = distances[index, leg[index]]
+        remaining_duration[index] = durations[index, leg[index]]
+        if handling and leg_count > 1:
+            handling_due[index] = leg[index] == leg_count - 1
+
+    # Duty clocks, one entry per trip
+    current_time = np.zeros(trip_count)
+    available_driving_hours = np.full(trip_count, float(HOSCalculator.MAX_DRIVING_HOURS))
+    available_window_hours = np.full(trip_count, float(HOSCalculator.MAX_DUTY_WINDOW))
+    hours_since_break = np.zeros(trip_count)
+    accumulated_distance = np.zeros(trip_count)
+    last_fuel_distance = np.zeros(trip_count)
+
+    # Position within the trip
+    leg = np.zeros(trip_count, dtype=np.intp)
+    remaining_distance = distances[:, 0].copy()
+    remaining_duration = durations[:, 0].copy()
+    handling_due = np.full(trip_count, bool(handling))
+
+    rests = np.zeros(trip_count, dtype=np.intp)
+    restarts = np.zeros(trip_count, dtype=np.intp)
+    breaks = np.zeros(trip_count, dtype=np.intp)
+    fuel_stops = np.zeros(trip_count, dtype=np.intp)
+    feasible = ~np.isnan(durations).any(axis=1)
+
+    max_steps = getattr(settings, 'HOS_MAX_STEPS', 100000)
+    steps = 0
+
+    # Trips still driving; each pass of the loop is one step of every trip
+    active = np.flatnonzero(feasible)
+    while active.size:
+        steps += 1
+        if steps > max_steps:
+            raise ScheduleBudgetExceeded(f"HOS batch exceeded {max_steps} steps")
+
+        # 30-minute break after 8 hours of driving
+        due = active[hours_since_break[active] >= HOSCalculator.MAX_DRIVING_WITHOUT_BREAK]
+        current_time[due] += HOSCalculator.MIN_BREAK_DURATION
+        hours_since_break[due] = 0
+        available_window_hours[due] -= HOSCalculator.MIN_BREAK_DURATION
+        breaks[due] += 1
+
+        # Fuel every FUELING_INTERVAL_MILES
+        due = active[accumulated_distance[active] - last_fuel_distance[active] >= HOSCalculator.FUELING_INTERVAL_MILES]
+        book(due, HOSCalculator.FUELING_DURATION)
+        current_time[due] += HOSCalculator.FUELING_DURATION
+        available_window_hours[due] -= HOSCalculator.FUELING_DURATION
+        last_fuel_distance[due] = accumulated_distance[due]
+        fuel_stops[due] += 1
+
+        # Pickup or dropoff
+        due = active[handling_due[active]]
+        book(due, HOSCalculator.PICKUP_DROPOFF_DURATION)
+        current_time[due] += HOSCalculator.PICKUP_DROPOFF_DURATION
+        available_window_hours[due] -= HOSCalculator.PICKUP_DROPOFF_DURATION
+        handling_due[due] = False
+
+        # Legs with nothing to drive end on the spot
+        empty = remaining_duration[active] <= 0
+        if empty.any():
+            next_leg(active[empty])
+            active = active[~empty]
+
+        # The drive ends at whichever limit comes first
+        driving_time = np.minimum.reduce([
+            available_driving_hours[active],
+            available_window_hours[active],
+            remaining_duration[active],
+            HOSCalculator.MAX_DRIVING_WITHOUT_BREAK - hours_since_break[active],
+            available(active)
+        ])
+
+        # Trips out of hours go off duty
+        resting = driving_time <= 0
+        if resting.any():
+            stuck = active[resting]
+            rest_duration = np.full(len(stuck), float(HOSCalculator.MIN_REST_DURATION))
+            restarted = np.zeros(len(stuck), dtype=bool)
+            spent = available(stuck) <= 0
+            if spent.any():
+                # Wait for hours to roll off, or restart the cycle if sooner
+                waiting = stuck[spent]
+                day = day_of(current_time[waiting])
+                recovery_day = day + DutyCycle.DAYS
+                for later in range(DutyCycle.DAYS, 0, -1):
+                    recovered = HOSCalculator.MAX_CYCLE_HOURS - used(waiting, day + later) > CYCLE_TOLERANCE
+                    recovery_day[recovered] = day[recovered] + later
+                wait = np.maximum(HOSCalculator.MIN_REST_DURATION, 24 * recovery_day - start_hour - current_time[waiting])
+                if allow_restart:
+                    restart = HOSCalculator.RESTART_DURATION < wait
+                    wait[restart] = HOSCalculator.RESTART_DURATION
+                    slot_hours[waiting[restart]] = 0.0
+                    slot_days[waiting[restart]] = EMPTY_DAY
+                    restarted[np.flatnonzero(spent)[restart]] = True
+                rest_duration[spent] = wait
+            rests[stuck[~restarted]] += 1
+            restarts[stuck[restarted]] += 1
+            current_time[stuck] += rest_duration
+            available_driving_hours[stuck] = HOSCalculator.MAX_DRIVING_HOURS
+            available_window_hours[stuck] = HOSCalculator.MAX_DUTY_WINDOW
+            hours_since_break[stuck] = 0
+            driving = active[~resting]
+            driving_time = driving_time[~resting]
+        else:
+            driving = active
+
+        segment_progress = driving_time / remaining_duration[driving]
+        distance_covered = remaining_distance[driving] * segment_progress
+        accumulated_distance[driving] += distance_covered
+
+        # Drives that end part-way through their leg
+        partial = segment_progress < 1
+        index = driving[partial]
+        hours = driving_time[partial]
+        remaining_distance[index] -= distance_covered[partial]
+        remaining_duration[index] -= hours
+        book(index, hours)
+        current_time[index] += hours
+        available_driving_hours[index] -= hours
+        available_window_hours[index] -= hours
+        hours_since_break[index] += hours
+
+        # Drives that finish their leg
+        index = driving[~partial]
+        hours = remaining_duration[index]
+        book(index, hours)
+        current_time[index] += hours
+        available_driving_hours[index] -= hours
+        available_window_hours[index] -= hours
+        hours_since_break[index] += hours
+        next_leg(index)
+
+        active = np.flatnonzero(feasible & (leg < leg_count))
+
+    # Start, end, pickup and dropoff count as stops too
+    handled = min(leg_count, 2) if handling else 0
+    result = {
+        'eta_hours': np.where(feasible, current_time, np.nan),
+        'stops': rests + restarts + breaks + fuel_stops + 2 + handled,
+        'rests': rests,
+        'restarts': restarts,
+        'breaks': breaks,
+        'fuel_stops': fuel_stops,
+        'remaining_cycle_hours': available(np.arange(trip_count)),
+        'feasible': feasible
+    }
+
+    if len(schedules):
+        if locations is None:
+            raise ValueError('locations are needed to build schedules')
+        result['schedules'] = {
+            int(trip): (
+                HOSCalculator(
+                    [float(hours) for hours in history[trip]] if history.shape[1] > 1 else float(history[trip, 0]),
+                    allow_restart=allow_restart,
+                    start_time=start_time
+                ).calculate_schedule(trip_route_data(durations[trip], distances[trip], locations[trip]))
+                if feasible[trip] else None
+            )
+            for trip in schedules
+        }
+
+    return result
+
+
+def trip_route_data(leg_durations, leg_distances, locations):
+    """
+    Build the route data of one trip of a batch
+
+    Args:
+        leg_durations: Driving hours of each leg
+        leg_distances: Distance of each leg in miles
+        locations: lat/lng of each leg end, starting at the origin
+
+    Returns:
+        Route information dictionary without geometry, as build_schedule
+        takes it
+    """
+    points = [
+        {'address': f"Location {index}", 'lat': float(lat), 'lng': float(lng)}
+        for index, (lat, lng) in enumerate(locations)
+    ]
+    segments = [
+        {
+            'start_location': points[index],
+            'end_location': points[index + 1],
+            'distance': float(distance),
+            'duration': float(duration)
+        }
+        for index, (duration, distance) in enumerate(zip(leg_durations, leg_distances))
+    ]
+    return {
+        'locations': points,
+        'segments': segments,
+        'total_distance': sum(segment['distance'] for segment in segments),
+        'total_duration': sum(segment['duration'] for segment in segments)
+    }
@@ -5,12 +5,137 @@ This module implements the HOS regulations for property-carrying drivers:
 - 11-hour driving limit after 10 consecutive hours off duty
 - 14-hour "driving window" limit
 - 30-minute break after 8 hours of driving
-- 70-hour/8-day limit
+- 70-hour/8-day limit, rolling day by day, with an optional 34-hour restart
 """
 
 import datetime
 import math
-from copy import deepcopy
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .geometry import point_at_distance, points_at_distances
+from .poi_index import FUEL_KINDS, REST_KINDS, get_poi_index
+from .schedule import Schedule
+
+
+# Slack when checking whether a planned stop has been reached, in miles
+DISTANCE_TOLERANCE = 1e-6
+
+# Below this many points, interpolating one at a time beats a NumPy call
+VECTORIZE_MIN_POINTS = 4
+
+# Scheduler steps between checks of the time budget
+BUDGET_CHECK_INTERVAL = 1024
+
+# Cycle hours too few to advance the clock count as spent, in hours
+CYCLE_TOLERANCE = 1e-9
+
+# Hours and miles a run of jumped duty days keeps clear of every limit, so
+# that float rounding cannot change a decision the loop would make
+DAY_JUMP_MARGIN = 1e-6
+
+# Fewest duty days worth jumping; shorter runs cost more to set up than
+# stepping through them
+DAY_JUMP_MIN_DAYS = 2
+
+
+class ScheduleBudgetExceeded(Exception):
+    """Raised when a schedule takes more steps or time than allowed"""
+
+
+def hours_past_midnight(moment):
+    """Return the hours from midnight to a datetime"""
+    midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return (moment - midnight).total_seconds() / 3600
+
+
+class DutyCycle:
+    """
+    On-duty hours of the last 8 days, for the rolling 70-hour/8-day limit
+    
+    A ring buffer with one slot per day. Days are calendar days, midnight
+    to midnight as on the log sheets, numbered from the day the schedule
+    starts on (day 0); as each day begins, the hours worked 8 days earlier
+    roll off and can be used again.
+    """
+    
+    DAYS = 8
+    
+    __slots__ = ('limit', 'start_hour', 'hours', 'days')
+    
+    def __init__(self, limit, current_cycle_hours=0, start_hour=0):
+        """
+        Args:
+            limit: Maximum on-duty hours in any 8 days
+            current_cycle_hours: Hours already used; either a total, taken
+                as worked the day before the start (so none roll off early),
+                or the hours of each previous day, oldest first
+            start_hour: Hours past midnight at the schedule start (offset 0)
+        """
+        self.limit = limit
+        self.start_hour = start_hour
+        self.hours = [0.0] * self.DAYS
+        self.days = [None] * self.DAYS  # Day each slot holds, None if empty
+        history = current_cycle_hours if isinstance(current_cycle_hours, (list, tuple)) else [current_cycle_hours]
+        for day, hours in enumerate(history[-(self.DAYS - 1):], -min(len(history), self.DAYS - 1)):
+            self.hours[day % self.DAYS] = float(hours)
+            self.days[day % self.DAYS] = day
+    
+    def day(self, offset):
+        """Return the day an hour offset falls on"""
+        return math.floor((offset + self.start_hour) / 24)
+    
+    def midnight(self, day):
+        """Return the hour offset at which a day begins"""
+        return 24 * day - self.start_hour
+    
+    def used(self, day):
+        """Return the on-duty hours of the 8 days ending with the given one"""
+        used = 0.0
+        for hours, slot_day in zip(self.hours, self.days):
+            if slot_day is not None and slot_day > day - self.DAYS:
+                used += hours
+        return used
+    
+    def available(self, offset):
+        """Return the on-duty hours left at an hour offset"""
+        hours = self.limit - self.used(self.day(offset))
+        return hours if hours > CYCLE_TOLERANCE else 0.0
+    
+    def book(self, start, hours):
+        """Record on-duty hours starting at an offset, split at day boundaries"""
+        end = start + hours
+        for day in range(self.day(start), self.day(end) + 1):
+            part = min(end, self.midnight(day + 1)) - max(start, self.midnight(day))
+            if part <= 0:
+                continue
+            slot = day % self.DAYS
+            if self.days[slot] != day:
+                self.hours[slot] = 0.0
+                self.days[slot] = day
+            self.hours[slot] += part
+    
+    def recovery_time(self, offset):
+        """Return the offset at which hours next become available again"""
+        day = self.day(offset)
+        for later in range(day + 1, day + self.DAYS + 1):
+            if self.limit - self.used(later) > CYCLE_TOLERANCE:
+                return self.midnight(later)
+        return self.midnight(day + self.DAYS)
+    
+    def copy(self):
+        """Return an independent copy of the record"""
+        cycle = DutyCycle(self.limit, start_hour=self.start_hour)
+        cycle.hours = list(self.hours)
+        cycle.days = list(self.days)
+        return cycle
+    
+    def restart(self):
+        """Forget all hours worked, after a 34-hour restart"""
+        self.hours = [0.0] * self.DAYS
+        self.days = [None] * self.DAYS
 
 
 class HOSCalculator:
@@ -26,6 +151,7 @@ class HOSCalculator:
     
     # 70-hour/8-day rule constants
     MAX_CYCLE_HOURS = 70  # Maximum on-duty hours in 8-day period
+    RESTART_DURATION = 34  # Off-duty hours that restart the 8-day period
     
     # Average truck speed in mph for estimation
     AVG_TRUCK_SPEED = 55
@@ -33,10 +159,37 @@ class HOSCalculator:
     # Fueling constants
     FUELING_INTERVAL_MILES = 1000  # Fuel every 1000 miles
     FUELING_DURATION = 0.5  # 30 minutes for fueling
+    FUEL_STOP_CORRIDOR_MILES = 3  # Max detour from the route to a fuel station
+    
+    # Rest placement constants
+    REST_AREA_CORRIDOR_MILES = 1  # Max detour from the route to a rest area or truck parking
+    REST_AREA_SEARCH_HOURS = 2  # Rest up to this much driving early to reach legal parking
     
-    def __init__(self, current_cycle_hours=0):
-        """Initialize calculator with current cycle hours used"""
+    def __init__(self, current_cycle_hours=0, poi_index=None, allow_restart=False, sleeper_berth=False,
+                 start_time=None):
+        """
+        Initialize calculator with current cycle hours used
+        
+        Args:
+            current_cycle_hours: Hours used in the 70-hour/8-day cycle, as
+                a total or per previous day (see DutyCycle)
+            poi_index: Optional POIIndex; when given, fuel stops and
+                10-hour rests are placed at real facilities near the route
+            allow_restart: Whether the driver may take a 34-hour restart
+                when the cycle runs out, rather than waiting for hours to
+                roll off
+            sleeper_berth: Whether 10-hour rests may be split into
+                sleeper berth periods to deliver sooner
+            start_time: Datetime the schedule starts at; the current hour
+                if None
+        """
         self.current_cycle_hours = current_cycle_hours
+        self.poi_index = poi_index
+        self.allow_restart = allow_restart
+        self.sleeper_berth = sleeper_berth
+        self.start_time = start_time
+        self.max_steps = getattr(settings, 'HOS_MAX_STEPS', 100000)
+        self.time_budget = getattr(settings, 'HOS_TIME_BUDGET', 2)
         self.current_driving_hours = 0
         self.current_window_hours = 0
         self.current_driving_without_break = 0
@@ -45,49 +198,84 @@ class HOSCalculator:
         """
         Calculate an HOS-compliant schedule for the given route
         
+        Args:
+            route_data: Dictionary containing route information (see
+                build_schedule)
+                
+        Returns:
+            Dictionary with schedule information including stops and segments
+        """
+        return self.build_schedule(route_data).as_dict(route_data)
+    
+    def build_schedule(self, route_data, jump_days=True):
+        """
+        Build an HOS-compliant schedule for the given route
+        
+        route_data is read-only: the schedule refers to its location
+        dictionaries, but nothing in it is copied or modified.
+        
+        Runs of full duty days in the middle of a long segment (drive,
+        break, drive, 10-hour rest, with no fuel stop, cycle limit or
+        POI facility in the way) are worked out arithmetically and
+        emitted in one pass rather than stepped through limit by limit.
+        
         Args:
             route_data: Dictionary containing route information
                 - segments: List of route segments with distance and duration
                 - total_distance: Total route distance in miles
                 - total_duration: Total route duration in hours
+                - geometry: Optional (n, 2) array of route coordinates
+                - cumulative_distances: Optional distance along the route
+                  at each coordinate, used to place stops
+            jump_days: Whether to jump runs of full duty days; False steps
+                through every limit (gives the same stops, with times
+                equal to well within a second)
                 
         Returns:
-            Dictionary with schedule information including stops and segments
+            Schedule with stops and segments
+            
+        Raises:
+            ScheduleBudgetExceeded: If the schedule takes more than
+                settings.HOS_MAX_STEPS steps or HOS_TIME_BUDGET seconds
         """
-        # Deep copy to avoid modifying original
-        result = deepcopy(route_data)
+        if self.sleeper_berth:
+            # Split rests are searched for by a separate planner
+            from .sleeper_berth import SleeperBerthPlanner
+            return SleeperBerthPlanner(self).plan(route_data)
         
         # Initialize schedule
-        start_time = datetime.datetime.now().replace(
-            minute=0, second=0, microsecond=0
-        )
-        current_time = start_time
+        schedule = Schedule(self.schedule_start(), route_data['locations'])
+        current_time = 0  # Hours since start_time
         available_driving_hours = self.MAX_DRIVING_HOURS
         available_window_hours = self.MAX_DUTY_WINDOW
         hours_since_break = 0
         
-        stops = []
-        modified_segments = []
-        remaining_cycle_hours = self.MAX_CYCLE_HOURS - self.current_cycle_hours
+        cycle = self.duty_cycle(schedule.start_time)
+        deadline = time.monotonic() + self.time_budget
+        steps = 0
         
         # Add starting point
-        stops.append({
-            'location': route_data['locations'][0],
-            'arrival_time': current_time,
-            'departure_time': current_time,
-            'stop_type': 'start',
-            'duration': 0
-        })
+        schedule.add_stop(route_data['locations'][0], 'start', current_time)
         
         # Process each segment
         accumulated_distance = 0
         last_fuel_distance = 0
+        fuel_corridor = self._corridor(route_data, FUEL_KINDS, self.FUEL_STOP_CORRIDOR_MILES)
+        fuel_station = self._plan_fuel_station(fuel_corridor, last_fuel_distance)
+        rest_corridor = self._corridor(route_data, REST_KINDS, self.REST_AREA_CORRIDOR_MILES)
+        average_speed = (
+            route_data['total_distance'] / route_data['total_duration']
+            if rest_corridor is not None and route_data.get('total_duration') else 0
+        )
+        rest_area = None
         segment_index = 0
         total_segments = len(route_data['segments'])
         
         while segment_index < total_segments:
             segment = route_data['segments'][segment_index]
-            remaining_segment = deepcopy(segment)
+            # Only the distance and duration left to drive change
+            remaining_distance = segment['distance']
+            remaining_duration = segment['duration']
             segment_processed = False
             
             # Check if this is a pickup or dropoff point
@@ -109,85 +297,131 @@ class HOSCalculator:
             
             # Process segment with HOS compliance
             while not segment_processed:
+                steps += 1
+                self.check_budget(steps, deadline)
+                
+                # Take the 10-hour rest on reaching the planned rest area
+                if rest_area is not None and accumulated_distance >= rest_area['distance'] - DISTANCE_TOLERANCE:
+                    current_location = rest_area['location']
+                    stop_type, rest_duration = self.take_off_duty(cycle, current_time)
+                    schedule.add_stop(current_location, stop_type, current_time, rest_duration)
+                    
+                    current_time += rest_duration
+                    available_driving_hours = self.MAX_DRIVING_HOURS
+                    available_window_hours = self.MAX_DUTY_WINDOW
+                    hours_since_break = 0
+                    rest_area = None
+                    continue
+                
                 # Check if we need a mandatory break due to 8-hour rule
                 if hours_since_break >= self.MAX_DRIVING_WITHOUT_BREAK:
                     # Add a 30-minute break
-                    stops.append({
-                        'location': current_location,
-                        'arrival_time': current_time,
-                        'departure_time': current_time + datetime.timedelta(hours=self.MIN_BREAK_DURATION),
-                        'stop_type': 'break',
-                        'duration': self.MIN_BREAK_DURATION
-                    })
+                    schedule.add_stop(current_location, 'break', current_time, self.MIN_BREAK_DURATION)
                     
-                    current_time += datetime.timedelta(hours=self.MIN_BREAK_DURATION)
+                    current_time += self.MIN_BREAK_DURATION
                     hours_since_break = 0
                     available_window_hours -= self.MIN_BREAK_DURATION
                 
                 # Check if we need a fueling stop
-                distance_since_last_fuel = accumulated_distance - last_fuel_distance
-                if distance_since_last_fuel >= self.FUELING_INTERVAL_MILES:
-                    stops.append({
-                        'location': current_location,
-                        'arrival_time': current_time,
-                        'departure_time': current_time + datetime.timedelta(hours=self.FUELING_DURATION),
-                        'stop_type': 'fuel',
-                        'duration': self.FUELING_DURATION
-                    })
+                if fuel_station is not None:
+                    fuel_due = accumulated_distance >= fuel_station['distance'] - DISTANCE_TOLERANCE
+                else:
+                    distance_since_last_fuel = accumulated_distance - last_fuel_distance
+                    fuel_due = distance_since_last_fuel >= self.FUELING_INTERVAL_MILES
+                if fuel_due:
+                    if fuel_station is not None:
+                        current_location = fuel_station['location']
+                    schedule.add_stop(current_location, 'fuel', current_time, self.FUELING_DURATION)
                     
-                    current_time += datetime.timedelta(hours=self.FUELING_DURATION)
+                    cycle.book(current_time, self.FUELING_DURATION)
+                    current_time += self.FUELING_DURATION
                     available_window_hours -= self.FUELING_DURATION
                     last_fuel_distance = accumulated_distance
+                    fuel_station = self._plan_fuel_station(fuel_corridor, last_fuel_distance)
                 
                 # Handle pickup/dropoff activities
                 if is_pickup:
-                    stops.append({
-                        'location': next_location,
-                        'arrival_time': current_time,
-                        'departure_time': current_time + datetime.timedelta(hours=self.PICKUP_DROPOFF_DURATION),
-                        'stop_type': 'pickup',
-                        'duration': self.PICKUP_DROPOFF_DURATION
-                    })
+                    schedule.add_stop(next_location, 'pickup', current_time, self.PICKUP_DROPOFF_DURATION)
                     
-                    current_time += datetime.timedelta(hours=self.PICKUP_DROPOFF_DURATION)
+                    cycle.book(current_time, self.PICKUP_DROPOFF_DURATION)
+                    current_time += self.PICKUP_DROPOFF_DURATION
                     available_window_hours -= self.PICKUP_DROPOFF_DURATION
-                    remaining_cycle_hours -= self.PICKUP_DROPOFF_DURATION
                     is_pickup = False
                 
                 if is_dropoff:
-                    stops.append({
-                        'location': next_location,
-                        'arrival_time': current_time,
-                        'departure_time': current_time + datetime.timedelta(hours=self.PICKUP_DROPOFF_DURATION),
-                        'stop_type': 'dropoff',
-                        'duration': self.PICKUP_DROPOFF_DURATION
-                    })
+                    schedule.add_stop(next_location, 'dropoff', current_time, self.PICKUP_DROPOFF_DURATION)
                     
-                    current_time += datetime.timedelta(hours=self.PICKUP_DROPOFF_DURATION)
+                    cycle.book(current_time, self.PICKUP_DROPOFF_DURATION)
+                    current_time += self.PICKUP_DROPOFF_DURATION
                     available_window_hours -= self.PICKUP_DROPOFF_DURATION
-                    remaining_cycle_hours -= self.PICKUP_DROPOFF_DURATION
                     is_dropoff = False
                 
+                # Nothing to drive on this segment (e.g. already at pickup)
+                if remaining_duration <= 0:
+                    segment_processed = True
+                    segment_index += 1
+                    continue
+                
+                # Jump a run of full duty days from the start of one
+                if jump_days and fuel_corridor is None and rest_corridor is None \
+                        and remaining_duration > DAY_JUMP_MIN_DAYS * self.MAX_DRIVING_HOURS \
+                        and available_driving_hours == self.MAX_DRIVING_HOURS \
+                        and available_window_hours == self.MAX_DUTY_WINDOW and hours_since_break == 0:
+                    days, end_time, current_location, last_fuel_distance = self._jump_duty_days(
+                        schedule,
+                        cycle,
+                        route_data,
+                        segment_index,
+                        current_time,
+                        current_location,
+                        next_location,
+                        accumulated_distance,
+                        last_fuel_distance,
+                        remaining_distance,
+                        remaining_duration
+                    )
+                    if days:
+                        driven_hours = days * self.MAX_DRIVING_HOURS
+                        distance_covered = remaining_distance * (driven_hours / remaining_duration)
+                        accumulated_distance += distance_covered
+                        remaining_distance -= distance_covered
+                        remaining_duration -= driven_hours
+                        current_time = end_time
+                        continue
+                
+                # Pick the rest area for the next 10-hour rest
+                rest_area = self._plan_rest_area(
+                    rest_corridor,
+                    accumulated_distance,
+                    min(available_driving_hours, available_window_hours),
+                    average_speed,
+                    route_data['total_distance']
+                )
+                
                 # Determine how much of the segment we can drive
                 max_driving_time = min(
                     available_driving_hours,
                     available_window_hours,
-                    remaining_segment['duration'],
+                    remaining_duration,
                     self.MAX_DRIVING_WITHOUT_BREAK - hours_since_break,
-                    remaining_cycle_hours
+                    cycle.available(current_time)
                 )
+                if remaining_distance > 0:
+                    # Stop driving at a planned station or rest area
+                    speed = remaining_distance / remaining_duration
+                    for planned_stop in (fuel_station, rest_area):
+                        if planned_stop is not None:
+                            max_driving_time = min(
+                                max_driving_time,
+                                (planned_stop['distance'] - accumulated_distance) / speed
+                            )
                 
                 if max_driving_time <= 0:
                     # Need to take a rest period
-                    stops.append({
-                        'location': current_location,
-                        'arrival_time': current_time,
-                        'departure_time': current_time + datetime.timedelta(hours=self.MIN_REST_DURATION),
-                        'stop_type': 'rest',
-                        'duration': self.MIN_REST_DURATION
-                    })
+                    stop_type, rest_duration = self.take_off_duty(cycle, current_time)
+                    schedule.add_stop(current_location, stop_type, current_time, rest_duration)
                     
-                    current_time += datetime.timedelta(hours=self.MIN_REST_DURATION)
+                    current_time += rest_duration
                     available_driving_hours = self.MAX_DRIVING_HOURS
                     available_window_hours = self.MAX_DUTY_WINDOW
                     hours_since_break = 0
@@ -196,8 +430,8 @@ class HOSCalculator:
                     continue
                 
                 # Calculate how much distance we can cover
-                segment_progress = max_driving_time / remaining_segment['duration']
-                distance_covered = remaining_segment['distance'] * segment_progress
+                segment_progress = max_driving_time / remaining_duration
+                distance_covered = remaining_distance * segment_progress
                 
                 # Update our position
                 accumulated_distance += distance_covered
@@ -205,53 +439,55 @@ class HOSCalculator:
                 # Create a partial segment if needed
                 if segment_progress < 1:
                     # We're splitting the segment
-                    partial_segment = {
-                        'start_location': current_location,
-                        'end_location': {
-                            'address': f"Intermediate point {segment_index}",
-                            'lat': (current_location['lat'] + next_location['lat']) / 2,
-                            'lng': (current_location['lng'] + next_location['lng']) / 2
-                        },
-                        'distance': distance_covered,
-                        'duration': max_driving_time,
-                        'start_time': current_time,
-                        'end_time': current_time + datetime.timedelta(hours=max_driving_time)
-                    }
-                    
-                    modified_segments.append(partial_segment)
+                    if fuel_station is not None and accumulated_distance >= fuel_station['distance'] - DISTANCE_TOLERANCE:
+                        end_location = fuel_station['location']
+                    elif rest_area is not None and accumulated_distance >= rest_area['distance'] - DISTANCE_TOLERANCE:
+                        end_location = rest_area['location']
+                    else:
+                        end_location = self._route_position(
+                            route_data,
+                            accumulated_distance,
+                            f"Intermediate point {segment_index}",
+                            current_location,
+                            next_location
+                        )
+                    schedule.add_segment(
+                        current_location,
+                        end_location,
+                        distance_covered,
+                        max_driving_time,
+                        current_time
+                    )
                     
                     # Update current location
-                    current_location = partial_segment['end_location']
+                    current_location = end_location
                     
                     # Update remaining segment
-                    remaining_segment['distance'] -= distance_covered
-                    remaining_segment['duration'] -= max_driving_time
+                    remaining_distance -= distance_covered
+                    remaining_duration -= max_driving_time
                     
                     # Update times
-                    current_time += datetime.timedelta(hours=max_driving_time)
+                    cycle.book(current_time, max_driving_time)
+                    current_time += max_driving_time
                     available_driving_hours -= max_driving_time
                     available_window_hours -= max_driving_time
                     hours_since_break += max_driving_time
-                    remaining_cycle_hours -= max_driving_time
                 else:
                     # We completed the segment
-                    complete_segment = {
-                        'start_location': current_location,
-                        'end_location': next_location,
-                        'distance': remaining_segment['distance'],
-                        'duration': remaining_segment['duration'],
-                        'start_time': current_time,
-                        'end_time': current_time + datetime.timedelta(hours=remaining_segment['duration'])
-                    }
-                    
-                    modified_segments.append(complete_segment)
+                    schedule.add_segment(
+                        current_location,
+                        next_location,
+                        remaining_distance,
+                        remaining_duration,
+                        current_time
+                    )
                     
                     # Update times
-                    current_time += datetime.timedelta(hours=remaining_segment['duration'])
-                    available_driving_hours -= remaining_segment['duration']
-                    available_window_hours -= remaining_segment['duration']
-                    hours_since_break += remaining_segment['duration']
-                    remaining_cycle_hours -= remaining_segment['duration']
+                    cycle.book(current_time, remaining_duration)
+                    current_time += remaining_duration
+                    available_driving_hours -= remaining_duration
+                    available_window_hours -= remaining_duration
+                    hours_since_break += remaining_duration
                     
                     # Mark segment as processed
                     segment_processed = True
@@ -259,33 +495,374 @@ class HOSCalculator:
             
         # Add final stop
         final_location = route_data['locations'][-1]
-        stops.append({
-            'location': final_location,
-            'arrival_time': current_time,
-            'departure_time': current_time,
-            'stop_type': 'end',
-            'duration': 0
-        })
-        
-        # Update result
-        result['stops'] = stops
-        result['segments'] = modified_segments
-        result['start_time'] = start_time
-        result['end_time'] = current_time
-        
-        return result
+        schedule.add_stop(final_location, 'end', current_time)
+        schedule.end = current_time
+        
+        return schedule
+    
+    def _jump_duty_days(self, schedule, cycle, route_data, segment_index, current_time, current_location,
+                        next_location, accumulated_distance, last_fuel_distance, remaining_distance,
+                        remaining_duration):
+        """
+        Add a run of full duty days to a schedule in one pass
+        
+        From the start of a duty day in the middle of a segment, every day
+        is a drive up to the 30-minute break, the break, a drive to the
+        11-hour limit and a 10-hour rest, with a fuel stop after the break
+        or before the rest once the fueling interval has been driven. The
+        days are worked out arithmetically until the segment, the 70-hour
+        cycle or a fuel stop too close to call would end the pattern (the
+        cycle hours left now bound the whole run, as hours only roll off
+        as days pass); the break and rest points of the whole run are
+        then interpolated along the route together.
+        
+        Args:
+            schedule: Schedule to add to
+            cycle: DutyCycle of the schedule, booked with the on-duty time
+            route_data: Dictionary containing route information
+            segment_index: Index of the segment being driven
+            current_time: Hours since the schedule start
+            current_location: Location at the start of the first day
+            next_location: Location where the segment ends
+            accumulated_distance: Road miles driven so far
+            last_fuel_distance: Road miles at the last fill-up
+            remaining_distance: Miles left on the segment
+            remaining_duration: Driving hours left on the segment
+            
+        Returns:
+            (days, end time, location, last fill-up in road miles) at the
+            start of the day after the run; days is 0 if none was added
+        """
+        before_break = self.MAX_DRIVING_WITHOUT_BREAK
+        after_break = self.MAX_DRIVING_HOURS - before_break
+        speed = remaining_distance / remaining_duration
+        # The pattern needs one break a day and at most one fill-up
+        if not 0 < after_break < before_break or speed * self.MAX_DRIVING_HOURS >= self.FUELING_INTERVAL_MILES \
+                or self.MAX_DRIVING_HOURS + self.MIN_BREAK_DURATION + self.FUELING_DURATION > self.MAX_DUTY_WINDOW:
+            return 0, current_time, current_location, last_fuel_distance
+        
+        cycle_left = cycle.available(current_time) - DAY_JUMP_MARGIN
+        fuel_distance = last_fuel_distance
+        day_starts = []
+        fuel_stops = []  # Per day: None, or the stop (1 after the break, 2 before the rest)
+        day_start = current_time
+        while (len(day_starts) + 1) * self.MAX_DRIVING_HOURS <= remaining_duration - DAY_JUMP_MARGIN:
+            driven = len(day_starts) * self.MAX_DRIVING_HOURS
+            stops = (
+                accumulated_distance + speed * (driven + before_break),
+                accumulated_distance + speed * (driven + self.MAX_DRIVING_HOURS)
+            )
+            since_fuel = [distance - fuel_distance - self.FUELING_INTERVAL_MILES for distance in stops]
+            if any(abs(excess) < DAY_JUMP_MARGIN for excess in since_fuel):
+                break
+            fuel_stop = 1 if since_fuel[0] > 0 else 2 if since_fuel[1] > 0 else None
+            on_duty = self.MAX_DRIVING_HOURS + (self.FUELING_DURATION if fuel_stop else 0)
+            if on_duty > cycle_left:
+                break
+            cycle_left -= on_duty
+            if fuel_stop:
+                fuel_distance = stops[fuel_stop - 1]
+            day_starts.append(day_start)
+            fuel_stops.append(fuel_stop)
+            day_start += on_duty + self.MIN_BREAK_DURATION + self.MIN_REST_DURATION
+        
+        if len(day_starts) < DAY_JUMP_MIN_DAYS:
+            return 0, current_time, current_location, last_fuel_distance
+        
+        # Break and rest points of every day, in driving order
+        driven = [
+            day * self.MAX_DRIVING_HOURS + hours
+            for day in range(len(day_starts))
+            for hours in (before_break, self.MAX_DRIVING_HOURS)
+        ]
+        points = [
+            (accumulated_distance + speed * hours, segment_index,
+             current_location if number == 0 else number - 1, next_location)
+            for number, hours in enumerate(driven)
+        ]
+        locations = self.route_positions(route_data, points)
+        
+        location = current_location
+        for day, (start, fuel_stop) in enumerate(zip(day_starts, fuel_stops)):
+            break_location, rest_location = locations[2 * day], locations[2 * day + 1]
+            
+            schedule.add_segment(location, break_location, speed * before_break, before_break, start)
+            cycle.book(start, before_break)
+            start += before_break
+            schedule.add_stop(break_location, 'break', start, self.MIN_BREAK_DURATION)
+            start += self.MIN_BREAK_DURATION
+            if fuel_stop == 1:
+                schedule.add_stop(break_location, 'fuel', start, self.FUELING_DURATION)
+                cycle.book(start, self.FUELING_DURATION)
+                start += self.FUELING_DURATION
+            
+            schedule.add_segment(break_location, rest_location, speed * after_break, after_break, start)
+            cycle.book(start, after_break)
+            start += after_break
+            if fuel_stop == 2:
+                schedule.add_stop(rest_location, 'fuel', start, self.FUELING_DURATION)
+                cycle.book(start, self.FUELING_DURATION)
+                start += self.FUELING_DURATION
+            schedule.add_stop(rest_location, 'rest', start, self.MIN_REST_DURATION)
+            location = rest_location
+        
+        return len(day_starts), day_start, location, fuel_distance
+    
+    def schedule_start(self):
+        """Return the start of the schedule: start_time, or else the current hour"""
+        if self.start_time is not None:
+            return self.start_time
+        return datetime.datetime.now().replace(
+            minute=0, second=0, microsecond=0
+        )
+    
+    def duty_cycle(self, start_time):
+        """Return the driver's 70-hour/8-day record for a schedule starting at start_time"""
+        return DutyCycle(self.MAX_CYCLE_HOURS, self.current_cycle_hours, hours_past_midnight(start_time))
+    
+    def check_budget(self, steps, deadline):
+        """Stop a schedule that has run over its step or time budget"""
+        if steps > self.max_steps:
+            raise ScheduleBudgetExceeded(f"HOS schedule exceeded {self.max_steps} steps")
+        if steps % BUDGET_CHECK_INTERVAL == 0 and time.monotonic() > deadline:
+            raise ScheduleBudgetExceeded(f"HOS schedule exceeded its {self.time_budget}s time budget")
+    
+    def take_off_duty(self, cycle, current_time):
+        """
+        Choose the off-duty period to take when no more driving is allowed
+        
+        Args:
+            cycle: DutyCycle of the schedule; cleared on a restart
+            current_time: Hours since the schedule start
+            
+        Returns:
+            (stop_type, duration): a 10-hour 'rest' while the 70-hour cycle
+            has hours left; once it is spent, a 'rest' lasting until hours
+            roll off, or a 34-hour 'restart' if allowed and sooner
+        """
+        if cycle.available(current_time) > 0:
+            return 'rest', self.MIN_REST_DURATION
+        
+        wait = max(self.MIN_REST_DURATION, cycle.recovery_time(current_time) - current_time)
+        if self.allow_restart and self.RESTART_DURATION < wait:
+            cycle.restart()
+            return 'restart', self.RESTART_DURATION
+        return 'rest', wait
+    
+    def route_positions(self, route_data, points):
+        """
+        Locate many intermediate points of a schedule at once
+        
+        Args:
+            route_data: Dictionary containing route information
+            points: List of (accumulated distance, segment index, start
+                location, segment end location); a start location may be
+                the index of an earlier point
+                
+        Returns:
+            List of location dictionaries, one per point, as
+            _route_position would give them
+        """
+        geometry = route_data.get('geometry')
+        cumulative = route_data.get('cumulative_distances')
+        
+        if geometry is None or cumulative is None or len(geometry) < 2 or not route_data.get('total_distance'):
+            # No route geometry, fall back to straight-line midpoints
+            locations = []
+            for _, segment_index, start_location, end_location in points:
+                if isinstance(start_location, int):
+                    start_location = locations[start_location]
+                locations.append(self._route_position(
+                    route_data, None, f"Intermediate point {segment_index}", start_location, end_location
+                ))
+            return locations
+        
+        # Road distance and polyline length differ slightly; scale between them
+        scale = cumulative[-1] / route_data['total_distance']
+        if len(points) < VECTORIZE_MIN_POINTS:
+            coordinates = [point_at_distance(geometry, cumulative, point[0] * scale) for point in points]
+        else:
+            coordinates = points_at_distances(
+                geometry,
+                cumulative,
+                np.array([point[0] for point in points]) * scale
+            )
+        return [
+            {
+                'address': f"Intermediate point {segment_index}",
+                'lat': float(lat),
+                'lng': float(lng)
+            }
+            for (_, segment_index, _, _), (lat, lng) in zip(points, coordinates)
+        ]
+    
+    def _corridor(self, route_data, kinds, radius_miles):
+        """
+        Find the POIs of some kinds near the route
+        
+        Args:
+            route_data: Dictionary containing route information
+            kinds: POI kinds to include
+            radius_miles: Maximum distance from the route
+            
+        Returns:
+            Corridor with distances along the route in road miles, or None
+            without a POI index or route geometry
+        """
+        geometry = route_data.get('geometry')
+        cumulative = route_data.get('cumulative_distances')
+        
+        if self.poi_index is None or geometry is None or cumulative is None or len(geometry) < 2 \
+                or not cumulative[-1] or not route_data.get('total_distance'):
+            return None
+        
+        # Report positions in road miles, the unit the schedule counts in
+        road_distances = cumulative * (route_data['total_distance'] / cumulative[-1])
+        return self.poi_index.corridor(geometry, road_distances, radius_miles, kinds)
+    
+    def _plan_fuel_station(self, corridor, last_fuel_distance):
+        """
+        Pick the station for the next fuel stop
+        
+        The furthest station within FUELING_INTERVAL_MILES of the last
+        fill-up is chosen; if there is none, the first one after it.
+        
+        Args:
+            corridor: Corridor of fuel stations, or None
+            last_fuel_distance: Road miles at the last fill-up
+            
+        Returns:
+            Dictionary with distance (road miles) and location, or None to
+            fuel wherever the truck is once the interval is driven
+        """
+        if corridor is None:
+            return None
+        
+        target = last_fuel_distance + self.FUELING_INTERVAL_MILES
+        station = corridor.last_before(target, after=last_fuel_distance + DISTANCE_TOLERANCE)
+        if station is None:
+            station = corridor.first_after(target)
+        if station is None:
+            return None
+        
+        return self._planned_stop(station)
+    
+    def _plan_rest_area(self, corridor, accumulated_distance, hours_to_rest, speed, total_distance):
+        """
+        Pick the rest area for the next 10-hour rest
+        
+        Candidates are the rest areas and truck parking in the corridor
+        window covering the last REST_AREA_SEARCH_HOURS of driving before
+        the limits run out; the latest one in the window is chosen.
+        
+        Args:
+            corridor: Corridor of rest areas and truck parking, or None
+            accumulated_distance: Road miles driven so far
+            hours_to_rest: Driving hours left before a 10-hour rest
+            speed: Expected average speed in mph
+            total_distance: Road miles of the whole route
+            
+        Returns:
+            Dictionary with distance (road miles) and location, or None to
+            rest wherever the truck is when the limits run out
+        """
+        if corridor is None or not speed:
+            return None
+        
+        reachable = accumulated_distance + hours_to_rest * speed
+        if reachable >= total_distance:
+            # The trip ends before the limits run out
+            return None
+        
+        earliest = max(
+            accumulated_distance,
+            reachable - self.REST_AREA_SEARCH_HOURS * speed
+        )
+        rest_area = corridor.last_before(reachable, after=earliest)
+        if rest_area is None:
+            return None
+        return self._planned_stop(rest_area)
+    
+    @staticmethod
+    def _planned_stop(poi):
+        """Build a planned stop at a corridor POI"""
+        return {
+            'distance': poi['distance'],
+            'location': {
+                'address': poi['name'],
+                'lat': poi['lat'],
+                'lng': poi['lng'],
+                'kind': poi['kind']
+            }
+        }
+
+    @staticmethod
+    def _route_position(route_data, distance, address, current_location, next_location):
+        """
+        Get the location reached after driving a distance along the route
+        
+        Args:
+            route_data: Dictionary containing route information
+            distance: Miles driven from the start of the route
+            address: Label for the location
+            current_location: Location where the current drive started
+            next_location: Location where the current segment ends
+            
+        Returns:
+            Location dictionary with address, lat and lng
+        """
+        geometry = route_data.get('geometry')
+        cumulative = route_data.get('cumulative_distances')
+        
+        if geometry is None or cumulative is None or len(geometry) < 2 or not route_data.get('total_distance'):
+            # No route geometry, fall back to the straight-line midpoint
+            return {
+                'address': address,
+                'lat': (current_location['lat'] + next_location['lat']) / 2,
+                'lng': (current_location['lng'] + next_location['lng']) / 2
+            }
+        
+        # Road distance and polyline length differ slightly; scale between them
+        scale = cumulative[-1] / route_data['total_distance']
+        lat, lng = point_at_distance(geometry, cumulative, distance * scale)
+        return {
+            'address': address,
+            'lat': lat,
+            'lng': lng
+        }
 
 
-def calculate_hos_compliant_schedule(route_data, current_cycle_hours=0):
+def calculate_hos_compliant_schedule(route_data, current_cycle_hours=0, allow_restart=False, sleeper_berth=False):
     """
     Calculate an HOS-compliant schedule for the given route
     
     Args:
         route_data: Dictionary containing route information
-        current_cycle_hours: Current hours used in the 70-hour/8-day cycle
+        current_cycle_hours: Current hours used in the 70-hour/8-day cycle,
+            as a total or per previous day
+        allow_restart: Whether a 34-hour restart may reset the cycle
+        sleeper_berth: Whether to search for faster split sleeper berth rests
         
     Returns:
         Dictionary with schedule information
     """
-    calculator = HOSCalculator(current_cycle_hours)
+    calculator = HOSCalculator(current_cycle_hours, get_poi_index(), allow_restart, sleeper_berth)
     return calculator.calculate_schedule(route_data)
+
+
+def build_hos_schedule(route_data, current_cycle_hours=0, allow_restart=False, sleeper_berth=False):
+    """
+    Build an HOS-compliant schedule in its compact form
+    
+    Args:
+        route_data: Dictionary containing route information
+        current_cycle_hours: Current hours used in the 70-hour/8-day cycle,
+            as a total or per previous day
+        allow_restart: Whether a 34-hour restart may reset the cycle
+        sleeper_berth: Whether to search for faster split sleeper berth rests
+        
+    Returns:
+        Schedule with stops and segments
+    """
+    calculator = HOSCalculator(current_cycle_hours, get_poi_index(), allow_restart, sleeper_berth)
+    return calculator.build_schedule(route_data)
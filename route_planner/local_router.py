@@ -0,0 +1,431 @@
+"""
+Local Router module
+
+This module implements an in-process routing engine over a road graph
+stored on disk. The graph is kept in compressed sparse row (CSR) arrays
+saved as .npy files and memory-mapped, so all worker processes share the
+same pages. Shortest paths (by travel time) are found with A* guided by
+landmark lower bounds (ALT).
+
+Graph directories are produced from OSM-derived node/edge CSV files by
+build_road_graph (see the build_road_graph management command).
+"""
+
+import csv
+import heapq
+import json
+import math
+import operator
+import os
+
+import numpy as np
+
+from .geometry import encode_polyline
+from .routing import RoutingBackend, METERS_TO_MILES
+
+
+GRAPH_ARRAYS = (
+    'node_lat', 'node_lng', 'offsets', 'targets', 'durations', 'distances',
+    'landmarks_from', 'landmarks_to', 'cell_keys', 'cell_nodes'
+)
+
+# Landmark distance stored for nodes a landmark cannot reach (or be reached from)
+UNREACHABLE = 1e30
+
+# Cells of the nearest-node grid are keyed as row * CELL_KEY_STRIDE + column
+CELL_KEY_STRIDE = 1 << 32
+
+
+def _cell(lat, lng, cell_size):
+    """Return the (row, column) of the grid cell containing a coordinate"""
+    return (
+        int(math.floor((lat + 90) / cell_size)),
+        int(math.floor((lng + 180) / cell_size))
+    )
+
+
+class RoadGraph:
+    """Memory-mapped road graph in CSR form"""
+
+    def __init__(self, graph_dir):
+        """
+        Load a graph directory written by build_road_graph
+
+        Args:
+            graph_dir: Path of the directory holding the .npy arrays
+        """
+        with open(os.path.join(graph_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.cell_size = self.meta['cell_size']
+
+        for name in GRAPH_ARRAYS:
+            array = np.load(os.path.join(graph_dir, f'{name}.npy'), mmap_mode='r')
+            # Plain ndarray views keep the shared mapping without the
+            # per-access overhead of the np.memmap subclass
+            setattr(self, name, array.view(np.ndarray))
+
+        self.node_count = len(self.node_lat)
+
+    def nearest_node(self, lat, lng, max_rings=50):
+        """
+        Find the graph node closest to a coordinate
+
+        Args:
+            lat: Latitude in degrees
+            lng: Longitude in degrees
+            max_rings: Number of grid rings to search before giving up
+
+        Returns:
+            Integer node index
+        """
+        row, column = _cell(lat, lng, self.cell_size)
+        best_node = None
+        best_distance = math.inf
+
+        for ring in range(max_rings + 1):
+            for r in range(row - ring, row + ring + 1):
+                for c in range(column - ring, column + ring + 1):
+                    # Only visit the border of the ring
+                    if ring and r not in (row - ring, row + ring) and c not in (column - ring, column + ring):
+                        continue
+                    key = r * CELL_KEY_STRIDE + c
+                    start = np.searchsorted(self.cell_keys, key, side='left')
+                    end = np.searchsorted(self.cell_keys, key, side='right')
+                    if start == end:
+                        continue
+                    nodes = np.asarray(self.cell_nodes[start:end])
+                    d_lat = self.node_lat[nodes] - lat
+                    d_lng = (self.node_lng[nodes] - lng) * math.cos(math.radians(lat))
+                    squared = d_lat * d_lat + d_lng * d_lng
+                    index = int(np.argmin(squared))
+                    if squared[index] < best_distance:
+                        best_distance = float(squared[index])
+                        best_node = int(nodes[index])
+            # Anything in a further ring is at least `ring` cells away
+            reach = ring * self.cell_size * math.cos(math.radians(lat))
+            if best_node is not None and math.sqrt(best_distance) <= reach:
+                break
+
+        if best_node is None:
+            raise ValueError(f"No road found near {lat},{lng}")
+        return best_node
+
+    def shortest_path(self, source, target):
+        """
+        Find the fastest path between two nodes with A* and landmarks
+
+        Args:
+            source: Source node index
+            target: Target node index
+
+        Returns:
+            Tuple of (list of node indices, duration in seconds,
+            distance in meters)
+        """
+        if source == target:
+            return [source], 0.0, 0.0
+
+        from_target = self.landmarks_from[target].tolist()
+        to_target = self.landmarks_to[target].tolist()
+        landmarks_from = self.landmarks_from
+        landmarks_to = self.landmarks_to
+
+        def heuristic(node):
+            # Triangle inequality lower bounds from every landmark:
+            # d(v, t) >= d(L, t) - d(L, v) and d(v, t) >= d(v, L) - d(t, L)
+            return max(
+                0.0,
+                max(map(operator.sub, from_target, landmarks_from[node].tolist())),
+                max(map(operator.sub, landmarks_to[node].tolist(), to_target))
+            )
+
+        offsets = self.offsets
+        targets = self.targets
+        durations = self.durations
+
+        best = {source: 0.0}
+        previous = {}
+        closed = set()
+        queue = [(heuristic(source), 0.0, source)]
+
+        while queue:
+            _, cost, node = heapq.heappop(queue)
+            if node == target:
+                break
+            if node in closed:
+                continue
+            closed.add(node)
+
+            start, end = int(offsets[node]), int(offsets[node + 1])
+            neighbours = targets[start:end].tolist()
+            weights = durations[start:end].tolist()
+            for edge, (neighbour, weight) in enumerate(zip(neighbours, weights), start):
+                if neighbour in closed:
+                    continue
+                new_cost = cost + weight
+                if new_cost < best.get(neighbour, math.inf):
+                    best[neighbour] = new_cost
+                    previous[neighbour] = (node, edge)
+                    heapq.heappush(queue, (new_cost + heuristic(neighbour), new_cost, neighbour))
+        else:
+            raise ValueError("No route found between the given points")
+
+        path = [target]
+        distance = 0.0
+        while path[-1] != source:
+            node, edge = previous[path[-1]]
+            distance += float(self.distances[edge])
+            path.append(node)
+        path.reverse()
+
+        return path, best[target], distance
+
+    def travel_costs(self, source, targets):
+        """
+        Find the fastest paths from one node to several nodes with Dijkstra
+
+        Args:
+            source: Source node index
+            targets: Iterable of target node indices
+
+        Returns:
+            Dictionary of target node to (duration in seconds, distance in
+            meters); unreachable targets are left out
+        """
+        offsets = self.offsets
+        neighbours_of = self.targets
+        durations = self.durations
+        distances = self.distances
+
+        remaining = set(targets)
+        best = {source: (0.0, 0.0)}
+        closed = set()
+        queue = [(0.0, 0.0, source)]
+        costs = {}
+
+        # Stop as soon as every target has been settled
+        while queue and remaining:
+            cost, distance, node = heapq.heappop(queue)
+            if node in closed:
+                continue
+            closed.add(node)
+            if node in remaining:
+                remaining.discard(node)
+                costs[node] = (cost, distance)
+
+            start, end = int(offsets[node]), int(offsets[node + 1])
+            edges = zip(
+                neighbours_of[start:end].tolist(),
+                durations[start:end].tolist(),
+                distances[start:end].tolist()
+            )
+            for neighbour, weight, length in edges:
+                if neighbour in closed:
+                    continue
+                new_cost = cost + weight
+                if new_cost < best.get(neighbour, (math.inf,))[0]:
+                    best[neighbour] = (new_cost, distance + length)
+                    heapq.heappush(queue, (new_cost, distance + length, neighbour))
+
+        return costs
+
+    def encode_path(self, path):
+        """Encode a list of node indices as a polyline"""
+        nodes = np.asarray(path)
+        return encode_polyline(np.column_stack((self.node_lat[nodes], self.node_lng[nodes])))
+
+
+class LocalRoutingBackend(RoutingBackend):
+    """Routing on a local memory-mapped road graph"""
+
+    name = 'local'
+
+    def __init__(self, graph_dir):
+        """Load the road graph from graph_dir"""
+        self.graph = RoadGraph(graph_dir)
+
+    def route(self, waypoints, geometry='full', steps=False):
+        """
+        Route through the waypoints on the local graph
+
+        Paths are returned at full detail for both 'simplified' and 'full'
+        geometry. The graph has no street names, so legs carry an empty
+        steps list when steps are requested.
+        """
+        nodes = [self.graph.nearest_node(point['lat'], point['lng']) for point in waypoints]
+        with_geometry = geometry != 'none'
+
+        legs = []
+        route_path = []
+        for source, target in zip(nodes, nodes[1:]):
+            path, duration, distance = self.graph.shortest_path(source, target)
+            leg = {
+                'distance': distance * METERS_TO_MILES,
+                'duration': duration / 3600,  # seconds to hours
+                'polyline': self.graph.encode_path(path) if with_geometry else None
+            }
+            if steps:
+                leg['steps'] = []
+            legs.append(leg)
+            route_path.extend(path[1:] if route_path else path)
+
+        return legs, self.graph.encode_path(route_path) if with_geometry else None
+
+    def table(self, sources, destinations):
+        """Compute the matrix with one Dijkstra search per source"""
+        source_nodes = [self.graph.nearest_node(point['lat'], point['lng']) for point in sources]
+        destination_nodes = [self.graph.nearest_node(point['lat'], point['lng']) for point in destinations]
+
+        durations = []
+        distances = []
+        for source in source_nodes:
+            costs = self.graph.travel_costs(source, destination_nodes)
+            durations.append([
+                costs[node][0] / 3600 if node in costs else None  # seconds to hours
+                for node in destination_nodes
+            ])
+            distances.append([
+                costs[node][1] * METERS_TO_MILES if node in costs else None
+                for node in destination_nodes
+            ])
+
+        return durations, distances
+
+
+def _dijkstra(offsets, targets, weights, source):
+    """Single-source shortest travel times over CSR lists"""
+    dist = [math.inf] * (len(offsets) - 1)
+    dist[source] = 0.0
+    queue = [(0.0, source)]
+    while queue:
+        cost, node = heapq.heappop(queue)
+        if cost > dist[node]:
+            continue
+        for edge in range(offsets[node], offsets[node + 1]):
+            neighbour = targets[edge]
+            new_cost = cost + weights[edge]
+            if new_cost < dist[neighbour]:
+                dist[neighbour] = new_cost
+                heapq.heappush(queue, (new_cost, neighbour))
+    return dist
+
+
+def _to_csr(node_count, sources, targets, *values):
+    """Sort edges by source and build the CSR offsets array"""
+    order = np.argsort(sources, kind='stable')
+    offsets = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=node_count), out=offsets[1:])
+    return (offsets, targets[order]) + tuple(value[order] for value in values)
+
+
+def _pick_landmarks(node_lat, node_lng, count):
+    """Pick peripheral nodes spread by bearing around the graph centroid"""
+    center_lat, center_lng = node_lat.mean(), node_lng.mean()
+    d_lat = node_lat - center_lat
+    d_lng = (node_lng - center_lng) * math.cos(math.radians(center_lat))
+    sectors = ((np.arctan2(d_lat, d_lng) + math.pi) / (2 * math.pi) * count).astype(int) % count
+    radius = d_lat * d_lat + d_lng * d_lng
+
+    landmarks = []
+    for sector in range(count):
+        members = np.nonzero(sectors == sector)[0]
+        if len(members):
+            landmarks.append(int(members[np.argmax(radius[members])]))
+    return landmarks
+
+
+def build_road_graph(nodes_csv, edges_csv, output_dir, landmark_count=8, cell_size=0.01):
+    """
+    Build a memory-mappable road graph from OSM-derived CSV files
+
+    Args:
+        nodes_csv: CSV with columns id, lat, lng
+        edges_csv: CSV with columns source, target, distance (meters),
+                   duration (seconds) and optional oneway (1/0)
+        output_dir: Directory to write the .npy arrays and meta.json to
+        landmark_count: Number of ALT landmarks to precompute
+        cell_size: Nearest-node grid cell size in degrees
+
+    Returns:
+        Dictionary with node, edge and landmark counts
+    """
+    node_index = {}
+    lats, lngs = [], []
+    with open(nodes_csv, newline='') as f:
+        for row in csv.DictReader(f):
+            node_index[row['id']] = len(lats)
+            lats.append(float(row['lat']))
+            lngs.append(float(row['lng']))
+    node_lat = np.array(lats, dtype=np.float64)
+    node_lng = np.array(lngs, dtype=np.float64)
+    node_count = len(node_lat)
+
+    sources, targets, distances, durations = [], [], [], []
+    with open(edges_csv, newline='') as f:
+        for row in csv.DictReader(f):
+            source, target = node_index[row['source']], node_index[row['target']]
+            distance, duration = float(row['distance']), float(row['duration'])
+            sources.append(source)
+            targets.append(target)
+            distances.append(distance)
+            durations.append(duration)
+            if row.get('oneway', '0') not in ('1', 'true', 'yes'):
+                sources.append(target)
+                targets.append(source)
+                distances.append(distance)
+                durations.append(duration)
+
+    sources = np.array(sources, dtype=np.int64)
+    targets = np.array(targets, dtype=np.int32)
+    distances = np.array(distances, dtype=np.float32)
+    durations = np.array(durations, dtype=np.float32)
+
+    offsets, csr_targets, csr_durations, csr_distances = _to_csr(
+        node_count, sources, targets, durations, distances
+    )
+    rev_offsets, rev_targets, rev_durations = _to_csr(
+        node_count, targets.astype(np.int64), sources.astype(np.int32), durations
+    )
+
+    # Landmark distances, stored node-major so each lookup reads one row
+    landmarks = _pick_landmarks(node_lat, node_lng, landmark_count)
+    forward = (offsets.tolist(), csr_targets.tolist(), csr_durations.tolist())
+    backward = (rev_offsets.tolist(), rev_targets.tolist(), rev_durations.tolist())
+    landmarks_from = np.array([_dijkstra(*forward, l) for l in landmarks], dtype=np.float32).T
+    landmarks_to = np.array([_dijkstra(*backward, l) for l in landmarks], dtype=np.float32).T
+    # A finite sentinel keeps the bounds free of inf - inf = nan
+    landmarks_from[~np.isfinite(landmarks_from)] = UNREACHABLE
+    landmarks_to[~np.isfinite(landmarks_to)] = UNREACHABLE
+
+    rows = np.floor((node_lat + 90) / cell_size).astype(np.int64)
+    columns = np.floor((node_lng + 180) / cell_size).astype(np.int64)
+    keys = rows * CELL_KEY_STRIDE + columns
+    cell_order = np.argsort(keys, kind='stable')
+
+    arrays = {
+        'node_lat': node_lat,
+        'node_lng': node_lng,
+        'offsets': offsets,
+        'targets': csr_targets,
+        'durations': csr_durations,
+        'distances': csr_distances,
+        'landmarks_from': np.ascontiguousarray(landmarks_from),
+        'landmarks_to': np.ascontiguousarray(landmarks_to),
+        'cell_keys': keys[cell_order],
+        'cell_nodes': cell_order.astype(np.int32),
+    }
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(output_dir, f'{name}.npy'), array)
+
+    meta = {
+        'node_count': node_count,
+        'edge_count': int(len(csr_targets)),
+        'landmarks': landmarks,
+        'cell_size': cell_size,
+    }
+    with open(os.path.join(output_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    return meta
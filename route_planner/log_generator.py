@@ -2,19 +2,33 @@
 Log Generator module
 
 This module is responsible for generating ELD log sheets based on
-the calculated HOS-compliant schedule.
+the calculated HOS-compliant schedule. Times are handled as hour offsets
+from the schedule start, so a day's activities need no datetime math.
 """
 
 import datetime
-from copy import deepcopy
+import itertools
 
 
-def generate_log_sheets(schedule_data):
+# Duty status logged for each kind of stop
+STOP_DUTY_STATUS = {
+    'rest': 'off_duty',
+    'restart': 'off_duty',
+    'sleeper': 'sleeper_berth',
+    'split_rest': 'off_duty',
+    'break': 'off_duty',
+    'pickup': 'on_duty',
+    'dropoff': 'on_duty',
+    'fuel': 'on_duty',
+}
+
+
+def generate_log_sheets(schedule):
     """
     Generate ELD log sheets based on the schedule
     
     Args:
-        schedule_data: Dictionary with schedule information
+        schedule: Schedule from HOSCalculator.build_schedule
         
     Returns:
         List of log sheet entries
@@ -22,13 +36,20 @@ def generate_log_sheets(schedule_data):
     logs = []
     
     # Process each day of the trip
-    current_date = schedule_data['start_time'].date()
-    end_date = schedule_data['end_time'].date()
+    current_date = schedule.start_time.date()
+    end_time = schedule.end_time
+    end_date = end_time.date()
     
     # Add a day to end_date if there is activity in the current day
-    if schedule_data['end_time'].time() > datetime.time(0, 0):
+    if end_time.time() > datetime.time(0, 0):
         end_date += datetime.timedelta(days=1)
     
+    # Stops and segments are in time order; skip the ones before each day
+    stops = schedule.stops
+    segments = schedule.segments
+    first_stop = 0
+    first_segment = 0
+    
     while current_date <= end_date:
         # Initialize log entry for this day
         log_entry = {
@@ -45,64 +66,61 @@ def generate_log_sheets(schedule_data):
             'remarks': 'No remarks'  # Default value for empty remarks
         }
         
-        # Filter schedule items for this day
-        day_start = datetime.datetime.combine(current_date, datetime.time(0, 0))
-        day_end = day_start + datetime.timedelta(days=1)
+        # Day boundaries, in hours after the schedule start
+        day_start = (
+            datetime.datetime.combine(current_date, datetime.time(0, 0)) - schedule.start_time
+        ).total_seconds() / 3600
+        day_end = day_start + 24
+        
+        remarks = []
+        shipping_docs = []
         
         # Process stops for this day
-        for stop in schedule_data['stops']:
-            # Skip stops outside of this day
-            if stop['arrival_time'] >= day_end or stop['departure_time'] < day_start:
-                continue
+        while first_stop < len(stops) and stops[first_stop].end < day_start:
+            first_stop += 1
+        for stop in itertools.islice(stops, first_stop, None):
+            # Stops after this day start on a later one
+            if stop.start >= day_end:
+                break
             
             # Add stop activities to log
-            if stop['stop_type'] == 'rest':
-                add_activity_to_log(log_entry, 'off_duty', stop['arrival_time'], stop['departure_time'], day_start)
-            elif stop['stop_type'] == 'break':
-                add_activity_to_log(log_entry, 'off_duty', stop['arrival_time'], stop['departure_time'], day_start)
-            elif stop['stop_type'] in ['pickup', 'dropoff', 'fuel']:
-                add_activity_to_log(log_entry, 'on_duty', stop['arrival_time'], stop['departure_time'], day_start)
+            duty_status = STOP_DUTY_STATUS.get(stop.stop_type)
+            if duty_status:
+                add_activity_to_log(log_entry, duty_status, stop.start, stop.end, day_start)
+            
+            # Add remarks about the day's activities
+            if stop.start >= day_start:
+                if stop.stop_type == 'pickup':
+                    remarks.append(f"Pickup at {stop.location['address']} at {stop.arrival_time.strftime('%H:%M')}")
+                elif stop.stop_type == 'dropoff':
+                    remarks.append(f"Dropoff at {stop.location['address']} at {stop.arrival_time.strftime('%H:%M')}")
+                elif stop.stop_type == 'fuel':
+                    remarks.append(f"Fueling at {stop.arrival_time.strftime('%H:%M')}")
+            
+            # Add shipping document numbers
+            if stop.stop_type == 'pickup':
+                shipping_docs.append(f"PU{current_date.strftime('%Y%m%d')}")
+            elif stop.stop_type == 'dropoff':
+                shipping_docs.append(f"DO{current_date.strftime('%Y%m%d')}")
         
         # Process segments for this day
-        for segment in schedule_data['segments']:
-            # Skip segments outside of this day
-            if segment['start_time'] >= day_end or segment['end_time'] < day_start:
-                continue
+        while first_segment < len(segments) and segments[first_segment].end < day_start:
+            first_segment += 1
+        for segment in itertools.islice(segments, first_segment, None):
+            if segment.start >= day_end:
+                break
             
             # Add driving activity to log
-            add_activity_to_log(log_entry, 'driving', segment['start_time'], segment['end_time'], day_start)
-            
-            # Calculate miles driven on this day
-            segment_start = max(segment['start_time'], day_start)
-            segment_end = min(segment['end_time'], day_end)
+            add_activity_to_log(log_entry, 'driving', segment.start, segment.end, day_start)
             
             # Calculate proportion of segment that falls on this day
-            if segment['end_time'] > segment['start_time']:
-                segment_day_proportion = (segment_end - segment_start).total_seconds() / (segment['end_time'] - segment['start_time']).total_seconds()
-                log_entry['total_miles'] += segment['distance'] * segment_day_proportion
-        
-        # Add remarks about the day's activities
-        remarks = []
-        for stop in schedule_data['stops']:
-            if stop['arrival_time'].date() == current_date:
-                if stop['stop_type'] == 'pickup':
-                    remarks.append(f"Pickup at {stop['location']['address']} at {stop['arrival_time'].strftime('%H:%M')}")
-                elif stop['stop_type'] == 'dropoff':
-                    remarks.append(f"Dropoff at {stop['location']['address']} at {stop['arrival_time'].strftime('%H:%M')}")
-                elif stop['stop_type'] == 'fuel':
-                    remarks.append(f"Fueling at {stop['arrival_time'].strftime('%H:%M')}")
+            if segment.duration > 0:
+                segment_day_hours = min(segment.end, day_end) - max(segment.start, day_start)
+                log_entry['total_miles'] += segment.distance * segment_day_hours / segment.duration
         
         if remarks:
             log_entry['remarks'] = '. '.join(remarks)
         
-        # Add shipping document numbers
-        shipping_docs = []
-        for stop in schedule_data['stops']:
-            if stop['stop_type'] == 'pickup' and stop['arrival_time'].date() <= current_date <= stop['departure_time'].date():
-                shipping_docs.append(f"PU{current_date.strftime('%Y%m%d')}")
-            elif stop['stop_type'] == 'dropoff' and stop['arrival_time'].date() <= current_date <= stop['departure_time'].date():
-                shipping_docs.append(f"DO{current_date.strftime('%Y%m%d')}")
-        
         if shipping_docs:
             log_entry['shipping_docs'] = ', '.join(shipping_docs)
         
@@ -118,32 +136,32 @@ def generate_log_sheets(schedule_data):
     return logs
 
 
-def add_activity_to_log(log_entry, activity_type, start_time, end_time, day_start):
+def add_activity_to_log(log_entry, activity_type, start, end, day_start):
     """
     Add an activity period to the log entry
     
     Args:
         log_entry: Dictionary with log entry data
         activity_type: String type of activity ('off_duty', 'sleeper_berth', 'driving', 'on_duty')
-        start_time: Datetime of activity start
-        end_time: Datetime of activity end
-        day_start: Datetime representing start of the day
+        start: Activity start, in hours after the schedule start
+        end: Activity end, in hours after the schedule start
+        day_start: Start of the day, in hours after the schedule start
         
     Returns:
         None (modifies log_entry in place)
     """
     # Adjust times to be within the current day
-    day_end = day_start + datetime.timedelta(days=1)
-    activity_start = max(start_time, day_start)
-    activity_end = min(end_time, day_end)
+    day_end = day_start + 24
+    activity_start = max(start, day_start)
+    activity_end = min(end, day_end)
     
     # Skip if activity doesn't fall in this day
     if activity_start >= day_end or activity_end <= day_start:
         return
     
-    # Convert to hour fractions (0-24)
-    start_hour = (activity_start - day_start).total_seconds() / 3600
-    end_hour = (activity_end - day_start).total_seconds() / 3600
-    
-    # Add to appropriate activity list
-    log_entry[activity_type].append([start_hour, end_hour])
+    # Convert to hour fractions (0-24), to the microsecond like the
+    # datetimes shown elsewhere in the plan
+    log_entry[activity_type].append([
+        round((activity_start - day_start) * 3600, 6) / 3600,
+        round((activity_end - day_start) * 3600, 6) / 3600
+    ])
@@ -0,0 +1 @@
+# This file is intentionally left empty to mark the directory as a Python package
@@ -0,0 +1,210 @@
+import copy
+import time
+import tracemalloc
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from route_planner.geometry import cumulative_distances, encode_polyline
+from route_planner.hos_batch import batch_hos_schedules
+from route_planner.hos_calculator import HOSCalculator
+
+
+def synthetic_route(point_count, distance, leg_shares=(1, 1), speeds=None):
+    """
+    Build route data shaped like calculate_route's, with a large geometry
+
+    Args:
+        point_count: Number of coordinates in the route geometry (0 for
+                     a route without geometry)
+        distance: Route length in miles
+        leg_shares: Relative length of each leg; the first ends at pickup
+                    and the last at dropoff
+        speeds: Average speed of each leg in mph (AVG_TRUCK_SPEED if None)
+
+    Returns:
+        Route information dictionary
+    """
+    # A gently winding line from the Midwest to the East Coast
+    t = np.linspace(0, 1, max(point_count, len(leg_shares) + 1))
+    geometry = np.column_stack((38 + 4 * t + 0.2 * np.sin(40 * t), -105 + 30 * t))
+    # Split the geometry in proportion to the legs
+    bounds = np.round(np.cumsum((0,) + tuple(leg_shares)) / sum(leg_shares) * (len(t) - 1)).astype(int)
+    pieces = [np.arange(start, end + 1) for start, end in zip(bounds[:-1], bounds[1:])]
+    speeds = speeds or [HOSCalculator.AVG_TRUCK_SPEED] * len(leg_shares)
+
+    locations = [
+        {'address': f'Location {i}', 'lat': float(geometry[index, 0]), 'lng': float(geometry[index, 1])}
+        for i, index in enumerate(bounds)
+    ]
+    segments = [
+        {
+            'start_location': locations[i],
+            'end_location': locations[i + 1],
+            'distance': distance * share / sum(leg_shares),
+            'duration': distance * share / sum(leg_shares) / speed,
+            'polyline': encode_polyline(geometry[piece]),
+            'steps': []
+        }
+        for i, (piece, share, speed) in enumerate(zip(pieces, leg_shares, speeds))
+    ]
+
+    if not point_count:
+        geometry = np.empty((0, 2))
+    return {
+        'locations': locations,
+        'segments': segments,
+        'total_distance': sum(segment['distance'] for segment in segments),
+        'total_duration': sum(segment['duration'] for segment in segments),
+        'polyline': encode_polyline(geometry),
+        'geometry': geometry,
+        'cumulative_distances': cumulative_distances(geometry)
+    }
+
+
+def golden_corpus(size=500, seed=0):
+    """
+    Generate varied (route_data, current_cycle_hours, allow_restart) cases
+
+    Routes have 2 to 5 legs of mixed lengths and speeds, with and without
+    geometry, and up to three times the driving the 70-hour cycle leaves
+    room for, so many run out of cycle hours. Some give the cycle hours
+    per previous day, and some have a leg with nothing to drive.
+    """
+    random = np.random.default_rng(seed)
+    cases = []
+    for _ in range(size):
+        legs = int(random.integers(2, 6))
+        shares = tuple(float(share) for share in random.uniform(0.05, 1, legs))
+        speeds = [float(speed) for speed in random.uniform(25, 70, legs)]
+        cycle_hours = float(random.choice([0, 0, random.uniform(0, 70), 12.5]))
+        # Driving hours the cycle leaves room for, after pickup and dropoff
+        budget = max(HOSCalculator.MAX_CYCLE_HOURS - cycle_hours - 2, 1)
+        driving_hours = float(random.uniform(0.2, 3)) * budget
+        distance = driving_hours / sum(share / speed for share, speed in zip(shares, speeds)) * sum(shares)
+        point_count = int(random.choice([0, 50, 2000]))
+        route_data = synthetic_route(point_count, distance, shares, speeds)
+
+        if random.random() < 0.1:
+            empty = route_data['segments'][int(random.integers(legs))]
+            empty['distance'] = empty['duration'] = 0.0
+        if random.random() < 0.3:
+            # The same hours spread over the previous week
+            days = random.uniform(0, 1, 7)
+            cycle_hours = [float(hours) for hours in days / days.sum() * cycle_hours]
+        cases.append((route_data, cycle_hours, bool(random.random() < 0.5)))
+    return cases
+
+
+def fleet_batch(size, legs=2, seed=0):
+    """
+    Generate random driver/load combinations as batch kernel input
+
+    Returns:
+        (leg_durations, leg_distances, current_cycle_hours) arrays; trips
+        run from a few hours to several days
+    """
+    random = np.random.default_rng(seed)
+    speeds = random.uniform(25, 70, (size, legs))
+    leg_durations = random.uniform(0.2, 30, (size, legs))
+    cycle_hours = random.uniform(0, 70, size)
+    return leg_durations, leg_durations * speeds, cycle_hours
+
+
+def best_time(func, repeat):
+    """Return the fastest of several timed runs, in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def peak_memory(func):
+    """Return the peak memory allocated while running func, in KiB"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+class Command(BaseCommand):
+    """Time HOS schedule calculation on synthetic routes"""
+
+    help = 'Benchmark HOS schedule calculation on synthetic routes with large geometries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--points', type=int, nargs='+', default=[1000, 10000, 100000],
+            help='Route geometry sizes to benchmark'
+        )
+        parser.add_argument(
+            '--distances', type=float, nargs='+', default=[500, 2800, 3600, 30000],
+            help='Route lengths in miles'
+        )
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per case (fastest is kept)')
+        parser.add_argument(
+            '--batch', type=int, nargs='+', default=[10000],
+            help='Fleet sizes to time the batch kernel on'
+        )
+
+    def handle(self, *args, **options):
+        calculator = HOSCalculator(current_cycle_hours=0, allow_restart=True)
+
+        self.stdout.write(
+            f"{'points':>8} {'miles':>6} {'schedule ms':>12} {'stepped ms':>11} "
+            f"{'schedule KiB':>13} {'deepcopy ms':>12} {'deepcopy KiB':>13}"
+        )
+        for point_count in options['points']:
+            for distance in options['distances']:
+                route_data = synthetic_route(point_count, distance)
+
+                # The copies calculate_schedule used to make of its input
+                def copy_input():
+                    copy.deepcopy(route_data)
+                    for segment in route_data['segments']:
+                        copy.deepcopy(segment)
+
+                def schedule():
+                    calculator.build_schedule(route_data)
+
+                # Every duty day stepped through limit by limit
+                def stepped():
+                    calculator.build_schedule(route_data, jump_days=False)
+
+                self.stdout.write(
+                    f"{point_count:>8} {distance:>6.0f} "
+                    f"{best_time(schedule, options['repeat']):>12.3f} "
+                    f"{best_time(stepped, options['repeat']):>11.3f} "
+                    f"{peak_memory(schedule):>13.1f} "
+                    f"{best_time(copy_input, options['repeat']):>12.3f} "
+                    f"{peak_memory(copy_input):>13.1f}"
+                )
+
+        self.stdout.write(f"\n{'trips':>8} {'batch ms':>9} {'per trip us':>12} {'scalar us':>12}")
+        for size in options['batch']:
+            leg_durations, leg_distances, cycle_hours = fleet_batch(size)
+            batch_ms = best_time(
+                lambda: batch_hos_schedules(leg_durations, leg_distances, cycle_hours),
+                max(1, options['repeat'] // 4)
+            )
+
+            # One schedule per trip, on a sample of the same trips
+            sample = range(min(size, 200))
+            routes = [
+                (HOSCalculator(cycle_hours[trip]), synthetic_route(0, leg_distances[trip].sum(),
+                                                                   tuple(leg_distances[trip]),
+                                                                   list(leg_distances[trip] / leg_durations[trip])))
+                for trip in sample
+            ]
+            scalar_ms = best_time(
+                lambda: [calculator.build_schedule(route_data) for calculator, route_data in routes],
+                max(1, options['repeat'] // 4)
+            )
+            self.stdout.write(
+                f"{size:>8} {batch_ms:>9.2f} {batch_ms * 1000 / size:>12.2f} "
+                f"{scalar_ms * 1000 / max(1, len(routes)):>12.2f}"
+            )
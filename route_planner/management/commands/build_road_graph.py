@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from route_planner.local_router import build_road_graph
+
+
+class Command(BaseCommand):
+    """Build the memory-mapped road graph used by the local routing backend"""
+
+    help = 'Build a local road graph from OSM-derived node and edge CSV files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('nodes_csv', help='CSV with columns id, lat, lng')
+        parser.add_argument(
+            'edges_csv',
+            help='CSV with columns source, target, distance (m), duration (s), oneway'
+        )
+        parser.add_argument('output_dir', help='Directory to write the graph arrays to')
+        parser.add_argument('--landmarks', type=int, default=8, help='Number of ALT landmarks')
+        parser.add_argument('--cell-size', type=float, default=0.01, help='Nearest-node grid cell size in degrees')
+
+    def handle(self, *args, **options):
+        meta = build_road_graph(
+            options['nodes_csv'],
+            options['edges_csv'],
+            options['output_dir'],
+            landmark_count=options['landmarks'],
+            cell_size=options['cell_size']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Built graph with {meta['node_count']} nodes, {meta['edge_count']} edges "
+            f"and {len(meta['landmarks'])} landmarks"
+        ))
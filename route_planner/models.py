@@ -1,4 +1,25 @@
 from django.db import models
 
-# No persistent models needed for this application
-# All calculations and data handling will be done in memory
+
+class GeocodeCacheEntry(models.Model):
+    """Persisted geocoding result shared by all worker processes"""
+    normalized_address = models.CharField(max_length=255, unique=True)
+    found = models.BooleanField(default=True)  # False caches a "not found" answer
+    lat = models.FloatField(null=True, blank=True)
+    lng = models.FloatField(null=True, blank=True)
+    display_name = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.normalized_address
+
+
+class UpstreamLock(models.Model):
+    """Lock-table row marking an upstream call in flight in some worker"""
+    key = models.CharField(max_length=64, unique=True)
+    result = models.TextField(null=True, blank=True)  # JSON result once the call finished
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.key
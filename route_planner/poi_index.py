@@ -0,0 +1,264 @@
+"""
+POI Index module
+
+This module provides an offline index of truck-relevant points of interest
+(truck stops, fuel stations, rest areas, truck parking) for placing HOS
+stops at real facilities.
+Points are bucketed in a lat/lng grid held as sorted cell keys, so a
+corridor query only visits the cells around the route, and its answer is
+ordered by distance along the route so the scheduler can pick stations
+with a binary search and no network calls.
+"""
+
+import csv
+import math
+import os
+import threading
+
+import numpy as np
+
+from django.conf import settings
+
+from .geometry import EARTH_RADIUS_MILES
+
+
+# Cells of the grid are keyed as row * CELL_KEY_STRIDE + column
+CELL_KEY_STRIDE = 1 << 32
+
+MILES_PER_DEGREE = math.pi * EARTH_RADIUS_MILES / 180
+
+# POI kinds where a truck can refuel
+FUEL_KINDS = ('truck_stop', 'fuel')
+
+# POI kinds where a truck can park for a 10-hour rest
+REST_KINDS = ('rest_area', 'truck_parking', 'truck_stop')
+
+
+class Corridor:
+    """POIs near a route, ordered by distance along it"""
+
+    def __init__(self, index, poi_ids, along, offsets):
+        """
+        Args:
+            index: POIIndex the POIs come from
+            poi_ids: Array of POI ids, sorted by along
+            along: Distance along the route of each POI's closest point
+            offsets: Distance in miles from the route to each POI
+        """
+        self.index = index
+        self.poi_ids = poi_ids
+        self.along = along
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.poi_ids)
+
+    def poi(self, position):
+        """
+        Get a corridor POI as a dictionary
+
+        Returns:
+            Dictionary with name, kind, lat, lng, distance (along the
+            route) and offset (from the route)
+        """
+        poi_id = int(self.poi_ids[position])
+        return {
+            'name': self.index.names[poi_id],
+            'kind': self.index.kinds[poi_id],
+            'lat': float(self.index.lat[poi_id]),
+            'lng': float(self.index.lng[poi_id]),
+            'distance': float(self.along[position]),
+            'offset': float(self.offsets[position])
+        }
+
+    def pois(self):
+        """Return every corridor POI in driving order"""
+        return [self.poi(position) for position in range(len(self))]
+
+    def last_before(self, distance, after=-math.inf):
+        """
+        Find the furthest POI at or before a distance along the route
+
+        Args:
+            distance: Distance along the route
+            after: Only consider POIs strictly beyond this distance
+
+        Returns:
+            POI dictionary, or None
+        """
+        position = int(np.searchsorted(self.along, distance, side='right')) - 1
+        if position >= 0 and self.along[position] > after:
+            return self.poi(position)
+        return None
+
+    def first_after(self, distance):
+        """Find the nearest POI strictly beyond a distance along the route"""
+        position = int(np.searchsorted(self.along, distance, side='right'))
+        if position < len(self):
+            return self.poi(position)
+        return None
+
+
+class POIIndex:
+    """In-memory grid index of points of interest with corridor queries"""
+
+    def __init__(self, path, cell_size=0.1):
+        """
+        Load points of interest from a CSV file
+
+        Args:
+            path: CSV with columns name, kind, lat, lng and optional
+                  display_name
+            cell_size: Grid cell size in degrees
+        """
+        self.cell_size = cell_size
+        self.names = []
+        self.kinds = []
+        lat = []
+        lng = []
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                self.names.append(row.get('display_name') or row['name'])
+                self.kinds.append(row.get('kind', ''))
+                lat.append(float(row['lat']))
+                lng.append(float(row['lng']))
+
+        self.lat = np.array(lat, dtype=np.float64)
+        self.lng = np.array(lng, dtype=np.float64)
+        self.kind_array = np.array(self.kinds, dtype=object)
+
+        keys = self._cell_keys(self.lat, self.lng)
+        order = np.argsort(keys, kind='stable')
+        self.cell_keys = keys[order]
+        self.cell_pois = order
+
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'corridor_queries': 0,
+            'corridor_pois': 0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _cell_keys(self, lat, lng):
+        """Return the grid cell keys of coordinate arrays"""
+        rows = np.floor((lat + 90) / self.cell_size).astype(np.int64)
+        columns = np.floor((lng + 180) / self.cell_size).astype(np.int64)
+        return rows * CELL_KEY_STRIDE + columns
+
+    def corridor(self, coordinates, distances, radius_miles, kinds=None):
+        """
+        Find the POIs within a distance of a route
+
+        Args:
+            coordinates: (n, 2) coordinate array of the route
+            distances: Distance along the route at each vertex, in the unit
+                       the corridor should report (see cumulative_distances)
+            radius_miles: Maximum distance from the route
+            kinds: POI kinds to include (None for all)
+
+        Returns:
+            Corridor ordered by distance along the route
+        """
+        self._count('corridor_queries')
+        empty = Corridor(self, np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+        if len(coordinates) < 2 or not len(self.cell_keys):
+            return empty
+
+        start = coordinates[:-1]
+        end = coordinates[1:]
+
+        # Grid cells covered by each route edge's bounding box, grown by the radius
+        lat_margin = radius_miles / MILES_PER_DEGREE
+        cos_lat = np.maximum(np.cos(np.radians(np.maximum(
+            np.abs(start[:, 0]), np.abs(end[:, 0])
+        ) + lat_margin)), 0.01)
+        lng_margin = lat_margin / cos_lat
+        row_start = np.floor((np.minimum(start[:, 0], end[:, 0]) - lat_margin + 90) / self.cell_size).astype(np.int64)
+        row_end = np.floor((np.maximum(start[:, 0], end[:, 0]) + lat_margin + 90) / self.cell_size).astype(np.int64)
+        column_start = np.floor((np.minimum(start[:, 1], end[:, 1]) - lng_margin + 180) / self.cell_size).astype(np.int64)
+        column_end = np.floor((np.maximum(start[:, 1], end[:, 1]) + lng_margin + 180) / self.cell_size).astype(np.int64)
+
+        widths = column_end - column_start + 1
+        cell_counts = (row_end - row_start + 1) * widths
+        edges = np.repeat(np.arange(len(start)), cell_counts)
+        local = np.arange(len(edges)) - np.repeat(np.cumsum(cell_counts) - cell_counts, cell_counts)
+        keys = (row_start[edges] + local // widths[edges]) * CELL_KEY_STRIDE + column_start[edges] + local % widths[edges]
+
+        # Pair each edge with the POIs of its cells
+        first = np.searchsorted(self.cell_keys, keys, side='left')
+        poi_counts = np.searchsorted(self.cell_keys, keys, side='right') - first
+        pair_edges = np.repeat(edges, poi_counts)
+        local = np.arange(len(pair_edges)) - np.repeat(np.cumsum(poi_counts) - poi_counts, poi_counts)
+        pair_pois = self.cell_pois[np.repeat(first, poi_counts) + local]
+
+        if kinds is not None and len(pair_pois):
+            keep = np.isin(self.kind_array[pair_pois], list(kinds))
+            pair_edges = pair_edges[keep]
+            pair_pois = pair_pois[keep]
+        if not len(pair_pois):
+            return empty
+
+        # Distance from each POI to its paired edge, in a local flat projection
+        scale = np.cos(np.radians(self.lat[pair_pois]))
+        a_y = start[pair_edges, 0]
+        a_x = start[pair_edges, 1] * scale
+        d_y = end[pair_edges, 0] - a_y
+        d_x = end[pair_edges, 1] * scale - a_x
+        p_y = self.lat[pair_pois] - a_y
+        p_x = self.lng[pair_pois] * scale - a_x
+        length = d_x * d_x + d_y * d_y
+        t = np.clip(np.divide(p_x * d_x + p_y * d_y, length, out=np.zeros_like(length), where=length > 0), 0.0, 1.0)
+        offsets = np.hypot(p_x - t * d_x, p_y - t * d_y) * MILES_PER_DEGREE
+
+        within = offsets <= radius_miles
+        pair_edges = pair_edges[within]
+        pair_pois = pair_pois[within]
+        offsets = offsets[within]
+        t = t[within]
+
+        # Keep each POI's closest edge
+        order = np.lexsort((offsets, pair_pois))
+        _, closest = np.unique(pair_pois[order], return_index=True)
+        chosen = order[closest]
+        along = distances[pair_edges[chosen]] + t[chosen] * (
+            distances[pair_edges[chosen] + 1] - distances[pair_edges[chosen]]
+        )
+
+        by_along = np.argsort(along, kind='stable')
+        self._count('corridor_pois', len(chosen))
+        return Corridor(self, pair_pois[chosen][by_along], along[by_along], offsets[chosen][by_along])
+
+    def get_stats(self):
+        """Return a snapshot of query counters"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['pois'] = len(self.names)
+        return stats
+
+
+_poi_index = None
+_poi_index_loaded = False
+_poi_index_lock = threading.Lock()
+
+
+def get_poi_index():
+    """
+    Get the POI index configured in settings.POI_PATH
+
+    Returns:
+        POIIndex shared by the process, or None if no file is configured
+    """
+    global _poi_index, _poi_index_loaded
+    if _poi_index_loaded:
+        return _poi_index
+
+    with _poi_index_lock:
+        if not _poi_index_loaded:
+            path = getattr(settings, 'POI_PATH', None)
+            if path and os.path.exists(path):
+                _poi_index = POIIndex(path, getattr(settings, 'POI_CELL_SIZE', 0.1))
+            _poi_index_loaded = True
+        return _poi_index
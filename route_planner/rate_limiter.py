@@ -0,0 +1,242 @@
+"""
+Rate Limiter module
+
+This module schedules calls to rate-limited upstreams (Nominatim allows
+about one request per second). Tokens come from a bucket whose state is
+kept in a small file under an exclusive flock, so every worker process on
+the host draws from the same budget. Within a process, waiting callers
+are served in priority order and give up once their deadline passes, so
+low-priority traffic is dropped instead of piling up.
+"""
+
+import asyncio
+import fcntl
+import heapq
+import itertools
+import os
+import struct
+import tempfile
+import threading
+import time
+
+
+# Priority classes, served lowest value first
+PRIORITIES = {
+    'route': 0,     # Geocodes needed to plan a trip
+    'geocode': 1,   # Standalone geocode requests
+    'enrich': 2,    # Reverse geocodes naming computed stops
+    'suggest': 3,   # Autocomplete suggestions
+}
+
+# Seconds between queue checks for waiters running on an event loop
+ASYNC_POLL_INTERVAL = 0.05
+
+_STATE = struct.Struct('dd')  # tokens, last refill (wall clock seconds)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a queued request's deadline passes before it gets a token"""
+
+    def __init__(self, host, priority, waited):
+        self.host = host
+        self.priority = priority
+        self.waited = waited
+        super().__init__(
+            f"{host} rate limit: {priority} request dropped after waiting {waited:.2f}s"
+        )
+
+
+class SharedTokenBucket:
+    """Token bucket whose state is shared by all processes through a file"""
+
+    def __init__(self, path, rate, burst):
+        """
+        Initialize bucket
+
+        Args:
+            path: State file shared by all processes
+            rate: Tokens added per second
+            burst: Maximum number of tokens held
+        """
+        self.rate = rate
+        self.burst = burst
+        self.path = path
+        self._fd = None
+        self._fd_lock = threading.Lock()
+
+    def _file(self):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        return self._fd
+
+    def try_take(self):
+        """
+        Take one token if available
+
+        Returns:
+            0 if a token was taken, otherwise seconds until one is available
+        """
+        with self._fd_lock:
+            fd = self._file()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                data = os.pread(fd, _STATE.size, 0)
+                if len(data) == _STATE.size:
+                    tokens, updated = _STATE.unpack(data)
+                    tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+                else:
+                    tokens = self.burst
+
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0.0
+                else:
+                    wait = (1 - tokens) / self.rate
+
+                os.pwrite(fd, _STATE.pack(tokens, now), 0)
+                return wait
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class RateLimiter:
+    """Priority scheduler in front of a shared token bucket"""
+
+    def __init__(self, host, rate, burst=1, deadlines=None, state_path=None):
+        """
+        Initialize scheduler
+
+        Args:
+            host: Name of the upstream host, used in errors and metrics
+            rate: Requests per second allowed across all processes
+            burst: Maximum burst size
+            deadlines: Dictionary of priority name to max seconds queued
+            state_path: Bucket state file; defaults to a file in the temp dir
+        """
+        self.host = host
+        self.deadlines = deadlines or {}
+        self.bucket = SharedTokenBucket(
+            state_path or os.path.join(tempfile.gettempdir(), f'trucking-{host}-bucket'),
+            rate,
+            burst
+        )
+        self._condition = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self.stats = {
+            'granted': {name: 0 for name in PRIORITIES},
+            'dropped': {name: 0 for name in PRIORITIES},
+            'max_queue_depth': 0,
+            'total_wait_seconds': 0.0,
+        }
+
+    def acquire(self, priority='geocode', deadline=None):
+        """
+        Wait for permission to make one request
+
+        Args:
+            priority: Priority class name (see PRIORITIES)
+            deadline: Max seconds to wait; defaults to the class deadline
+
+        Returns:
+            Seconds spent waiting
+
+        Raises:
+            RateLimitExceeded: If no token was granted before the deadline
+        """
+        entry, started, expires = self._enqueue(priority, deadline)
+        try:
+            with self._condition:
+                while True:
+                    granted, wait = self._poll(entry, priority, started, expires)
+                    if granted:
+                        return wait
+                    # Without a token wait, sleep until the head of the queue changes
+                    if expires is not None:
+                        remaining = expires - time.monotonic()
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._condition.wait(wait)
+        finally:
+            self._dequeue(entry)
+
+    async def aacquire(self, priority='geocode', deadline=None):
+        """
+        Async version of acquire for callers running on an event loop
+
+        Async waiters cannot block on the condition, so they poll every
+        ASYNC_POLL_INTERVAL seconds until they reach the head of the queue.
+        """
+        entry, started, expires = self._enqueue(priority, deadline)
+        try:
+            while True:
+                with self._condition:
+                    granted, wait = self._poll(entry, priority, started, expires)
+                if granted:
+                    return wait
+                if wait is None:
+                    wait = ASYNC_POLL_INTERVAL
+                if expires is not None:
+                    wait = min(wait, max(0.0, expires - time.monotonic()))
+                await asyncio.sleep(wait)
+        finally:
+            self._dequeue(entry)
+
+    def _enqueue(self, priority, deadline):
+        """Add a waiter to the queue; returns (entry, start time, expiry time)"""
+        if deadline is None:
+            deadline = self.deadlines.get(priority)
+        started = time.monotonic()
+        expires = started + deadline if deadline is not None else None
+        entry = (PRIORITIES[priority], next(self._sequence))
+
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], len(self._queue))
+        return entry, started, expires
+
+    def _dequeue(self, entry):
+        with self._condition:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+            self._condition.notify_all()
+
+    def _poll(self, entry, priority, started, expires):
+        """
+        Try to take a token for a queued waiter; call with the condition held
+
+        Returns:
+            Tuple (True, seconds waited) once a token is granted, otherwise
+            (False, seconds until the bucket refills), with None for the
+            wait if the waiter is not at the head of the queue
+
+        Raises:
+            RateLimitExceeded: If the waiter's deadline has passed
+        """
+        if expires is not None and time.monotonic() >= expires:
+            self.stats['dropped'][priority] += 1
+            raise RateLimitExceeded(self.host, priority, time.monotonic() - started)
+
+        if self._queue[0] != entry:
+            return False, None
+
+        wait = self.bucket.try_take()
+        if wait:
+            return False, wait
+
+        waited = time.monotonic() - started
+        self.stats['granted'][priority] += 1
+        self.stats['total_wait_seconds'] += waited
+        return True, waited
+
+    def get_stats(self):
+        """Return queue depth and wait-time metrics"""
+        with self._condition:
+            granted = sum(self.stats['granted'].values())
+            return {
+                'queue_depth': len(self._queue),
+                'max_queue_depth': self.stats['max_queue_depth'],
+                'granted': dict(self.stats['granted']),
+                'dropped': dict(self.stats['dropped']),
+                'average_wait_seconds': self.stats['total_wait_seconds'] / granted if granted else 0.0,
+            }
@@ -0,0 +1,221 @@
+"""
+Reverse Geocoder module
+
+This module turns the coordinates of computed HOS stops (rests, breaks,
+fuel stops) into place names drivers can act on. A plan's stops are
+enriched as one batch: stops in the same grid cell share a lookup, cells
+already in the spatial cache or near a known geocoded place are answered
+locally, and the remaining lookups run concurrently through the shared
+Nominatim rate limiter.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+from . import upstream
+from .geocode_cache import LRUCache, MISS, geocode_cache
+from .rate_limiter import RateLimitExceeded
+from .segment_cache import snap_point
+from .singleflight import upstream_flight
+from .upstream import UpstreamError
+
+
+# Stop types whose locations are computed rather than entered by the user
+ENRICHED_STOP_TYPES = ('rest', 'restart', 'sleeper', 'split_rest', 'break', 'fuel')
+
+
+def format_place_name(data):
+    """
+    Build a short place name from a Nominatim reverse geocoding answer
+
+    Args:
+        data: Decoded JSON response of the /reverse endpoint
+
+    Returns:
+        String like "I 80, Joliet, Illinois", or None if nothing was found
+    """
+    address = data.get('address') or {}
+    place = next(
+        (address[field] for field in ('city', 'town', 'village', 'hamlet', 'county') if address.get(field)),
+        None
+    )
+    parts = [address.get('road'), place, address.get('state')]
+    parts = [part for part in parts if part]
+    if len(parts) >= 2:
+        return ', '.join(parts)
+    return data.get('display_name')
+
+
+def short_display_name(display_name, parts=3):
+    """Keep the first few comma-separated parts of a Nominatim display name"""
+    return ', '.join(part.strip() for part in display_name.split(',')[:parts])
+
+
+class ReverseGeocoder:
+    """Batched reverse geocoder with a grid-snapped spatial cache"""
+
+    def __init__(self):
+        """Initialize from Django settings"""
+        self.grid_meters = getattr(settings, 'REVERSE_GEOCODE_GRID_METERS', 500)
+        self.max_workers = getattr(settings, 'REVERSE_GEOCODE_MAX_WORKERS', 4)
+        self.zoom = getattr(settings, 'REVERSE_GEOCODE_ZOOM', 16)
+        self.nearby_meters = getattr(settings, 'REVERSE_GEOCODE_NEARBY_METERS', 300)
+        self.memory = LRUCache(
+            getattr(settings, 'REVERSE_GEOCODE_CACHE_MAX_SIZE', 4096),
+            getattr(settings, 'REVERSE_GEOCODE_CACHE_TTL', 60 * 60 * 24 * 30)
+        )
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'stops': 0,
+            'deduplicated': 0,
+            'cache_hits': 0,
+            'nearby_hits': 0,
+            'lookups': 0,
+            'failures': 0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def make_key(self, lat, lng):
+        """Build the cache key for the grid cell containing a point"""
+        return snap_point(lat, lng, self.grid_meters)
+
+    def enrich_stops(self, stops, stop_types=ENRICHED_STOP_TYPES, skip_addresses=()):
+        """
+        Replace the placeholder addresses of computed stops with place names
+
+        Location dictionaries are updated in place, so segments sharing a
+        location object with a stop pick up the same name. Stops whose
+        lookup fails or is dropped by the rate limiter keep their address.
+
+        Args:
+            stops: List of Stop objects from the HOS calculator
+            stop_types: Stop types to enrich
+            skip_addresses: Addresses entered by the user, left untouched
+
+        Returns:
+            Number of stops that received a place name
+        """
+        # Group stop locations by grid cell so nearby stops share a lookup
+        cells = {}
+        for stop in stops:
+            location = stop.location
+            if stop.stop_type not in stop_types or location['address'] in skip_addresses:
+                continue
+            if location.get('kind'):
+                # Facilities from the POI index already carry their name
+                continue
+            key = self.make_key(location['lat'], location['lng'])
+            cells.setdefault(key, []).append(location)
+
+        stop_count = sum(len(locations) for locations in cells.values())
+        self._count('stops', stop_count)
+        self._count('deduplicated', stop_count - len(cells))
+
+        names = {}
+        pending = []
+        for key, locations in cells.items():
+            lat, lng = locations[0]['lat'], locations[0]['lng']
+            name = self.memory.get(key)
+            if name is not MISS:
+                self._count('cache_hits')
+                names[key] = name
+                continue
+            # A place already geocoded close by names the stop just as well
+            place = geocode_cache.nearby(lat, lng, self.nearby_meters) if self.nearby_meters else None
+            if place is not None:
+                self._count('nearby_hits')
+                names[key] = short_display_name(place['display_name'])
+                self.memory.set(key, names[key])
+            else:
+                pending.append((key, lat, lng))
+
+        if pending:
+            # The rate limiter paces these; running them concurrently keeps
+            # the batch from also paying each request's round trip in turn
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pending))) as executor:
+                futures = [
+                    (key, executor.submit(self._lookup_in_worker_thread, key, lat, lng))
+                    for key, lat, lng in pending
+                ]
+                for key, future in futures:
+                    name = future.result()
+                    if name is not MISS:
+                        names[key] = name
+
+        enriched = 0
+        for key, locations in cells.items():
+            name = names.get(key)
+            if name:
+                for location in locations:
+                    location['address'] = name
+                enriched += len(locations)
+        return enriched
+
+    def _lookup_in_worker_thread(self, key, lat, lng):
+        """Look up one cell in a pool thread; MISS if the lookup failed"""
+        try:
+            return upstream_flight.do(
+                'reverse:{}:{}'.format(*key),
+                lambda: self._lookup(key, lat, lng)
+            )
+        except (UpstreamError, RateLimitExceeded, ValueError):
+            self._count('failures')
+            return MISS
+        finally:
+            connections.close_all()
+
+    def _lookup(self, key, lat, lng):
+        """
+        Reverse geocode a point with Nominatim and cache the answer
+
+        Returns:
+            Place name, or None if Nominatim has no place there
+        """
+        self._count('lookups')
+        response = upstream.get(
+            'nominatim',
+            '/reverse',
+            params={
+                'lat': f'{lat:.6f}',
+                'lon': f'{lng:.6f}',
+                'format': 'json',
+                'zoom': self.zoom,
+                'addressdetails': 1
+            },
+            priority='enrich'
+        )
+        name = format_place_name(response.json())
+        self.memory.set(key, name)
+        return name
+
+    def get_stats(self):
+        """Return a snapshot of batch and cache counters"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['size'] = len(self.memory)
+        return stats
+
+
+# Process-wide instance used to enrich route plans
+reverse_geocoder = ReverseGeocoder()
+
+
+def enrich_schedule_stops(schedule):
+    """
+    Name the rest, break and fuel stops of an HOS schedule
+
+    Args:
+        schedule: Schedule returned by build_hos_schedule
+
+    Returns:
+        The same schedule, with stop locations updated in place
+    """
+    trip_addresses = {location['address'] for location in schedule.locations}
+    reverse_geocoder.enrich_stops(schedule.stops, skip_addresses=trip_addresses)
+    return schedule
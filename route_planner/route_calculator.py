@@ -5,47 +5,203 @@ This module is responsible for calculating routes between locations
 using external mapping APIs.
 """
 
-import requests
-import polyline
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote
 
+import numpy as np
+from django.conf import settings
+from django.db import connections
 
-def geocode_address(address):
+from . import upstream
+from .gazetteer import get_gazetteer
+from .geometry import (
+    cumulative_distances,
+    decode_polyline,
+    encode_polyline,
+    merge_geometries
+)
+from .hos_batch import batch_hos_schedules
+from .routing import get_routing_backend
+from .geocode_cache import geocode_cache, normalize_address, MISS
+from .segment_cache import segment_cache
+from .singleflight import upstream_flight
+
+
+class LocationNotFoundError(ValueError):
+    """Raised when the geocoder has no match for an address"""
+
+
+class GeocodingError(ValueError):
+    """Raised when one of the trip locations could not be geocoded"""
+    
+    def __init__(self, label, address, error):
+        self.label = label
+        self.address = address
+        self.error = error
+        super().__init__(
+            f"Failed to geocode {label} location '{address}': {error}"
+        )
+
+
+def geocode_address(address, priority='geocode'):
     """
     Convert address to coordinates using Nominatim
     
+    Known places are resolved from the local gazetteer first. Other results
+    (including "not found" answers) are cached in the two-tier geocode
+    cache so repeated addresses skip the upstream call. Expired results are
+    served stale while a fresh answer is fetched in the background.
+    
     Args:
         address: String address to geocode
+        priority: Nominatim scheduling class ('route' for trip planning,
+                  'geocode' for standalone lookups)
         
     Returns:
         Dictionary with lat and lng
     """
+    gazetteer = get_gazetteer()
+    if gazetteer is not None:
+        place = gazetteer.lookup(address)
+        if place is not None:
+            return {'address': address, **place}
+    
+    cached = geocode_cache.get(address)
+    if cached is MISS:
+        key = 'geocode:' + normalize_address(address)
+        fetch = lambda: _geocode_uncached(address, priority)
+        
+        cached = geocode_cache.get_stale(address)
+        if cached is not MISS:
+            upstream_flight.refresh(key, fetch)
+        else:
+            # Concurrent lookups of the same address share one upstream call
+            cached = upstream_flight.do(key, fetch)
+    if cached is None:
+        raise LocationNotFoundError(f"Location not found: {address}")
+    
+    return {'address': address, **cached}
+
+
+def _geocode_uncached(address, priority):
+    """
+    Geocode an address with Nominatim and store the answer in the cache
+    
+    Args:
+        address: String address to geocode
+        priority: Nominatim scheduling class
+        
+    Returns:
+        Dictionary with lat, lng and display_name, or None if not found
+    """
+    # Another worker may have resolved the address while we waited
+    cached = geocode_cache.get(address, record_stats=False)
+    if cached is not MISS:
+        return cached
+    
     # Use OpenStreetMap Nominatim API for geocoding (free)
-    response = requests.get(
-        'https://nominatim.openstreetmap.org/search',
+    response = upstream.get(
+        'nominatim',
+        '/search',
         params={
             'q': address,
             'format': 'json',
             'limit': 1
         },
-        headers={'User-Agent': 'TruckingRouteApp/1.0'}
+        priority=priority
     )
     
-    data = response.json()
+    return _store_geocode(address, response.json())
+
+
+def _store_geocode(address, data):
+    """
+    Cache a Nominatim search answer for an address
     
-    if not data:
-        raise ValueError(f"Location not found: {address}")
+    Args:
+        address: String address that was geocoded
+        data: Decoded JSON list returned by Nominatim
         
-    return {
-        'address': address,
+    Returns:
+        Dictionary with lat, lng and display_name, or None if not found
+    """
+    if not data:
+        geocode_cache.set(address, None)
+        return None
+    
+    location = {
         'lat': float(data[0]['lat']),
         'lng': float(data[0]['lon']),
         'display_name': data[0]['display_name']
     }
+    geocode_cache.set(address, location)
+        
+    return location
+
+
+def suggest_locations(query, limit=5):
+    """
+    Get location suggestions for a partial address
+    
+    Args:
+        query: Partial location name typed by the user
+        limit: Maximum number of suggestions
+        
+    Returns:
+        List of dictionaries with display_name, lat and lng
+    """
+    gazetteer = get_gazetteer()
+    if gazetteer is not None:
+        suggestions = gazetteer.suggest(query, limit)
+        if suggestions:
+            return suggestions
+    
+    return upstream_flight.do(
+        f'suggest:{limit}:' + normalize_address(query),
+        lambda: _suggest_locations_upstream(query, limit)
+    )
 
 
-def calculate_route(current_location, pickup_location, dropoff_location):
+def _suggest_locations_upstream(query, limit):
+    """Get location suggestions from Nominatim"""
+    # Use OpenStreetMap Nominatim API for location suggestions
+    response = upstream.get(
+        'nominatim',
+        '/search',
+        params={
+            'q': query,
+            'format': 'json',
+            'limit': limit
+        },
+        priority='suggest'
+    )
+    
+    return _format_suggestions(response.json())
+
+
+def _format_suggestions(data):
+    """Format Nominatim search results as suggestions for the frontend"""
+    suggestions = []
+    for item in data:
+        suggestions.append({
+            'display_name': item['display_name'],
+            'lat': float(item['lat']),
+            'lng': float(item['lon'])
+        })
+    
+    return suggestions
+
+
+def _run_in_worker_thread(func, *args):
+    """Run func in a pool thread and release that thread's DB connections"""
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
+
+
+def calculate_route(current_location, pickup_location, dropoff_location, geometry='full', steps=False):
     """
     Calculate route between locations
     
@@ -53,82 +209,281 @@ def calculate_route(current_location, pickup_location, dropoff_location):
         current_location: String address of starting point
         pickup_location: String address of pickup location
         dropoff_location: String address of dropoff location
+        geometry: Route geometry detail ('none', 'simplified' or 'full')
+        steps: Whether to fetch turn-by-turn steps for each leg
         
     Returns:
         Dictionary with route information
     """
-    # Step 1: Geocode all locations
-    try:
-        current_loc = geocode_address(current_location)
-        pickup_loc = geocode_address(pickup_location)
-        dropoff_loc = geocode_address(dropoff_location)
-    except Exception as e:
-        raise ValueError(f"Failed to geocode one or more locations: {str(e)}")
+    return calculate_multi_stop_route([
+        ('current', current_location),
+        ('pickup', pickup_location),
+        ('dropoff', dropoff_location)
+    ], geometry, steps)
+
+
+def calculate_multi_stop_route(addresses, geometry='full', steps=False):
+    """
+    Calculate route through any number of stops with a single routing call
+    
+    Args:
+        addresses: List of (label, address) tuples in driving order,
+                   e.g. [('current', ...), ('pickup', ...), ('dropoff', ...)]
+        geometry: Route geometry detail ('none', 'simplified' or 'full')
+        steps: Whether to fetch turn-by-turn steps for each leg
+        
+    Returns:
+        Dictionary with route information (one segment per leg)
+    """
+    # Geocode all locations concurrently
+    with ThreadPoolExecutor(max_workers=len(addresses)) as executor:
+        geocode_futures = [
+            executor.submit(_run_in_worker_thread, geocode_address, address, 'route')
+            for _, address in addresses
+        ]
+        
+        # Report geocoding failures in input order
+        locations = []
+        for (label, address), future in zip(addresses, geocode_futures):
+            try:
+                locations.append(future.result())
+            except Exception as e:
+                raise GeocodingError(label, address, e) from e
+    
+    # One multi-waypoint request returns every leg
+    route = calculate_route_legs(locations, geometry, steps)
+    
+    return _combine_route(locations, route)
+
+
+def _combine_route(locations, route):
+    """Build the route information dictionary for a multi-stop route"""
+    result = {
+        'locations': locations,
+        'segments': route['segments'],
+        'total_distance': sum(segment['distance'] for segment in route['segments']),
+        'total_duration': sum(segment['duration'] for segment in route['segments']),
+        'polyline': route['polyline'],
+        'geometry': route['geometry'],
+        'cumulative_distances': cumulative_distances(route['geometry'])
+    }
+    
+    return result
+
+
+def calculate_matrix(origins, destinations, current_cycle_hours=None):
+    """
+    Calculate travel times and distances between many origins and destinations
+    
+    Addresses go through the geocode layer (gazetteer and cache first); all
+    pairs come from the routing backend's matrix service, without route
+    geometry.
+    
+    Args:
+        origins: List of addresses or dictionaries with lat and lng
+        destinations: List of addresses or dictionaries with lat and lng
+        current_cycle_hours: If given, also estimate HOS-adjusted trip
+                             hours and arrival times for a driver with
+                             this many hours used in the 70-hour cycle
+        
+    Returns:
+        Dictionary with resolved origins and destinations and durations
+        (hours) and distances (miles) matrices, one row per origin
+    """
+    points = list(origins) + list(destinations)
+    addresses = list(dict.fromkeys(point for point in points if isinstance(point, str)))
+    
+    resolved = {}
+    if addresses:
+        # Geocode each distinct address once, concurrently
+        with ThreadPoolExecutor(max_workers=min(len(addresses), 8)) as executor:
+            futures = [
+                executor.submit(_run_in_worker_thread, geocode_address, address, 'route')
+                for address in addresses
+            ]
+            for address, future in zip(addresses, futures):
+                try:
+                    resolved[address] = future.result()
+                except Exception as e:
+                    label = 'origin' if address in origins else 'destination'
+                    raise GeocodingError(label, address, e) from e
+    
+    def location(point):
+        if isinstance(point, str):
+            return resolved[point]
+        address = point.get('address')
+        if not address:
+            # Name bare coordinates after a known place close by, if any
+            place = geocode_cache.nearby(point['lat'], point['lng'], nearby_meters)
+            address = place['display_name'] if place else f"{point['lat']:.6f},{point['lng']:.6f}"
+        return {
+            'address': address,
+            'lat': point['lat'],
+            'lng': point['lng']
+        }
     
-    # Step 2: Calculate route from current to pickup
-    first_leg = calculate_route_segment(current_loc, pickup_loc)
+    nearby_meters = getattr(settings, 'GEOCODE_NEARBY_METERS', 100)
     
-    # Step 3: Calculate route from pickup to dropoff
-    second_leg = calculate_route_segment(pickup_loc, dropoff_loc)
+    origin_locations = [location(point) for point in origins]
+    destination_locations = [location(point) for point in destinations]
+    
+    durations, distances = get_routing_backend().table(origin_locations, destination_locations)
     
-    # Combine results
     result = {
-        'locations': [current_loc, pickup_loc, dropoff_loc],
-        'segments': [first_leg, second_leg],
-        'total_distance': first_leg['distance'] + second_leg['distance'],
-        'total_duration': first_leg['duration'] + second_leg['duration'],
-        'polyline': first_leg['polyline'] + second_leg['polyline']
+        'origins': origin_locations,
+        'destinations': destination_locations,
+        'durations': durations,
+        'distances': distances
     }
     
+    if current_cycle_hours is not None:
+        start_time = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+        # Every pair is a one-leg trip of a batch
+        driving_hours = np.array(
+            [[np.nan if duration is None else duration for duration in row] for row in durations],
+            dtype=np.float64
+        ).reshape(len(origin_locations), len(destination_locations))
+        miles = np.array(
+            [[np.nan if distance is None else distance for distance in row] for row in distances],
+            dtype=np.float64
+        ).reshape(driving_hours.shape)
+        trip_hours = batch_hos_schedules(
+            driving_hours.ravel(), miles.ravel(), current_cycle_hours, handling=False, start_time=start_time
+        )['eta_hours'].reshape(driving_hours.shape)
+        # Unroutable pairs come back as NaN
+        trip_hours = [[None if np.isnan(hours) else float(hours) for hours in row] for row in trip_hours]
+        result['start_time'] = start_time
+        result['hos_durations'] = trip_hours
+        result['arrival_times'] = [
+            [None if hours is None else start_time + datetime.timedelta(hours=hours) for hours in row]
+            for row in trip_hours
+        ]
+    
     return result
 
 
-def calculate_route_segment(origin, destination):
+def calculate_route_segment(origin, destination, geometry='full', steps=False):
     """
     Calculate route between two points
     
     Args:
         origin: Dictionary with lat and lng of starting point
         destination: Dictionary with lat and lng of ending point
+        geometry: Route geometry detail; 'none' when only distance and
+                  duration are needed
+        steps: Whether to fetch turn-by-turn steps
         
     Returns:
         Dictionary with segment information
     """
-    # Use OSRM API (Open Source Routing Machine) - free and open source
-    # This is a public instance - for production, consider hosting your own
-    url = (
-        f"http://router.project-osrm.org/route/v1/driving/"
-        f"{origin['lng']},{origin['lat']};"
-        f"{destination['lng']},{destination['lat']}"
-        f"?overview=full&alternatives=false&steps=true"
-    )
-    
-    response = requests.get(url)
+    return calculate_route_legs([origin, destination], geometry, steps)['segments'][0]
+
+
+def calculate_route_legs(waypoints, geometry='full', steps=False):
+    """
+    Calculate route through a list of points with one routing request
     
-    if response.status_code != 200:
-        raise ValueError(f"Route calculation failed: {response.text}")
+    Legs found in the segment cache are reused; if every leg is cached the
+    routing call is skipped entirely. If every leg is at least cached
+    stale, the stale legs are used and refreshed in the background.
+    Cached legs are only reused if they hold the requested detail.
     
-    data = response.json()
+    Args:
+        waypoints: List of dictionaries with lat and lng, in driving order
+        geometry: Route geometry detail ('none', 'simplified' or 'full')
+        steps: Whether to fetch turn-by-turn steps for each leg
+        
+    Returns:
+        Dictionary with one segment per leg, the encoded polyline of the
+        whole route and its decoded (n, 2) coordinate array (None and an
+        empty array when geometry is 'none')
+    """
+    legs = _cached_legs(waypoints, geometry, steps)
+    route_polyline = None
     
-    if data['code'] != 'Ok':
-        raise ValueError(f"Route calculation failed: {data['message']}")
+    if any(leg is MISS for leg in legs):
+        backend = get_routing_backend()
+        key = _route_key(backend, waypoints, geometry, steps)
+        fetch = lambda: backend.route(waypoints, geometry, steps)
+        
+        legs = _cached_legs(waypoints, geometry, steps, stale=True)
+        if any(leg is MISS for leg in legs):
+            # Concurrent identical route requests share one routing call
+            route = upstream_flight.do(key, fetch)
+            _store_legs(waypoints, route, geometry)
+            legs, route_polyline = route
+        else:
+            upstream_flight.refresh(key, fetch, lambda route: _store_legs(waypoints, route, geometry))
     
-    route = data['routes'][0]
+    return _assemble_route(waypoints, legs, route_polyline, geometry, steps)
+
+
+def _cached_legs(waypoints, geometry, steps, stale=False):
+    """Look up every leg in the segment cache; MISS for legs not cached"""
+    lookup = segment_cache.get_stale if stale else segment_cache.get
+    return [
+        lookup(origin, destination, geometry, steps)
+        for origin, destination in zip(waypoints, waypoints[1:])
+    ]
+
+
+def _store_legs(waypoints, route, geometry):
+    """Store the legs of a routing result in the segment cache"""
+    for origin, destination, leg in zip(waypoints, waypoints[1:], route[0]):
+        segment_cache.set(origin, destination, leg, geometry)
+
+
+def _route_key(backend, waypoints, geometry, steps):
+    """Build the single-flight key of a routing request"""
+    return f'route:{backend.name}:{geometry}:{int(steps)}:' + ';'.join(
+        f"{point['lat']:.5f},{point['lng']:.5f}" for point in waypoints
+    )
+
+
+def _assemble_route(waypoints, legs, route_polyline, geometry, steps):
+    """
+    Build segments and the whole-route geometry from routed legs
     
-    # Convert distance to miles and duration to hours
-    distance_miles = route['distance'] * 0.000621371  # meters to miles
-    duration_hours = route['duration'] / 3600  # seconds to hours
+    Args:
+        waypoints: List of dictionaries with lat and lng, in driving order
+        legs: One leg dictionary per pair of consecutive waypoints
+        route_polyline: Encoded polyline of the whole route if the
+                        routing call returned one, otherwise None
+        geometry: Route geometry detail
+        steps: Whether legs carry turn-by-turn steps
+        
+    Returns:
+        Dictionary as returned by calculate_route_legs
+    """
+    if geometry == 'none':
+        route_polyline = None
+        coordinates = decode_polyline('')
+    elif route_polyline is not None:
+        coordinates = decode_polyline(route_polyline)
+    elif len(legs) == 1:
+        route_polyline = legs[0]['polyline']
+        coordinates = decode_polyline(route_polyline)
+    else:
+        # Merge decoded legs and re-encode once; encoded strings cannot be
+        # concatenated because each one's deltas start from (0, 0)
+        coordinates = merge_geometries([decode_polyline(leg['polyline']) for leg in legs])
+        route_polyline = encode_polyline(coordinates)
     
-    # Get encoded polyline
-    encoded_polyline = route['geometry']
+    segments = []
+    for origin, destination, leg in zip(waypoints, waypoints[1:], legs):
+        segment = {
+            'start_location': origin,
+            'end_location': destination,
+            'distance': leg['distance'],
+            'duration': leg['duration'],
+            'polyline': leg['polyline'] if geometry != 'none' else None
+        }
+        if steps:
+            segment['steps'] = leg['steps']
+        segments.append(segment)
     
-    # Create segment
-    segment = {
-        'start_location': origin,
-        'end_location': destination,
-        'distance': distance_miles,
-        'duration': duration_hours,
-        'polyline': encoded_polyline
+    return {
+        'segments': segments,
+        'polyline': route_polyline,
+        'geometry': coordinates
     }
-    
-    return segment
@@ -0,0 +1,282 @@
+"""
+Routing Backends module
+
+This module defines the interface used by route_calculator to route
+through a list of waypoints and to build distance/duration matrices, with
+the OSRM HTTP implementation and a factory that picks the backend
+configured in settings.ROUTING_BACKEND.
+"""
+
+import abc
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import upstream
+from .geometry import decode_polyline, encode_polyline, split_at_points
+
+
+METERS_TO_MILES = 0.000621371
+
+# Route geometry detail levels, least to most detailed
+GEOMETRY_LEVELS = ('none', 'simplified', 'full')
+
+
+class RoutingBackend(abc.ABC):
+    """Interface for routing engines"""
+
+    name = None
+
+    @abc.abstractmethod
+    def route(self, waypoints, geometry='full', steps=False):
+        """
+        Route through a list of points
+
+        Args:
+            waypoints: List of dictionaries with lat and lng, in driving order
+            geometry: Route geometry detail, one of GEOMETRY_LEVELS
+            steps: Whether to include turn-by-turn steps for each leg
+
+        Returns:
+            Tuple of (list of leg dictionaries with distance in miles,
+            duration in hours, encoded polyline and, if requested, steps;
+            encoded polyline of the whole route). Polylines are None when
+            geometry is 'none'.
+        """
+
+    async def aroute(self, waypoints, geometry='full', steps=False):
+        """
+        Async version of route
+
+        The default runs route in a worker thread, which suits engines
+        that compute routes in-process.
+        """
+        return await sync_to_async(self.route, thread_sensitive=False)(waypoints, geometry, steps)
+
+    @abc.abstractmethod
+    def table(self, sources, destinations):
+        """
+        Compute travel times and distances from every source to every destination
+
+        Args:
+            sources: List of dictionaries with lat and lng
+            destinations: List of dictionaries with lat and lng
+
+        Returns:
+            Tuple of (durations, distances), each a list with one row per
+            source and one column per destination, in hours and miles;
+            None where no route exists
+        """
+
+
+class OSRMRoutingBackend(RoutingBackend):
+    """Routing through the OSRM HTTP API"""
+
+    name = 'osrm'
+
+    def route(self, waypoints, geometry='full', steps=False):
+        """Request a route through the waypoints from OSRM"""
+        path, params = self._route_request(waypoints, geometry, steps)
+        return self._parse_route(upstream.get('osrm', path, params=params), geometry, steps)
+
+    async def aroute(self, waypoints, geometry='full', steps=False):
+        """Request a route from OSRM without blocking the event loop"""
+        path, params = self._route_request(waypoints, geometry, steps)
+        return self._parse_route(await upstream.aget('osrm', path, params=params), geometry, steps)
+
+    @staticmethod
+    def _route_request(waypoints, geometry, steps):
+        """Build the path and query parameters of a route request"""
+        # Use OSRM API (Open Source Routing Machine) - free and open source
+        # This is a public instance - for production, consider hosting your own
+        path = "/route/v1/driving/" + ';'.join(
+            f"{point['lng']},{point['lat']}" for point in waypoints
+        )
+
+        # Only ask for what the caller reads; steps and a full overview
+        # make up most of the response size
+        params = {
+            'overview': 'false' if geometry == 'none' else geometry,
+            'alternatives': 'false',
+            'steps': 'true' if steps else 'false'
+        }
+        return path, params
+
+    @staticmethod
+    def _parse_route(response, geometry, steps):
+        """Convert an OSRM route response into legs and the route polyline"""
+        if response.status_code != 200:
+            raise ValueError(f"Route calculation failed: {response.text}")
+
+        data = response.json()
+
+        if data['code'] != 'Ok':
+            raise ValueError(f"Route calculation failed: {data['message']}")
+
+        route = data['routes'][0]
+        route_polyline = route.get('geometry') if geometry != 'none' else None
+
+        if route_polyline is None:
+            leg_polylines = [None] * len(route['legs'])
+        elif len(route['legs']) == 1:
+            leg_polylines = [route_polyline]
+        else:
+            # Cut the overview at the snapped intermediate waypoints
+            leg_polylines = [
+                encode_polyline(piece)
+                for piece in split_at_points(
+                    decode_polyline(route_polyline),
+                    [waypoint['location'][::-1] for waypoint in data['waypoints'][1:-1]],
+                    [leg['distance'] for leg in route['legs']]
+                )
+            ]
+
+        legs = []
+        for leg, leg_polyline in zip(route['legs'], leg_polylines):
+            result = {
+                # Convert distance to miles and duration to hours
+                'distance': leg['distance'] * METERS_TO_MILES,
+                'duration': leg['duration'] / 3600,  # seconds to hours
+                'polyline': leg_polyline
+            }
+            if steps:
+                result['steps'] = [
+                    {
+                        'name': step.get('name', ''),
+                        'maneuver': ' '.join(
+                            part for part in (
+                                step['maneuver'].get('type'),
+                                step['maneuver'].get('modifier')
+                            ) if part
+                        ),
+                        'distance': step['distance'] * METERS_TO_MILES,
+                        'duration': step['duration'] / 3600
+                    }
+                    for step in leg['steps']
+                ]
+            legs.append(result)
+
+        return legs, route_polyline
+
+    def table(self, sources, destinations):
+        """Request the matrix from the OSRM table service, in chunks if large"""
+        max_size = getattr(settings, 'MATRIX_MAX_TABLE_SIZE', 100)
+        # Each request may hold at most max_size coordinates in total
+        source_chunk = max(1, min(len(sources), max_size // 2))
+        destination_chunk = max(1, min(len(destinations), max_size - source_chunk))
+        source_chunk = max(1, min(len(sources), max_size - destination_chunk))
+
+        blocks = [
+            (row, column)
+            for row in range(0, len(sources), source_chunk)
+            for column in range(0, len(destinations), destination_chunk)
+        ]
+
+        def fetch(block):
+            row, column = block
+            return self._table_request(
+                sources[row:row + source_chunk],
+                destinations[column:column + destination_chunk]
+            )
+
+        if len(blocks) == 1:
+            results = [fetch(blocks[0])]
+        else:
+            workers = getattr(settings, 'MATRIX_MAX_CONCURRENT_REQUESTS', 4)
+            with ThreadPoolExecutor(max_workers=min(workers, len(blocks))) as executor:
+                results = list(executor.map(fetch, blocks))
+
+        durations = [[None] * len(destinations) for _ in sources]
+        distances = [[None] * len(destinations) for _ in sources]
+        for (row, column), (block_durations, block_distances) in zip(blocks, results):
+            for i, (duration_row, distance_row) in enumerate(zip(block_durations, block_distances)):
+                durations[row + i][column:column + len(duration_row)] = duration_row
+                distances[row + i][column:column + len(distance_row)] = distance_row
+
+        return durations, distances
+
+    def _table_request(self, sources, destinations):
+        """Make one OSRM table request for a block of the matrix"""
+        points = list(sources) + list(destinations)
+        path = "/table/v1/driving/" + ';'.join(
+            f"{point['lng']},{point['lat']}" for point in points
+        )
+
+        response = upstream.get(
+            'osrm',
+            path,
+            params={
+                'sources': ';'.join(str(i) for i in range(len(sources))),
+                'destinations': ';'.join(str(i) for i in range(len(sources), len(points))),
+                'annotations': 'duration,distance'
+            }
+        )
+
+        if response.status_code != 200:
+            raise ValueError(f"Matrix calculation failed: {response.text}")
+
+        data = response.json()
+
+        if data['code'] != 'Ok':
+            raise ValueError(f"Matrix calculation failed: {data['message']}")
+
+        durations = [
+            [None if value is None else value / 3600 for value in row]  # seconds to hours
+            for row in data['durations']
+        ]
+        distances = [
+            [None if value is None else value * METERS_TO_MILES for value in row]
+            for row in data['distances']
+        ]
+        return durations, distances
+
+
+def get_route_detail(endpoint, geometry=None, steps=None):
+    """
+    Resolve the route detail for a request
+
+    Args:
+        endpoint: Endpoint name, a key of settings.ROUTE_DETAIL
+        geometry: Geometry level asked for by the request, if any
+        steps: Whether the request asked for steps, if it said
+
+    Returns:
+        Tuple of (geometry level, steps flag)
+    """
+    defaults = getattr(settings, 'ROUTE_DETAIL', {}).get(endpoint, {})
+    if geometry is None:
+        geometry = defaults.get('geometry', 'full')
+    if steps is None:
+        steps = defaults.get('steps', False)
+    return geometry, steps
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_routing_backend():
+    """
+    Get the routing backend configured in settings.ROUTING_BACKEND
+
+    Returns:
+        RoutingBackend instance shared by the process
+    """
+    global _backend
+    if _backend is not None:
+        return _backend
+
+    with _backend_lock:
+        if _backend is None:
+            name = getattr(settings, 'ROUTING_BACKEND', 'osrm')
+            if name == 'osrm':
+                _backend = OSRMRoutingBackend()
+            elif name == 'local':
+                # numpy-backed engine, only imported when configured
+                from .local_router import LocalRoutingBackend
+                _backend = LocalRoutingBackend(settings.ROUTING_GRAPH_DIR)
+            else:
+                raise ValueError(f"Unknown routing backend: {name}")
+        return _backend
@@ -0,0 +1,157 @@
+"""
+Schedule module
+
+This module defines the compact schedule model shared by the HOS
+calculator, the log generator and the response serializers. Stops and
+segments are slotted objects that keep their times as hour offsets from
+the schedule start and share location dictionaries with the route;
+datetimes are only computed when a schedule is rendered.
+"""
+
+import datetime
+
+
+def _at(origin, offset):
+    """Return the datetime an hour offset after the schedule start"""
+    return origin + datetime.timedelta(hours=offset)
+
+
+class Stop:
+    """A stop of the schedule (start, pickup, dropoff, break, fuel, rest, end)"""
+
+    __slots__ = ('origin', 'location', 'stop_type', 'start', 'duration')
+
+    def __init__(self, origin, location, stop_type, start, duration=0):
+        """
+        Args:
+            origin: Datetime the schedule starts at
+            location: Location dictionary with address, lat and lng
+            stop_type: Kind of stop, e.g. 'rest', 'pickup', 'fuel'
+            start: Arrival, in hours after the schedule start
+            duration: Length of the stop in hours
+        """
+        self.origin = origin
+        self.location = location
+        self.stop_type = stop_type
+        self.start = start
+        self.duration = duration
+
+    @property
+    def end(self):
+        """Departure, in hours after the schedule start"""
+        return self.start + self.duration
+
+    @property
+    def arrival_time(self):
+        return _at(self.origin, self.start)
+
+    @property
+    def departure_time(self):
+        return _at(self.origin, self.end)
+
+    def as_dict(self):
+        """Return the stop in its public dictionary form"""
+        return {
+            'location': self.location,
+            'arrival_time': self.arrival_time,
+            'departure_time': self.departure_time,
+            'stop_type': self.stop_type,
+            'duration': self.duration
+        }
+
+
+class Segment:
+    """A stretch of driving between two locations"""
+
+    __slots__ = ('origin', 'start_location', 'end_location', 'distance', 'duration', 'start')
+
+    def __init__(self, origin, start_location, end_location, distance, duration, start):
+        """
+        Args:
+            origin: Datetime the schedule starts at
+            start_location: Location dictionary where the drive starts
+            end_location: Location dictionary where the drive ends
+            distance: Distance in miles
+            duration: Driving time in hours
+            start: Departure, in hours after the schedule start
+        """
+        self.origin = origin
+        self.start_location = start_location
+        self.end_location = end_location
+        self.distance = distance
+        self.duration = duration
+        self.start = start
+
+    @property
+    def end(self):
+        """Arrival, in hours after the schedule start"""
+        return self.start + self.duration
+
+    @property
+    def start_time(self):
+        return _at(self.origin, self.start)
+
+    @property
+    def end_time(self):
+        return _at(self.origin, self.end)
+
+    def as_dict(self):
+        """Return the segment in its public dictionary form"""
+        return {
+            'start_location': self.start_location,
+            'end_location': self.end_location,
+            'distance': self.distance,
+            'duration': self.duration,
+            'start_time': self.start_time,
+            'end_time': self.end_time
+        }
+
+
+class Schedule:
+    """An HOS-compliant schedule: stops and driving segments in time order"""
+
+    __slots__ = ('start_time', 'locations', 'stops', 'segments', 'end')
+
+    def __init__(self, start_time, locations):
+        """
+        Args:
+            start_time: Datetime the schedule starts at
+            locations: Trip location dictionaries (current, pickup, dropoff)
+        """
+        self.start_time = start_time
+        self.locations = locations
+        self.stops = []
+        self.segments = []
+        self.end = 0
+
+    @property
+    def end_time(self):
+        return _at(self.start_time, self.end)
+
+    def add_stop(self, location, stop_type, start, duration=0):
+        """Append a stop and return its departure offset"""
+        self.stops.append(Stop(self.start_time, location, stop_type, start, duration))
+        return start + duration
+
+    def add_segment(self, start_location, end_location, distance, duration, start):
+        """Append a driving segment and return its arrival offset"""
+        self.segments.append(Segment(self.start_time, start_location, end_location, distance, duration, start))
+        return start + duration
+
+    def as_dict(self, route_data):
+        """
+        Return the schedule in the dictionary form of calculate_schedule
+
+        Args:
+            route_data: Route information the schedule was built for
+
+        Returns:
+            Shallow copy of route_data with stops, segments, start_time and
+            end_time; the route's own values are shared, not copied
+        """
+        result = dict(route_data)
+        result['stops'] = [stop.as_dict() for stop in self.stops]
+        result['segments'] = [segment.as_dict() for segment in self.segments]
+        result['start_time'] = self.start_time
+        result['end_time'] = self.end_time
+        return result
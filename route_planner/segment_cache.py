@@ -0,0 +1,221 @@
+"""
+Segment Cache module
+
+This module caches routed segments keyed by their origin and destination
+snapped to a fixed grid, so repeat plans between the same yards skip the
+routing call entirely. Endpoints are first collapsed onto a shared anchor
+point found in a spatial index, so inputs a few meters apart (or on
+either side of a grid line) share one key. Anchors are made by stored
+segments and dropped with the last entry keyed on them. Each entry
+records the geometry level and whether steps were fetched, so it only
+answers requests needing no more detail.
+"""
+
+import itertools
+import math
+import threading
+
+from django.conf import settings
+
+from .geocode_cache import LRUCache, MISS
+from .spatial_index import SpatialIndex
+
+
+METERS_PER_DEGREE_LAT = 111320
+
+# Geometry levels in increasing detail (see routing.GEOMETRY_LEVELS)
+GEOMETRY_RANK = {'none': 0, 'simplified': 1, 'full': 2}
+
+
+def snap_point(lat, lng, grid_meters):
+    """
+    Snap a coordinate to the grid cell containing it
+
+    Args:
+        lat: Latitude in degrees
+        lng: Longitude in degrees
+        grid_meters: Grid cell size in meters
+
+    Returns:
+        Tuple of integer (row, column) cell indices
+    """
+    lat_step = grid_meters / METERS_PER_DEGREE_LAT
+    row = math.floor(lat / lat_step)
+    # Longitude cells are sized at the snapped latitude so the key is stable
+    cos_lat = max(math.cos(math.radians(row * lat_step)), 0.01)
+    lng_step = lat_step / cos_lat
+    column = math.floor(lng / lng_step)
+    return (row, column)
+
+
+class SegmentCache:
+    """In-process cache of routed segments keyed by snapped endpoints"""
+
+    def __init__(self):
+        """Initialize cache from Django settings"""
+        self.grid_meters = getattr(settings, 'ROUTE_SEGMENT_CACHE_GRID_METERS', 50)
+        self.snap_meters = getattr(settings, 'ROUTE_SEGMENT_SNAP_METERS', 50)
+        # At most two anchors per cached entry, so no separate bound is needed
+        self.anchors = SpatialIndex()
+        self._anchor_ids = itertools.count()
+        self._anchor_refs = {}     # anchor id -> number of entries keyed on it
+        self._entry_anchors = {}   # cache key -> anchor ids it was keyed on
+        self._anchor_lock = threading.Lock()
+        self.memory = LRUCache(
+            getattr(settings, 'ROUTE_SEGMENT_CACHE_MAX_SIZE', 2048),
+            getattr(settings, 'ROUTE_SEGMENT_CACHE_TTL', 60 * 60 * 24),
+            getattr(settings, 'ROUTE_SEGMENT_CACHE_STALE_TTL', 60 * 60 * 24 * 7),
+            on_evict=self._release
+        )
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'stale_hits': 0,
+            'snapped': 0,
+        }
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def anchor(self, lat, lng, create=False):
+        """
+        Collapse a point onto the nearest anchor within snap_meters
+
+        Args:
+            lat: Latitude in degrees
+            lng: Longitude in degrees
+            create: Whether a point with no anchor nearby becomes one
+
+        Returns:
+            Tuple of (anchor id, lat, lng) of the anchor; the id is None
+            when the point is used as is
+        """
+        if not self.snap_meters:
+            return None, lat, lng
+        match = self.anchors.nearest(lat, lng, self.snap_meters)
+        if match is not None:
+            if match[4] > 0:
+                self._count('snapped')
+            return match[0], match[1], match[2]
+        if not create:
+            return None, lat, lng
+        anchor_id = next(self._anchor_ids)
+        self.anchors.add(anchor_id, lat, lng)
+        return anchor_id, lat, lng
+
+    def _anchored_key(self, origin, destination, create=False):
+        """Return the cache key for a segment and the anchor ids it uses"""
+        origin_id, *origin_point = self.anchor(origin['lat'], origin['lng'], create)
+        destination_id, *destination_point = self.anchor(destination['lat'], destination['lng'], create)
+        key = (
+            snap_point(*origin_point, self.grid_meters),
+            snap_point(*destination_point, self.grid_meters)
+        )
+        return key, (origin_id, destination_id)
+
+    def make_key(self, origin, destination):
+        """Build the cache key for a segment between two points"""
+        return self._anchored_key(origin, destination)[0]
+
+    def _release(self, key, value):
+        """Drop the anchors no cached entry is keyed on any more"""
+        with self._anchor_lock:
+            for anchor_id in self._entry_anchors.pop(key, ()):
+                self._unreference(anchor_id, -1)
+
+    def _unreference(self, anchor_id, change):
+        """Adjust an anchor's entry count, removing it at zero (the anchor lock must be held)"""
+        if anchor_id is None:
+            return
+        refs = self._anchor_refs.get(anchor_id, 0) + change
+        if refs > 0:
+            self._anchor_refs[anchor_id] = refs
+        else:
+            self._anchor_refs.pop(anchor_id, None)
+            self.anchors.remove(anchor_id)
+
+    @staticmethod
+    def _satisfies(value, geometry, steps):
+        """Whether a cached entry has at least the requested detail"""
+        return (
+            value is not MISS
+            and GEOMETRY_RANK[value['geometry']] >= GEOMETRY_RANK[geometry]
+            and (value['steps'] is not None or not steps)
+        )
+
+    def get(self, origin, destination, geometry='full', steps=False):
+        """
+        Look up a cached segment
+
+        Args:
+            origin: Dictionary with lat and lng of starting point
+            destination: Dictionary with lat and lng of ending point
+            geometry: Geometry level the caller needs
+            steps: Whether the caller needs turn-by-turn steps
+
+        Returns:
+            Dictionary with distance, duration, polyline and steps, or MISS
+        """
+        value = self.memory.get(self.make_key(origin, destination))
+        if not self._satisfies(value, geometry, steps):
+            value = MISS
+        self._count('misses' if value is MISS else 'hits')
+        return value
+
+    def get_stale(self, origin, destination, geometry='full', steps=False):
+        """Look up a segment even if expired within the stale TTL, or MISS"""
+        value = self.memory.get_stale(self.make_key(origin, destination))
+        if not self._satisfies(value, geometry, steps):
+            return MISS
+        self._count('stale_hits')
+        return value
+
+    def set(self, origin, destination, segment, geometry='full'):
+        """
+        Store a routed segment
+
+        Args:
+            origin: Dictionary with lat and lng of starting point
+            destination: Dictionary with lat and lng of ending point
+            segment: Leg with distance, duration, polyline and optional steps
+            geometry: Geometry level the polyline was fetched at
+        """
+        key, anchor_ids = self._anchored_key(origin, destination, create=True)
+        with self._anchor_lock:
+            if key not in self._entry_anchors:
+                self._entry_anchors[key] = anchor_ids
+                for anchor_id in anchor_ids:
+                    self._unreference(anchor_id, 1)
+            else:
+                # The key is already held; drop anchors made just now
+                for anchor_id in anchor_ids:
+                    self._unreference(anchor_id, 0)
+
+        # Keep a fresh entry that already has at least this much detail
+        if self._satisfies(self.memory.get(key), geometry, 'steps' in segment):
+            return
+        self.memory.set(key, {
+            'distance': segment['distance'],
+            'duration': segment['duration'],
+            'polyline': segment['polyline'],
+            'geometry': geometry,
+            'steps': segment.get('steps')
+        })
+        self._count('stores')
+
+    def get_stats(self):
+        """Return a snapshot of hit/miss counters"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['size'] = len(self.memory)
+        stats['anchors'] = len(self.anchors)
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+# Process-wide cache instance used by route_calculator
+segment_cache = SegmentCache()
@@ -1,11 +1,15 @@
+from django.conf import settings
 from rest_framework import serializers
 
+from .routing import GEOMETRY_LEVELS
+
 
 class LocationSerializer(serializers.Serializer):
     """Serializer for location data"""
     address = serializers.CharField(max_length=255)
     lat = serializers.FloatField(required=False)
     lng = serializers.FloatField(required=False)
+    kind = serializers.CharField(max_length=50, required=False)  # POI kind for stops at a known facility
 
 
 class TripRequestSerializer(serializers.Serializer):
@@ -14,6 +18,64 @@ class TripRequestSerializer(serializers.Serializer):
     pickup_location = serializers.CharField(max_length=255)
     dropoff_location = serializers.CharField(max_length=255)
     current_cycle_hours = serializers.FloatField(min_value=0, max_value=70)
+    cycle_history = serializers.ListField(  # On-duty hours of each previous day, oldest first
+        child=serializers.FloatField(min_value=0, max_value=24), max_length=7, required=False
+    )
+    allow_restart = serializers.BooleanField(required=False, default=False)  # Allow a 34-hour restart
+    sleeper_berth = serializers.BooleanField(required=False, default=False)  # Search split sleeper berth rests
+    enrich_stops = serializers.BooleanField(required=False, default=False)  # Name rest/break/fuel stops
+    geometry = serializers.ChoiceField(choices=GEOMETRY_LEVELS, required=False)  # Defaults per settings.ROUTE_DETAIL
+    steps = serializers.BooleanField(required=False)
+    
+    def validate(self, data):
+        history = data.get('cycle_history')
+        if history and abs(sum(history) - data['current_cycle_hours']) > 0.01:
+            raise serializers.ValidationError({'cycle_history': 'Must add up to current_cycle_hours.'})
+        return data
+    
+    def cycle_hours(self):
+        """Hours used in the cycle: the per-day history if given, else the total"""
+        return self.validated_data.get('cycle_history') or self.validated_data['current_cycle_hours']
+
+
+class MatrixPointField(serializers.Field):
+    """An address string or a dictionary with lat and lng"""
+    
+    default_error_messages = {
+        'invalid': 'Expected an address or an object with lat and lng.',
+    }
+    
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            if not data.strip() or len(data) > 255:
+                self.fail('invalid')
+            return data
+        if isinstance(data, dict):
+            try:
+                lat = float(data['lat'])
+                lng = float(data['lng'])
+            except (KeyError, TypeError, ValueError):
+                self.fail('invalid')
+            if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                self.fail('invalid')
+            return {'address': str(data.get('address') or '')[:255], 'lat': lat, 'lng': lng}
+        self.fail('invalid')
+    
+    def to_representation(self, value):
+        return value
+
+
+class MatrixRequestSerializer(serializers.Serializer):
+    """Serializer for distance/duration matrix requests"""
+    origins = serializers.ListField(
+        child=MatrixPointField(), min_length=1,
+        max_length=getattr(settings, 'MATRIX_MAX_POINTS', 200)
+    )
+    destinations = serializers.ListField(
+        child=MatrixPointField(), min_length=1,
+        max_length=getattr(settings, 'MATRIX_MAX_POINTS', 200)
+    )
+    current_cycle_hours = serializers.FloatField(min_value=0, max_value=70, required=False)  # Adds HOS-adjusted arrivals
 
 
 class RouteStopSerializer(serializers.Serializer):
@@ -21,7 +83,7 @@ class RouteStopSerializer(serializers.Serializer):
     location = LocationSerializer()
     arrival_time = serializers.DateTimeField()
     departure_time = serializers.DateTimeField()
-    stop_type = serializers.CharField(max_length=50)  # e.g., 'rest', 'pickup', 'dropoff', 'fuel'
+    stop_type = serializers.CharField(max_length=50)  # e.g., 'rest', 'sleeper', 'pickup', 'dropoff', 'fuel'
     duration = serializers.FloatField()  # in hours
 
 
@@ -59,4 +121,5 @@ class RouteResponseSerializer(serializers.Serializer):
     stops = RouteStopSerializer(many=True)
     segments = RouteSegmentSerializer(many=True)
     logs = LogEntrySerializer(many=True)
-    polyline = serializers.CharField()  # encoded polyline for map display
+    polyline = serializers.CharField(allow_blank=True)  # encoded polyline for map display, empty without geometry
+    steps = serializers.ListField(child=serializers.ListField(child=serializers.DictField()), required=False)  # per leg
@@ -0,0 +1,337 @@
+"""
+Single Flight module
+
+This module coalesces identical upstream calls that are in flight at the
+same time. Within a worker, threads asking for the same key wait for the
+first caller's result. Across workers, the UpstreamLock table stands in
+for a shared lock service: the first worker to insert a row for the key
+makes the call and publishes the JSON result on the row, while other
+workers poll the row instead of calling upstream themselves.
+
+ado is the same for coroutines: tasks on one event loop share a future,
+and the lock table is reached through sync_to_async. If the leading task
+is cancelled, a waiting task makes the call instead.
+"""
+
+import asyncio
+import datetime
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections
+from django.utils import timezone
+
+from .models import UpstreamLock
+
+
+# Result handed to waiting tasks when the leading task was cancelled
+_ABANDONED = object()
+
+
+class _Call:
+    """A call in flight within this process"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key"""
+
+    def __init__(self):
+        """Initialize from Django settings"""
+        self.wait_timeout = getattr(settings, 'SINGLE_FLIGHT_WAIT_TIMEOUT', 10)
+        self.result_ttl = getattr(settings, 'SINGLE_FLIGHT_RESULT_TTL', 5)
+        self.poll_interval = getattr(settings, 'SINGLE_FLIGHT_POLL_INTERVAL', 0.05)
+        self._calls = {}
+        self._async_calls = {}
+        self._refreshing = set()
+        self._refresh_executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'SINGLE_FLIGHT_REFRESH_WORKERS', 2),
+            thread_name_prefix='upstream-refresh'
+        )
+        self._lock = threading.Lock()
+        self.stats = {
+            'calls': 0,
+            'background_refreshes': 0,
+            'background_refresh_errors': 0,
+            'coalesced_threads': 0,
+            'coalesced_tasks': 0,
+            'coalesced_workers': 0,
+            'lock_timeouts': 0,
+            'db_errors': 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def do(self, key, func):
+        """
+        Run func once for all concurrent callers with the same key
+
+        Args:
+            key: String identifying the upstream request
+            func: Callable making the request; its result must be
+                  JSON-serializable to be shared across workers
+
+        Returns:
+            Result of func (possibly computed by another caller)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            call.event.wait()
+            self._count('coalesced_threads')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_across_workers(key, func)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.result
+
+    def refresh(self, key, func, on_result=None):
+        """
+        Run func for key in the background, at most once at a time
+
+        Used for stale-while-revalidate: the caller answers from stale
+        cache and the fresh result replaces it when it arrives.
+
+        Args:
+            key: String identifying the upstream request
+            func: Callable making the request
+            on_result: Optional callable receiving the fresh result
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self.stats['background_refreshes'] += 1
+
+        def run():
+            try:
+                result = self.do(key, func)
+                if on_result is not None:
+                    on_result(result)
+            except Exception:
+                # Stale data stays in place; the next request tries again
+                self._count('background_refresh_errors')
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+                connections.close_all()
+
+        self._refresh_executor.submit(run)
+
+    def _run_across_workers(self, key, func):
+        """Run func unless another worker is already running it"""
+        lock_key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+        try:
+            acquired = self._acquire(lock_key)
+        except DatabaseError:
+            self._count('db_errors')
+            return self._call(func)
+
+        if not acquired:
+            found, result = self._wait_for_result(lock_key)
+            if found:
+                self._count('coalesced_workers')
+                return result
+            # The other worker failed or timed out; make the call ourselves
+            return self._call(func)
+
+        try:
+            result = self._call(func)
+        except Exception:
+            self._release(lock_key)
+            raise
+
+        self._publish(lock_key, result)
+        return result
+
+    async def ado(self, key, func):
+        """
+        Async version of do
+
+        Args:
+            key: String identifying the upstream request
+            func: Callable returning an awaitable that makes the request
+
+        Returns:
+            Result of the awaited call (possibly made by another caller)
+        """
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), key)
+        while True:
+            future = self._async_calls.get(call_key)
+            if future is None:
+                break
+            self._count('coalesced_tasks')
+            # Shielded so one cancelled waiter does not cancel the others
+            result = await asyncio.shield(future)
+            if result is not _ABANDONED:
+                return result
+            # The leader was cancelled; the first waiter to wake takes over
+
+        future = self._async_calls[call_key] = loop.create_future()
+        try:
+            result = await self._arun_across_workers(key, func)
+        except asyncio.CancelledError:
+            # Cancelling the future would cancel every waiter along with
+            # the leader (e.g. when only the leader's client disconnected)
+            future.set_result(_ABANDONED)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure is not logged
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._async_calls[call_key]
+
+    async def _arun_across_workers(self, key, func):
+        """Await func unless another worker is already running it"""
+        lock_key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+        try:
+            acquired = await sync_to_async(self._acquire)(lock_key)
+        except DatabaseError:
+            self._count('db_errors')
+            return await self._acall(func)
+
+        if not acquired:
+            deadline = time.monotonic() + self.wait_timeout
+            while time.monotonic() < deadline:
+                state, result = await sync_to_async(self._read_result)(lock_key)
+                if state == 'found':
+                    self._count('coalesced_workers')
+                    return result
+                if state == 'gone':
+                    break
+                await asyncio.sleep(self.poll_interval)
+            else:
+                self._count('lock_timeouts')
+            return await self._acall(func)
+
+        try:
+            result = await self._acall(func)
+        except BaseException:
+            await sync_to_async(self._release)(lock_key)
+            raise
+
+        await sync_to_async(self._publish)(lock_key, result)
+        return result
+
+    def _call(self, func):
+        self._count('calls')
+        return func()
+
+    async def _acall(self, func):
+        self._count('calls')
+        return await func()
+
+    def _publish(self, lock_key, result):
+        """Store a finished call's result on its lock row for other workers"""
+        try:
+            UpstreamLock.objects.filter(key=lock_key).update(
+                result=json.dumps(result),
+                expires_at=timezone.now() + datetime.timedelta(seconds=self.result_ttl)
+            )
+        except (DatabaseError, TypeError, ValueError):
+            self._release(lock_key)
+
+    def _acquire(self, lock_key):
+        """Insert the lock row for a key; False if another worker holds it"""
+        now = timezone.now()
+        UpstreamLock.objects.filter(expires_at__lte=now).delete()
+        try:
+            UpstreamLock.objects.create(
+                key=lock_key,
+                expires_at=now + datetime.timedelta(seconds=self.wait_timeout)
+            )
+        except IntegrityError:
+            return False
+        return True
+
+    def _release(self, lock_key):
+        try:
+            UpstreamLock.objects.filter(key=lock_key).delete()
+        except DatabaseError:
+            self._count('db_errors')
+
+    def _wait_for_result(self, lock_key):
+        """
+        Poll another worker's lock row until it publishes a result
+
+        Returns:
+            Tuple of (found, result)
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            state, result = self._read_result(lock_key)
+            if state == 'found':
+                return True, result
+            if state == 'gone':
+                return False, None
+            time.sleep(self.poll_interval)
+
+        self._count('lock_timeouts')
+        return False, None
+
+    def _read_result(self, lock_key):
+        """
+        Check another worker's lock row once
+
+        Returns:
+            Tuple of ('found', result), ('pending', None) while the call
+            is running, or ('gone', None) if it was released without a
+            result, abandoned or cannot be read
+        """
+        try:
+            row = UpstreamLock.objects.filter(
+                key=lock_key,
+                expires_at__gt=timezone.now()
+            ).values_list('result').first()
+        except DatabaseError:
+            self._count('db_errors')
+            return 'gone', None
+        if row is None:
+            return 'gone', None
+        if row[0] is not None:
+            return 'found', json.loads(row[0])
+        return 'pending', None
+
+    def get_stats(self):
+        """Return a snapshot of call and coalescing counters"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self._calls) + len(self._async_calls)
+        return stats
+
+
+# Process-wide instance shared by geocoding, routing and suggestions
+upstream_flight = SingleFlight()
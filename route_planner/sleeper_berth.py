@@ -0,0 +1,431 @@
+"""
+Sleeper Berth module
+
+This module plans HOS schedules that may split the 10-hour rest into two
+sleeper berth periods, one of at least 7 hours in the berth and one of at
+least 2 hours, 10 or more in all (7/3 or 8/2). Once the second period of
+a pair ends, the 11-hour and 14-hour limits are counted from the end of
+the first, so neither period uses up the driving window.
+
+At every point where the plain schedule must stop for a break or a rest,
+the planner may instead take a period of a split. A depth-first
+branch-and-bound search over those choices looks for the earliest
+delivery. The plain schedule is the plan to beat; splits are tried before
+plain stops so that better plans turn up early, states already reached at
+an earlier time are skipped, and the search stops at its time budget with
+the best plan found so far.
+"""
+
+import time
+
+from django.conf import settings
+
+from .hos_calculator import ScheduleBudgetExceeded
+from .schedule import Schedule
+
+
+# Periods a rest may be split into, in hours
+SLEEPER_PERIODS = (7, 8)  # In the sleeper berth
+SHORT_PERIODS = (2, 3)    # Off duty or in the berth
+
+# Clock values are rounded to this many decimals when comparing states
+STATE_PRECISION = 6
+
+
+def is_split_pair(first, second):
+    """
+    Check whether two off-duty periods make a legal split rest
+
+    Args:
+        first: Length of one period in hours
+        second: Length of the other period in hours
+
+    Returns:
+        True if one is a sleeper berth period of 7+ hours, the other 2+
+        hours, and together they are at least 10 hours
+    """
+    longer, shorter = max(first, second), min(first, second)
+    return longer >= min(SLEEPER_PERIODS) and shorter >= min(SHORT_PERIODS) and longer + shorter >= 10
+
+
+class PlanState:
+    """Where a partial plan has got to: the trip position and duty clocks"""
+
+    __slots__ = (
+        'time', 'segment_index', 'remaining_distance', 'remaining_duration', 'handling',
+        'location', 'next_location', 'accumulated_distance', 'last_fuel_distance',
+        'available_driving_hours', 'available_window_hours', 'hours_since_break',
+        'cycle', 'split', 'events'
+    )
+
+    def copy(self):
+        """Return an independent copy to branch from"""
+        state = PlanState()
+        for name in self.__slots__:
+            setattr(state, name, getattr(self, name))
+        state.cycle = self.cycle.copy()
+        return state
+
+
+class SleeperBerthPlanner:
+    """Search for the fastest schedule that may split 10-hour rests"""
+
+    def __init__(self, calculator, time_budget=None):
+        """
+        Args:
+            calculator: HOSCalculator with the driver's cycle and options
+            time_budget: Seconds to search before settling for the best
+                plan found (settings.SLEEPER_BERTH_TIME_BUDGET if None)
+        """
+        self.calculator = calculator
+        self.time_budget = (
+            time_budget if time_budget is not None
+            else getattr(settings, 'SLEEPER_BERTH_TIME_BUDGET', 0.5)
+        )
+        self.stats = {'nodes': 0, 'pruned': 0, 'plans': 0, 'timed_out': False}
+
+    def plan(self, route_data):
+        """
+        Plan the fastest HOS-compliant schedule for a route
+
+        Fuel stops, pickup and dropoff are placed as in
+        HOSCalculator.build_schedule; stops are not moved to POI
+        facilities.
+
+        Args:
+            route_data: Dictionary containing route information (see
+                HOSCalculator.build_schedule)
+
+        Returns:
+            Schedule with stops and segments
+
+        Raises:
+            ScheduleBudgetExceeded: If even the plain schedule takes more
+                than settings.HOS_MAX_STEPS steps or HOS_TIME_BUDGET
+                seconds; a search that runs out of budget returns the
+                best plan found instead
+        """
+        calculator = self.calculator
+        self.route_data = route_data
+        self.start_time = calculator.schedule_start()
+        self.segments = route_data['segments']
+        # Driving hours left from the start of each segment to the end of the trip
+        self.driving_after = [0.0] * (len(self.segments) + 1)
+        for index in range(len(self.segments) - 1, -1, -1):
+            self.driving_after[index] = self.driving_after[index + 1] + max(self.segments[index]['duration'], 0)
+
+        state = PlanState()
+        state.time = 0
+        state.accumulated_distance = 0
+        state.last_fuel_distance = 0
+        state.available_driving_hours = calculator.MAX_DRIVING_HOURS
+        state.available_window_hours = calculator.MAX_DUTY_WINDOW
+        state.hours_since_break = 0
+        state.cycle = calculator.duty_cycle(self.start_time)
+        state.split = None  # (period length, driving hours since, hours since) of an unpaired period
+        state.events = (None, ('stop', route_data['locations'][0], 'start', 0, 0))
+        self._start_segment(state, 0)
+
+        # Every step counts against the calculator's step and time budget
+        self.steps = 0
+        self.budget_deadline = time.monotonic() + calculator.time_budget
+
+        # The plain schedule is the plan to beat
+        self.best = state.copy()
+        while True:
+            decision = self._advance(self.best)
+            if decision is None:
+                break
+            self._take(self.best, *self._options(self.best, decision)[-1])
+        self.stats['plans'] += 1
+
+        self.seen = {}
+        self.deadline = min(time.monotonic() + self.time_budget, self.budget_deadline)
+        try:
+            self._search(state)
+        except ScheduleBudgetExceeded:
+            # Out of steps mid-search: settle for the best plan so far
+            self.stats['timed_out'] = True
+        return self._schedule(self.best)
+
+    def _search(self, state):
+        """Explore the choices from a state, keeping the fastest finished plan"""
+        self.stats['nodes'] += 1
+        decision = self._advance(state)
+        if decision is None:
+            if state.time < self.best.time:
+                self.best = state
+                self.stats['plans'] += 1
+            return
+
+        # Every plan from here still has all the remaining driving to do
+        if self._lower_bound(state) >= self.best.time:
+            self.stats['pruned'] += 1
+            return
+        if time.monotonic() > self.deadline:
+            self.stats['timed_out'] = True
+            return
+
+        key = self._key(state)
+        if self.seen.get(key, float('inf')) <= state.time:
+            self.stats['pruned'] += 1
+            return
+        self.seen[key] = state.time
+
+        for option in self._options(state, decision):
+            branch = state.copy()
+            self._take(branch, *option)
+            self._search(branch)
+
+    def _lower_bound(self, state):
+        """
+        Earliest the trip could end: the driving and on-duty stops left,
+        plus the off-duty time that driving needs
+
+        Between consecutive periods of split rests, the driving on either
+        side of a period adds up to at most 11 hours while the periods of
+        each pair add up to at least 10, so any run of rests gives at most
+        11 hours of driving per 10 off duty, give or take the driving
+        before the first rest and after the last (11 hours each at most)
+        and half of the last period (under 4 hours).
+        """
+        calculator = self.calculator
+        pending = 0
+        if state.handling:
+            pending += calculator.PICKUP_DROPOFF_DURATION
+        if state.segment_index < len(self.segments) - 1 and len(self.segments) > 1:
+            pending += calculator.PICKUP_DROPOFF_DURATION  # The dropoff
+        driving = max(state.remaining_duration, 0) + self.driving_after[state.segment_index + 1]
+        off_duty = (
+            calculator.MIN_REST_DURATION / calculator.MAX_DRIVING_HOURS
+            * (driving - calculator.MAX_DRIVING_HOURS) - max(SLEEPER_PERIODS) / 2
+        )
+        return state.time + driving + pending + max(off_duty, 0)
+
+    @staticmethod
+    def _key(state):
+        """Trip position and duty clocks that decide what can still happen"""
+        def rounded(value):
+            return round(value, STATE_PRECISION)
+
+        split = state.split and (state.split[0], rounded(state.split[1]), rounded(state.split[2]))
+        return (
+            state.segment_index,
+            rounded(state.remaining_duration),
+            state.handling,
+            rounded(state.accumulated_distance - state.last_fuel_distance),
+            rounded(state.available_driving_hours),
+            rounded(state.available_window_hours),
+            rounded(state.hours_since_break),
+            rounded(state.cycle.available(state.time)),
+            split
+        )
+
+    def _options(self, state, decision):
+        """
+        List the off-duty periods that may be taken at a decision point
+
+        Periods of split rests come first, as they are what can beat the
+        plain schedule; the plain schedule's choice is last.
+        """
+        calculator = self.calculator
+        options = []
+        for length in SHORT_PERIODS:
+            # A short period only helps a rest if it completes a split
+            if decision == 'break' or (state.split and is_split_pair(state.split[0], length)):
+                options.append(('split_rest', length))
+        for length in reversed(SLEEPER_PERIODS):
+            options.append(('sleeper', length))
+        if decision == 'break' and state.available_driving_hours <= 0:
+            options.append(('rest', calculator.MIN_REST_DURATION))
+
+        if decision == 'break':
+            options.append(('break', calculator.MIN_BREAK_DURATION))
+        else:
+            options.append(('rest', calculator.MIN_REST_DURATION))
+        return options
+
+    def _take(self, state, stop_type, duration):
+        """Take an off-duty period, updating the duty clocks"""
+        calculator = self.calculator
+        self._add_stop(state, state.location, stop_type, duration)
+        state.time += duration
+        state.hours_since_break = 0
+
+        if stop_type == 'rest':
+            state.available_driving_hours = calculator.MAX_DRIVING_HOURS
+            state.available_window_hours = calculator.MAX_DUTY_WINDOW
+            state.split = None
+            return
+
+        state.available_window_hours -= duration
+        if stop_type == 'break':
+            self._elapse(state, duration, 0)
+            return
+
+        if state.split is not None and is_split_pair(state.split[0], duration):
+            # Limits now count from the end of the pair's first period
+            length, driving_since, hours_since = state.split
+            state.available_driving_hours = calculator.MAX_DRIVING_HOURS - driving_since
+            state.available_window_hours = calculator.MAX_DUTY_WINDOW - hours_since
+        state.split = (duration, 0, 0)
+
+    @staticmethod
+    def _elapse(state, hours, driving_hours):
+        """Count time towards the split rest that is waiting for its pair"""
+        if state.split is not None:
+            length, driving_since, hours_since = state.split
+            state.split = (length, driving_since + driving_hours, hours_since + hours)
+
+    def _start_segment(self, state, segment_index):
+        """Move on to a route segment (or past the last one)"""
+        locations = self.route_data['locations']
+        total_segments = len(self.segments)
+        state.segment_index = segment_index
+        state.handling = None
+        if segment_index >= total_segments:
+            return
+        segment = self.segments[segment_index]
+        state.remaining_distance = segment['distance']
+        state.remaining_duration = segment['duration']
+        if segment_index == 0:  # First segment ends at pickup
+            state.location = locations[0]
+            state.next_location = locations[1]
+            state.handling = 'pickup'
+        elif segment_index == total_segments - 1:  # Last segment ends at dropoff
+            state.location = locations[1]
+            state.next_location = locations[2]
+            state.handling = 'dropoff'
+        else:
+            state.location = segment['start_location']
+            state.next_location = segment['end_location']
+
+    def _advance(self, state):
+        """
+        Drive on until the plan needs a choice
+
+        Returns:
+            'break' when a 30-minute break is due, 'rest' when the driving
+            or window limit is reached, or None when the trip is done
+
+        Raises:
+            ScheduleBudgetExceeded: If the planner has taken more than
+                settings.HOS_MAX_STEPS steps or HOS_TIME_BUDGET seconds
+        """
+        calculator = self.calculator
+        total_segments = len(self.segments)
+
+        while state.segment_index < total_segments:
+            self.steps += 1
+            calculator.check_budget(self.steps, self.budget_deadline)
+
+            if state.hours_since_break >= calculator.MAX_DRIVING_WITHOUT_BREAK:
+                return 'break'
+
+            if state.accumulated_distance - state.last_fuel_distance >= calculator.FUELING_INTERVAL_MILES:
+                self._on_duty(state, 'fuel', calculator.FUELING_DURATION)
+                state.last_fuel_distance = state.accumulated_distance
+
+            if state.handling is not None:
+                self._on_duty(state, state.handling, calculator.PICKUP_DROPOFF_DURATION, state.next_location)
+                state.handling = None
+
+            if state.remaining_duration <= 0:
+                self._start_segment(state, state.segment_index + 1)
+                continue
+
+            driving_time = min(
+                state.available_driving_hours,
+                state.available_window_hours,
+                state.remaining_duration,
+                calculator.MAX_DRIVING_WITHOUT_BREAK - state.hours_since_break,
+                state.cycle.available(state.time)
+            )
+
+            if driving_time <= 0:
+                if state.cycle.available(state.time) > 0:
+                    return 'rest'
+                # Out of cycle hours: no split helps, wait or restart
+                stop_type, duration = calculator.take_off_duty(state.cycle, state.time)
+                self._add_stop(state, state.location, stop_type, duration)
+                state.time += duration
+                state.available_driving_hours = calculator.MAX_DRIVING_HOURS
+                state.available_window_hours = calculator.MAX_DUTY_WINDOW
+                state.hours_since_break = 0
+                state.split = None
+                continue
+
+            segment_progress = driving_time / state.remaining_duration
+            distance_covered = state.remaining_distance * segment_progress
+            state.accumulated_distance += distance_covered
+
+            if segment_progress < 1:
+                end_location = (state.accumulated_distance, state.segment_index, state.location, state.next_location)
+                self._add_drive(state, end_location, distance_covered, driving_time)
+                state.location = end_location
+                state.remaining_distance -= distance_covered
+                state.remaining_duration -= driving_time
+            else:
+                driving_time = state.remaining_duration
+                self._add_drive(state, state.next_location, state.remaining_distance, driving_time)
+                self._start_segment(state, state.segment_index + 1)
+
+            state.cycle.book(state.time, driving_time)
+            state.time += driving_time
+            state.available_driving_hours -= driving_time
+            state.available_window_hours -= driving_time
+            state.hours_since_break += driving_time
+            self._elapse(state, driving_time, driving_time)
+
+        return None
+
+    def _on_duty(self, state, stop_type, duration, location=None):
+        """Take an on-duty stop (fueling, pickup or dropoff)"""
+        self._add_stop(state, location or state.location, stop_type, duration)
+        state.cycle.book(state.time, duration)
+        state.time += duration
+        state.available_window_hours -= duration
+        self._elapse(state, duration, 0)
+
+    @staticmethod
+    def _add_stop(state, location, stop_type, duration):
+        state.events = (state.events, ('stop', location, stop_type, state.time, duration))
+
+    @staticmethod
+    def _add_drive(state, end_location, distance, duration):
+        state.events = (state.events, ('drive', state.location, end_location, distance, duration, state.time))
+
+    def _schedule(self, state):
+        """Build the Schedule of a finished plan"""
+        events = []
+        node = state.events
+        while node is not None:
+            node, event = node
+            events.append(event)
+        events.reverse()
+
+        # Intermediate points are tuples; number them and locate them in one pass
+        numbers = {}
+        points = []
+        for event in events:
+            if event[0] == 'drive' and isinstance(event[2], tuple):
+                accumulated_distance, segment_index, start_location, end_location = event[2]
+                numbers[id(event[2])] = len(points)
+                start_location = numbers[id(start_location)] if isinstance(start_location, tuple) else start_location
+                points.append((accumulated_distance, segment_index, start_location, end_location))
+        point_locations = self.calculator.route_positions(self.route_data, points)
+
+        def resolve(location):
+            return point_locations[numbers[id(location)]] if isinstance(location, tuple) else location
+
+        schedule = Schedule(self.start_time, self.route_data['locations'])
+        for event in events:
+            if event[0] == 'stop':
+                _, location, stop_type, start, duration = event
+                schedule.add_stop(resolve(location), stop_type, start, duration)
+            else:
+                _, start_location, end_location, distance, duration, start = event
+                schedule.add_segment(resolve(start_location), resolve(end_location), distance, duration, start)
+        schedule.add_stop(self.route_data['locations'][-1], 'end', state.time)
+        schedule.end = state.time
+        return schedule
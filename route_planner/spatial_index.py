@@ -0,0 +1,179 @@
+"""
+Spatial Index module
+
+This module provides a geohash-keyed index of named points with a
+nearest-neighbour query. Points are kept sorted by geohash, so all points
+in a geohash cell form one contiguous run found by binary search; a
+nearest query only scans the query cell and its eight neighbours at a
+precision whose cells are at least as large as the search radius. A
+bounded index evicts the least recently added or found point when full.
+"""
+
+import bisect
+import math
+import threading
+from collections import OrderedDict
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+EARTH_RADIUS_METERS = 6371008.8
+
+# Precision of the stored keys (cells of about 5 x 5 m)
+KEY_PRECISION = 9
+
+
+def geohash_encode(lat, lng, precision=KEY_PRECISION):
+    """
+    Encode a coordinate as a geohash
+
+    Args:
+        lat: Latitude in degrees
+        lng: Longitude in degrees
+        precision: Number of base-32 characters
+
+    Returns:
+        Geohash string
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True  # Bits alternate starting with longitude
+
+    while len(chars) < precision:
+        coordinate, bounds = (lng, lng_range) if even else (lat, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """Return the (height, width) in degrees of a geohash cell"""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def haversine_meters(lat1, lng1, lat2, lng2):
+    """Return the great-circle distance between two points in meters"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(min(a, 1.0)))
+
+
+class SpatialIndex:
+    """Thread-safe geohash index of points with nearest-neighbour lookup"""
+
+    def __init__(self, max_size=None):
+        """
+        Initialize an empty index
+
+        Args:
+            max_size: Maximum number of points; past this the least
+                      recently used point is evicted (None for unbounded)
+        """
+        self.max_size = max_size
+        self._entries = []  # Sorted (geohash, key) pairs
+        self._points = OrderedDict()  # key -> (geohash, lat, lng, value), least recently used first
+        self._lock = threading.Lock()
+
+    def add(self, key, lat, lng, value=None):
+        """
+        Add or move a point
+
+        Args:
+            key: Hashable, sortable identifier of the point
+            lat: Latitude in degrees
+            lng: Longitude in degrees
+            value: Data returned with the point by nearest()
+        """
+        geohash = geohash_encode(lat, lng)
+        with self._lock:
+            previous = self._points.pop(key, None)
+            if previous is not None:
+                self._entries.pop(bisect.bisect_left(self._entries, (previous[0], key)))
+            elif self.max_size is not None:
+                while len(self._points) >= self.max_size:
+                    evicted, (evicted_geohash, _, _, _) = self._points.popitem(last=False)
+                    self._entries.pop(bisect.bisect_left(self._entries, (evicted_geohash, evicted)))
+            bisect.insort(self._entries, (geohash, key))
+            self._points[key] = (geohash, lat, lng, value)
+
+    def remove(self, key):
+        """Remove a point if present"""
+        with self._lock:
+            previous = self._points.pop(key, None)
+            if previous is not None:
+                self._entries.pop(bisect.bisect_left(self._entries, (previous[0], key)))
+
+    def nearest(self, lat, lng, radius_meters):
+        """
+        Find the closest point within a radius
+
+        Args:
+            lat: Latitude in degrees
+            lng: Longitude in degrees
+            radius_meters: Search radius
+
+        Returns:
+            Tuple of (key, lat, lng, value, distance in meters), or None
+        """
+        precision = self._search_precision(lat, radius_meters)
+        height, width = geohash_cell_size(precision)
+
+        # The query cell and its neighbours cover the whole radius
+        prefixes = {
+            geohash_encode(
+                max(-90.0, min(90.0, lat + d_lat * height)),
+                (lng + d_lng * width + 180.0) % 360.0 - 180.0,
+                precision
+            )
+            for d_lat in (-1, 0, 1)
+            for d_lng in (-1, 0, 1)
+        }
+
+        best = None
+        with self._lock:
+            for prefix in prefixes:
+                position = bisect.bisect_left(self._entries, (prefix,))
+                while position < len(self._entries) and self._entries[position][0].startswith(prefix):
+                    key = self._entries[position][1]
+                    _, point_lat, point_lng, value = self._points[key]
+                    distance = haversine_meters(lat, lng, point_lat, point_lng)
+                    if distance <= radius_meters and (best is None or distance < best[4]):
+                        best = (key, point_lat, point_lng, value, distance)
+                    position += 1
+            if best is not None:
+                self._points.move_to_end(best[0])
+        return best
+
+    @staticmethod
+    def _search_precision(lat, radius_meters):
+        """Longest geohash precision whose cells are at least radius wide"""
+        meters_per_degree = math.pi * EARTH_RADIUS_METERS / 180
+        cos_lat = max(math.cos(math.radians(lat)), 0.01)
+        for precision in range(KEY_PRECISION, 0, -1):
+            height, width = geohash_cell_size(precision)
+            if min(height * meters_per_degree, width * meters_per_degree * cos_lat) >= radius_meters:
+                return precision
+        return 1
+
+    def __len__(self):
+        return len(self._points)
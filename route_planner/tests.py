@@ -0,0 +1,851 @@
+"""
+Tests module
+
+This module checks the HOS schedulers on a golden corpus of generated
+routes (see the benchmark_hos command): every schedule must keep to the
+HOS limits, the batch kernel must agree with the scheduler, and jumping
+whole duty days must give the same stops as stepping through them. Fuel
+stops and 10-hour rests land on facilities from the POI index when its
+corridor has any. Split sleeper berth plans are replayed against the 7/3
+and 8/2 split rest rules and must never be slower than the plain
+schedule. The gazetteer tests cover ranking among many places sharing a
+prefix, and the segment cache tests the lifetime of its snapping
+anchors. The local router is checked against plain Dijkstra on a small
+CSV graph, and the polyline codec against the reference algorithm.
+Upstream calls run against a fake clock and session to cover circuit
+breaker transitions, the single half-open trial and the jittered
+retries; the ASGI lifespan shutdown closes the async clients. The
+metrics endpoint is staff only, and tasks waiting on a coalesced call
+survive the cancellation of the task making it.
+"""
+
+import asyncio
+import csv
+import datetime
+import math
+import os
+import random
+import tempfile
+from unittest import mock
+
+import numpy as np
+import requests
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+from trucking_app.asgi import application as asgi_application
+
+from . import upstream
+from .gazetteer import Gazetteer
+from .geometry import (
+    cumulative_distances, decode_polyline, encode_polyline, merge_geometries, merge_polylines,
+    points_at_distances, split_at_points
+)
+from .hos_batch import batch_hos_schedules
+from .hos_calculator import DutyCycle, HOSCalculator, ScheduleBudgetExceeded, hours_past_midnight
+from .geocode_cache import MISS
+from .local_router import LocalRoutingBackend, _dijkstra, build_road_graph
+from .management.commands.benchmark_hos import golden_corpus, synthetic_route
+from .poi_index import FUEL_KINDS, REST_KINDS, POIIndex
+from .schedule import Schedule, Stop
+from .segment_cache import SegmentCache
+from .singleflight import SingleFlight
+from .views import MetricsView
+
+
+# Routes in the corpus the tests run on
+CORPUS_SIZE = 200
+
+# Float slack when comparing hours
+TOLERANCE = 1e-6
+
+# Departures are spread over the day so cycle days start at any hour
+FIRST_START = datetime.datetime(2026, 1, 5)
+
+
+class ScheduleAssertions:
+    """Replays schedules against the HOS limits"""
+
+    @staticmethod
+    def is_legal_split(first, second):
+        """Check whether two (stop type, hours) periods make a 7/3 or 8/2 split rest"""
+        return any(
+            stop_type == 'sleeper' and hours >= 7 and other >= 2 and hours + other >= 10
+            for (stop_type, hours), (_, other) in ((first, second), (second, first))
+        )
+
+    def assert_compliant(self, schedule, route_data, cycle_hours):
+        """
+        Replay a schedule in time order, checking every HOS limit
+
+        The 11-hour and 14-hour limits count from the last 10-hour rest,
+        or from the end of the first period of the last split rest pair;
+        neither period of a pair counts towards the 14 hours, and a period
+        still waiting for its pair counts like any other off-duty time.
+        """
+        calculator = HOSCalculator
+        items = sorted(schedule.stops + schedule.segments, key=lambda item: item.start)
+        cycle = DutyCycle(calculator.MAX_CYCLE_HOURS, cycle_hours, hours_past_midnight(schedule.start_time))
+        window_hours = 0
+        driving_since_rest = 0
+        driving_since_break = 0
+        driven = 0
+        current_time = 0
+        # (stop type, hours, driving since, window hours since) of a period waiting for its pair
+        split = None
+
+        for item in items:
+            self.assertAlmostEqual(item.start, current_time, delta=TOLERANCE)
+            current_time = item.start + item.duration
+            stop_type = getattr(item, 'stop_type', 'driving')
+
+            if stop_type in ('sleeper', 'split_rest'):
+                self.assertGreaterEqual(item.duration, 7 if stop_type == 'sleeper' else 2)
+                driving_since_break = 0
+                if split is not None and self.is_legal_split(split[:2], (stop_type, item.duration)):
+                    # The limits now count from the end of the first period
+                    driving_since_rest, window_hours = split[2:]
+                else:
+                    window_hours += item.duration
+                split = (stop_type, item.duration, 0, 0)
+                continue
+            if stop_type in ('rest', 'restart'):
+                self.assertGreaterEqual(item.duration, calculator.MIN_REST_DURATION)
+                if stop_type == 'restart':
+                    self.assertGreaterEqual(item.duration, calculator.RESTART_DURATION)
+                    cycle.restart()
+                window_hours = 0
+                driving_since_rest = 0
+                driving_since_break = 0
+                split = None
+                continue
+
+            window_hours += item.duration
+            if split is not None:
+                split = split[:2] + (split[2] + (stop_type == 'driving') * item.duration, split[3] + item.duration)
+            if stop_type == 'driving':
+                driving_since_rest += item.duration
+                driving_since_break += item.duration
+                driven += item.duration
+                self.assertLessEqual(driving_since_rest, calculator.MAX_DRIVING_HOURS + TOLERANCE)
+                self.assertLessEqual(driving_since_break, calculator.MAX_DRIVING_WITHOUT_BREAK + TOLERANCE)
+                self.assertLessEqual(window_hours, calculator.MAX_DUTY_WINDOW + TOLERANCE)
+                self.assertLessEqual(item.duration, cycle.available(item.start) + TOLERANCE)
+                cycle.book(item.start, item.duration)
+            elif stop_type in ('pickup', 'dropoff', 'fuel'):
+                cycle.book(item.start, item.duration)
+            elif stop_type == 'break':
+                self.assertGreaterEqual(item.duration, calculator.MIN_BREAK_DURATION)
+                driving_since_break = 0
+
+        self.assertAlmostEqual(driven, sum(segment['duration'] for segment in route_data['segments']),
+                               delta=TOLERANCE)
+        self.assertEqual(schedule.end, current_time)
+        self.assertEqual([stop.stop_type for stop in schedule.stops[:1]], ['start'])
+        self.assertEqual(schedule.stops[-1].stop_type, 'end')
+
+
+class HOSScheduleTests(ScheduleAssertions, SimpleTestCase):
+    """Schedules of the golden corpus keep to the HOS limits"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.corpus = golden_corpus(CORPUS_SIZE)
+
+    def test_golden_corpus_is_compliant(self):
+        for number, (route_data, cycle_hours, allow_restart) in enumerate(self.corpus):
+            with self.subTest(case=number):
+                start_time = FIRST_START + datetime.timedelta(hours=number % 24)
+                calculator = HOSCalculator(cycle_hours, allow_restart=allow_restart, start_time=start_time)
+                self.assert_compliant(calculator.build_schedule(route_data), route_data, cycle_hours)
+
+    def test_batch_kernel_matches_scheduler(self):
+        start_time = FIRST_START + datetime.timedelta(hours=15)
+        # The batch kernel takes trips with the same legs and cycle inputs together
+        groups = {}
+        for number, (route_data, cycle_hours, allow_restart) in enumerate(self.corpus):
+            key = (len(route_data['segments']), isinstance(cycle_hours, list), allow_restart)
+            groups.setdefault(key, []).append(number)
+
+        for (_, _, allow_restart), numbers in groups.items():
+            routes = [self.corpus[number][0] for number in numbers]
+            batch = batch_hos_schedules(
+                [[segment['duration'] for segment in route_data['segments']] for route_data in routes],
+                [[segment['distance'] for segment in route_data['segments']] for route_data in routes],
+                [self.corpus[number][1] for number in numbers],
+                allow_restart=allow_restart,
+                start_time=start_time
+            )
+            for trip, number in enumerate(numbers):
+                route_data, cycle_hours, _ = self.corpus[number]
+                with self.subTest(case=number):
+                    schedule = HOSCalculator(
+                        cycle_hours, allow_restart=allow_restart, start_time=start_time
+                    ).build_schedule(route_data)
+                    # Replay the schedule's on-duty time to find the cycle left
+                    cycle = DutyCycle(HOSCalculator.MAX_CYCLE_HOURS, cycle_hours, hours_past_midnight(start_time))
+                    for item in sorted(schedule.stops + schedule.segments, key=lambda item: item.start):
+                        if getattr(item, 'stop_type', None) == 'restart':
+                            cycle.restart()
+                        elif getattr(item, 'stop_type', 'driving') in ('driving', 'pickup', 'dropoff', 'fuel'):
+                            cycle.book(item.start, item.duration)
+
+                    self.assertEqual(batch['eta_hours'][trip], schedule.end)
+                    self.assertEqual(batch['stops'][trip], len(schedule.stops))
+                    self.assertTrue(np.isclose(batch['remaining_cycle_hours'][trip], cycle.available(schedule.end)))
+
+    def test_day_jumps_match_the_loop(self):
+        # Jumped and stepped days must give the same stops to the second
+        cases = self.corpus + [(synthetic_route(10000, 30000), 0, True), (synthetic_route(0, 9000), 0, False)]
+        for number, (route_data, cycle_hours, allow_restart) in enumerate(cases):
+            with self.subTest(case=number):
+                start_time = FIRST_START + datetime.timedelta(hours=number % 24)
+                calculator = HOSCalculator(cycle_hours, allow_restart=allow_restart, start_time=start_time)
+                jumped = calculator.build_schedule(route_data)
+                stepped = calculator.build_schedule(route_data, jump_days=False)
+
+                self.assertEqual([stop.stop_type for stop in jumped.stops], [stop.stop_type for stop in stepped.stops])
+                self.assertEqual(len(jumped.segments), len(stepped.segments))
+                for a, b in zip(jumped.stops, stepped.stops):
+                    self.assertAlmostEqual(a.start, b.start, delta=1 / 3600)
+                    self.assertAlmostEqual(a.duration, b.duration, delta=1 / 3600)
+                    self.assertAlmostEqual(a.location['lat'], b.location['lat'], delta=TOLERANCE)
+                    self.assertAlmostEqual(a.location['lng'], b.location['lng'], delta=TOLERANCE)
+                for a, b in zip(jumped.segments, stepped.segments):
+                    self.assertAlmostEqual(a.start, b.start, delta=1 / 3600)
+                    self.assertAlmostEqual(a.duration, b.duration, delta=1 / 3600)
+                    self.assertAlmostEqual(a.distance, b.distance, delta=TOLERANCE)
+
+
+class SleeperBerthTests(ScheduleAssertions, SimpleTestCase):
+    """Split rest plans against the HOS limits and the plain schedule"""
+
+    @override_settings(SLEEPER_BERTH_TIME_BUDGET=0.05)
+    def test_never_slower_than_plain_schedule(self):
+        for number, (route_data, cycle_hours, allow_restart) in enumerate(golden_corpus(20)):
+            with self.subTest(case=number):
+                plain = HOSCalculator(cycle_hours, allow_restart=allow_restart, start_time=FIRST_START)
+                split = HOSCalculator(cycle_hours, allow_restart=allow_restart, sleeper_berth=True,
+                                      start_time=FIRST_START).build_schedule(route_data)
+                self.assert_compliant(split, route_data, cycle_hours)
+                self.assertLessEqual(split.end, plain.build_schedule(route_data).end)
+
+    def test_split_rest_delivers_sooner(self):
+        route_data = synthetic_route(0, 2800)
+        plain = HOSCalculator(start_time=FIRST_START).build_schedule(route_data)
+        split = HOSCalculator(sleeper_berth=True, start_time=FIRST_START).build_schedule(route_data)
+        self.assert_compliant(split, route_data, 0)
+        self.assertLess(split.end, plain.end)
+        self.assertIn('sleeper', [stop.stop_type for stop in split.stops])
+
+    def assert_plan(self, periods, compliant):
+        """Replay a schedule made of (stop type or 'driving', hours) periods"""
+        location = {'address': 'Somewhere', 'lat': 40, 'lng': -100}
+        schedule = Schedule(FIRST_START, [location] * 3)
+        current_time = schedule.add_stop(location, 'start', 0)
+        for stop_type, hours in periods:
+            if stop_type == 'driving':
+                current_time = schedule.add_segment(location, location, hours * 50, hours, current_time)
+            else:
+                current_time = schedule.add_stop(location, stop_type, current_time, hours)
+        schedule.add_stop(location, 'end', current_time)
+        schedule.end = current_time
+        route_data = {'segments': [{'duration': sum(hours for stop_type, hours in periods if stop_type == 'driving')}]}
+
+        if compliant:
+            self.assert_compliant(schedule, route_data, 0)
+        else:
+            with self.assertRaises(AssertionError):
+                self.assert_compliant(schedule, route_data, 0)
+
+    def test_split_rest_rules(self):
+        # 2/8: 3 + 5 + 3 hours driven since the end of the 2-hour period
+        self.assert_plan([('driving', 8), ('split_rest', 2), ('driving', 3), ('sleeper', 8), ('driving', 5),
+                          ('break', 0.5), ('driving', 3)], True)
+        self.assert_plan([('driving', 8), ('split_rest', 2), ('driving', 3), ('sleeper', 8), ('driving', 5),
+                          ('break', 0.5), ('driving', 3.5)], False)
+        # 2/7 is 9 hours in all, so the limits still count from the start
+        self.assert_plan([('driving', 8), ('split_rest', 2), ('driving', 3), ('sleeper', 7), ('driving', 5)], False)
+        self.assert_plan([('driving', 8), ('split_rest', 3), ('driving', 3), ('sleeper', 7), ('driving', 5)], True)
+        # Neither of two off-duty periods is in the sleeper berth
+        self.assert_plan([('driving', 8), ('split_rest', 3), ('driving', 3), ('split_rest', 8), ('driving', 5)], False)
+        # The 14 hours leave out the 8-hour period but not the on-duty time
+        self.assert_plan([('driving', 8), ('split_rest', 2), ('driving', 3), ('sleeper', 8), ('pickup', 3),
+                          ('driving', 8)], True)
+        self.assert_plan([('driving', 8), ('split_rest', 2), ('driving', 3), ('sleeper', 8), ('pickup', 3.5),
+                          ('driving', 8)], False)
+        # A period waiting for its pair counts towards the 14 hours
+        self.assert_plan([('pickup', 3), ('driving', 3), ('split_rest', 3), ('driving', 5.5)], False)
+
+    def test_short_pairs_are_not_compliant(self):
+        # A planner pairing 7 and 2 hours (9 in all) must fail the replay
+        route_data = synthetic_route(0, 2800)
+        with mock.patch('route_planner.sleeper_berth.is_split_pair', lambda first, second: max(first, second) >= 7):
+            split = HOSCalculator(sleeper_berth=True, start_time=FIRST_START).build_schedule(route_data)
+        with self.assertRaises(AssertionError):
+            self.assert_compliant(split, route_data, 0)
+
+    @override_settings(HOS_MAX_STEPS=50)
+    def test_step_budget(self):
+        calculator = HOSCalculator(sleeper_berth=True, start_time=FIRST_START)
+        with self.assertRaises(ScheduleBudgetExceeded):
+            calculator.build_schedule(synthetic_route(0, 9000))
+
+
+def write_pois(rows):
+    """Write POI rows (name, kind, lat, lng) to a temporary CSV file and load it"""
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False) as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'kind', 'lat', 'lng', 'display_name'])
+        for name, kind, lat, lng in rows:
+            writer.writerow([name, kind, lat, lng, name.title()])
+    index = POIIndex(f.name)
+    os.unlink(f.name)
+    return index
+
+
+class POIIndexTests(SimpleTestCase):
+    """Corridor queries along a straight route"""
+
+    def setUp(self):
+        self.index = write_pois([
+            ('rest', 'rest_area', 40.001, -99.9),
+            ('south', 'truck_stop', 39.99, -99.7),  # In the grid row below the route
+            ('wide', 'fuel', 40.02, -99.5),  # About 1.4 miles off the route
+            ('near', 'fuel', 40.003, -99.2),
+            ('past_end', 'fuel', 40.0, -98.97),  # About 1.6 miles beyond the last vertex
+            ('far', 'fuel', 40.2, -99.5),
+        ])
+        self.route = np.array([(40.0, -100.0), (40.0, -99.5), (40.0, -99.0)])
+        self.distances = cumulative_distances(self.route)
+
+    def names(self, radius_miles, kinds=None):
+        corridor = self.index.corridor(self.route, self.distances, radius_miles, kinds)
+        return [poi['name'] for poi in corridor.pois()]
+
+    def test_radius_cutoff_and_along_route_order(self):
+        self.assertEqual(self.names(1, FUEL_KINDS), ['South', 'Near'])
+        self.assertEqual(self.names(2, FUEL_KINDS), ['South', 'Wide', 'Near', 'Past_End'])
+        self.assertEqual(self.names(1), ['Rest', 'South', 'Near'])
+
+    def test_positions(self):
+        corridor = self.index.corridor(self.route, self.distances, 2, FUEL_KINDS)
+        total = self.distances[-1]
+        expected = [(0.3 * total, 0.69), (0.5 * total, 1.38), (0.8 * total, 0.21), (total, 1.58)]
+        for poi, (distance, offset) in zip(corridor.pois(), expected):
+            with self.subTest(poi=poi['name']):
+                self.assertAlmostEqual(poi['distance'], distance, delta=0.01)
+                self.assertAlmostEqual(poi['offset'], offset, delta=0.01)
+        self.assertEqual(corridor.last_before(0.6 * total)['name'], 'Wide')
+        self.assertEqual(corridor.first_after(0.6 * total)['name'], 'Near')
+
+
+class POIStopTests(ScheduleAssertions, SimpleTestCase):
+    """Fuel stops and rests placed at facilities from the POI index"""
+
+    DISTANCE = 2500
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.route_data = synthetic_route(2000, cls.DISTANCE)
+        geometry = cls.route_data['geometry']
+        cumulative = cls.route_data['cumulative_distances']
+        scale = cumulative[-1] / cls.route_data['total_distance']
+
+        # Stations every 150 road miles and rest areas every 45, just off the route
+        rows = []
+        for kind, spacing, side in (('fuel', 150, 0.005), ('rest_area', 45, -0.005)):
+            miles = np.arange(spacing, cls.DISTANCE, spacing)
+            for mile, (lat, lng) in zip(miles, points_at_distances(geometry, cumulative, miles * scale)):
+                rows.append((f'{kind} {mile}', kind, lat + side, lng))
+        cls.poi_index = write_pois(rows)
+
+    def build(self, poi_index):
+        calculator = HOSCalculator(poi_index=poi_index, start_time=FIRST_START)
+        schedule = calculator.build_schedule(self.route_data)
+        self.assert_compliant(schedule, self.route_data, 0)
+        return schedule
+
+    def stop_positions(self, schedule):
+        """Return (road miles, stop) for every stop, in driving order"""
+        driven = 0
+        positions = []
+        for item in sorted(schedule.stops + schedule.segments, key=lambda item: item.start):
+            if isinstance(item, Stop):
+                positions.append((driven, item))
+            else:
+                driven += item.distance
+        return positions
+
+    def test_fuel_stops_at_stations(self):
+        fuel_stops = [(miles, stop) for miles, stop in self.stop_positions(self.build(self.poi_index))
+                      if stop.stop_type == 'fuel']
+        self.assertTrue(fuel_stops)
+        for miles, stop in fuel_stops:
+            self.assertIn(stop.location.get('kind'), FUEL_KINDS)
+            self.assertEqual(stop.location['address'], f'Fuel {round(miles)}')
+        # No stretch without fuel is longer than the interval
+        gaps = np.diff([0] + [miles for miles, _ in fuel_stops] + [self.DISTANCE])
+        self.assertLessEqual(gaps.max(), HOSCalculator.FUELING_INTERVAL_MILES + TOLERANCE)
+
+    def test_rests_at_rest_areas(self):
+        rests = [(miles, stop) for miles, stop in self.stop_positions(self.build(self.poi_index))
+                 if stop.stop_type == 'rest']
+        self.assertTrue(rests)
+        for miles, stop in rests:
+            self.assertIn(stop.location.get('kind'), REST_KINDS)
+            self.assertEqual(stop.location['address'], f'Rest_Area {round(miles)}')
+
+    def test_empty_corridor_falls_back_to_computed_points(self):
+        # Facilities, but none near this route
+        remote = write_pois([('remote', 'truck_stop', 25.0, -80.0), ('parking', 'truck_parking', 25.1, -80.0)])
+        schedule = self.build(remote)
+        plain = self.build(None)
+        self.assertEqual(
+            [(stop.stop_type, stop.start, stop.location['address']) for stop in schedule.stops],
+            [(stop.stop_type, stop.start, stop.location['address']) for stop in plain.stops]
+        )
+        fuel_miles = [miles for miles, stop in self.stop_positions(schedule) if stop.stop_type == 'fuel']
+        # Fuel is taken wherever the truck is once the interval has been driven
+        self.assertEqual(len(fuel_miles), 2)
+        self.assertGreaterEqual(np.diff([0] + fuel_miles).min(), HOSCalculator.FUELING_INTERVAL_MILES - TOLERANCE)
+        for _, stop in self.stop_positions(schedule):
+            self.assertNotIn('kind', stop.location)
+
+
+class GazetteerTests(SimpleTestCase):
+    """Ranking of exact and prefix matches"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False) as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'kind', 'lat', 'lng', 'display_name', 'rank'])
+            # Far more low-ranked matches than any candidate cap, all sorting first
+            for number in range(1000):
+                writer.writerow([f'san a{number:04d}', 'city', 30, -98, f'San A{number:04d}, TX', 1])
+            writer.writerow(['san francisco', 'city', 37.77, -122.42, 'San Francisco, CA', 100])
+            writer.writerow(['springfield', 'city', 37.21, -93.29, 'Springfield, MO', 10])
+            writer.writerow(['springfield', 'city', 39.80, -89.64, 'Springfield, IL', 50])
+        cls.gazetteer = Gazetteer(f.name)
+        os.unlink(f.name)
+
+    def test_suggest_ranks_every_prefix_match(self):
+        suggestions = self.gazetteer.suggest('san', limit=3)
+        self.assertEqual(suggestions[0]['display_name'], 'San Francisco, CA')
+        self.assertEqual(len(suggestions), 3)
+
+    def test_lookup_prefers_highest_rank(self):
+        self.assertEqual(self.gazetteer.lookup('Springfield')['display_name'], 'Springfield, IL')
+
+
+@override_settings(ROUTE_SEGMENT_CACHE_MAX_SIZE=10, ROUTE_SEGMENT_SNAP_METERS=50)
+class SegmentCacheTests(SimpleTestCase):
+    """Snapping anchors live exactly as long as the entries keyed on them"""
+
+    SEGMENT = {'distance': 100.0, 'duration': 2.0, 'polyline': ''}
+
+    def test_nearby_endpoints_share_an_entry(self):
+        cache = SegmentCache()
+        destination = {'lat': 41.0, 'lng': -101.0}
+        cache.set({'lat': 40.0, 'lng': -100.0}, destination, self.SEGMENT)
+        self.assertIsNot(cache.get({'lat': 40.0001, 'lng': -100.0}, destination), MISS)
+        # About 100 m away: past the snap radius
+        self.assertIs(cache.get({'lat': 40.0009, 'lng': -100.0}, destination), MISS)
+
+    def test_lookups_make_no_anchors(self):
+        cache = SegmentCache()
+        cache.get({'lat': 40.0, 'lng': -100.0}, {'lat': 41.0, 'lng': -101.0})
+        self.assertEqual(len(cache.anchors), 0)
+
+    def test_evicted_entries_release_their_anchors(self):
+        cache = SegmentCache()
+        for number in range(50):
+            cache.set({'lat': 30 + number / 100, 'lng': -90.0}, {'lat': 31 + number / 100, 'lng': -91.0},
+                      self.SEGMENT)
+        self.assertEqual(len(cache.memory), 10)
+        self.assertEqual(len(cache.anchors), 20)
+        cache.memory.clear()
+        self.assertEqual(len(cache.anchors), 0)
+
+
+class LocalRouterTests(SimpleTestCase):
+    """A* with landmarks on a small graph built from CSV files"""
+
+    ROWS = 8
+    COLUMNS = 8
+    SPACING = 0.004  # degrees between grid nodes; cells hold two or three
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        nodes_csv = os.path.join(cls.directory.name, 'nodes.csv')
+        edges_csv = os.path.join(cls.directory.name, 'edges.csv')
+        randomness = random.Random(7)
+
+        with open(nodes_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['id', 'lat', 'lng'])
+            for row in range(cls.ROWS):
+                for column in range(cls.COLUMNS):
+                    writer.writerow([f'n{row}_{column}', 40 + row * cls.SPACING, -100 + column * cls.SPACING])
+            # An island no landmark can reach
+            writer.writerow(['island_a', 41.0, -100.0])
+            writer.writerow(['island_b', 41.0, -99.99])
+
+        with open(edges_csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['source', 'target', 'distance', 'duration', 'oneway'])
+            for row in range(cls.ROWS):
+                for column in range(cls.COLUMNS):
+                    if column + 1 < cls.COLUMNS:
+                        # Every third row is a oneway street running east
+                        writer.writerow([f'n{row}_{column}', f'n{row}_{column + 1}', 330,
+                                         randomness.randint(10, 60), 1 if row % 3 == 0 else 0])
+                    if row + 1 < cls.ROWS:
+                        writer.writerow([f'n{row}_{column}', f'n{row + 1}_{column}', 445,
+                                         randomness.randint(10, 60), 0])
+            # The top-right corner can be left but not entered
+            writer.writerow([f'n{cls.ROWS - 1}_{cls.COLUMNS - 1}', 'n0_0', 5000, 400, 1])
+            writer.writerow(['island_a', 'island_b', 850, 60, 1])
+
+        graph_dir = os.path.join(cls.directory.name, 'graph')
+        build_road_graph(nodes_csv, edges_csv, graph_dir, landmark_count=4)
+        cls.backend = LocalRoutingBackend(graph_dir)
+        cls.graph = cls.backend.graph
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def test_shortest_path_matches_dijkstra(self):
+        graph = self.graph
+        csr = (graph.offsets.tolist(), graph.targets.tolist(), graph.durations.tolist())
+        for source in range(graph.node_count):
+            expected = _dijkstra(*csr, source)
+            for target in range(graph.node_count):
+                with self.subTest(source=source, target=target):
+                    if expected[target] == math.inf:
+                        with self.assertRaises(ValueError):
+                            graph.shortest_path(source, target)
+                        continue
+                    path, duration, distance = graph.shortest_path(source, target)
+                    self.assertAlmostEqual(duration, expected[target], places=3)
+                    self.assertEqual((path[0], path[-1]), (source, target))
+                    # The path only takes edges in their allowed direction
+                    walked_duration = walked_distance = 0.0
+                    for node, neighbour in zip(path, path[1:]):
+                        edges = range(graph.offsets[node], graph.offsets[node + 1])
+                        edge = min((edge for edge in edges if graph.targets[edge] == neighbour),
+                                   key=lambda edge: graph.durations[edge])
+                        walked_duration += float(graph.durations[edge])
+                        walked_distance += float(graph.distances[edge])
+                    self.assertAlmostEqual(walked_duration, duration, places=3)
+                    self.assertAlmostEqual(walked_distance, distance, places=3)
+
+    def test_oneway_and_unreachable_pairs(self):
+        corner = (self.ROWS - 1) * self.COLUMNS + self.COLUMNS - 1
+        island_a, island_b = self.graph.node_count - 2, self.graph.node_count - 1
+        self.assertEqual(self.graph.shortest_path(island_a, island_b)[1], 60)
+        with self.assertRaises(ValueError):
+            self.graph.shortest_path(island_b, island_a)
+        with self.assertRaises(ValueError):
+            self.graph.shortest_path(0, island_a)
+        # The corner's shortcut to the origin runs one way only
+        self.assertLessEqual(self.graph.shortest_path(corner, 0)[1], 400)
+        self.assertEqual(self.graph.travel_costs(0, [island_a, corner]).keys(), {corner})
+
+    def test_nearest_node_across_cell_borders(self):
+        randomness = random.Random(11)
+        for _ in range(200):
+            lat = 40 + randomness.uniform(-0.02, (self.ROWS - 1) * self.SPACING + 0.02)
+            lng = -100 + randomness.uniform(-0.02, (self.COLUMNS - 1) * self.SPACING + 0.02)
+            with self.subTest(lat=lat, lng=lng):
+                d_lat = self.graph.node_lat - lat
+                d_lng = (self.graph.node_lng - lng) * math.cos(math.radians(lat))
+                squared = d_lat * d_lat + d_lng * d_lng
+                nearest = self.graph.nearest_node(lat, lng)
+                self.assertAlmostEqual(squared[nearest], squared.min(), places=12)
+
+    def test_route_and_table_shapes(self):
+        waypoints = [{'lat': 40.0, 'lng': -100.0}, {'lat': 40.02, 'lng': -99.98}, {'lat': 40.0, 'lng': -99.976}]
+        legs, polyline = self.backend.route(waypoints, steps=True)
+        self.assertEqual(len(legs), 2)
+        for leg in legs:
+            self.assertEqual(set(leg), {'distance', 'duration', 'polyline', 'steps'})
+            self.assertGreater(leg['duration'], 0)
+        coordinates = decode_polyline(polyline)
+        self.assertTrue(np.allclose(coordinates[0], (40.0, -100.0)))
+        self.assertTrue(np.allclose(coordinates[-1], (40.0, -99.976)))
+
+        legs, polyline = self.backend.route(waypoints, geometry='none')
+        self.assertIsNone(polyline)
+        self.assertEqual([leg['polyline'] for leg in legs], [None, None])
+
+        island = {'lat': 41.0, 'lng': -100.0}
+        durations, distances = self.backend.table(waypoints[:2], waypoints + [island])
+        self.assertEqual([len(row) for row in durations], [4, 4])
+        self.assertEqual([len(row) for row in distances], [4, 4])
+        self.assertEqual(durations[0][0], 0)
+        self.assertEqual([row[3] for row in durations + distances], [None] * 4)
+        self.assertAlmostEqual(durations[0][1], legs[0]['duration'], places=6)
+
+
+class GeometryTests(SimpleTestCase):
+    """Polyline codec and merging of leg geometries"""
+
+    # Worked example of the reference polyline algorithm
+    REFERENCE_POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    REFERENCE_POLYLINE = '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+
+    def test_reference_vector(self):
+        self.assertEqual(encode_polyline(self.REFERENCE_POINTS), self.REFERENCE_POLYLINE)
+        self.assertTrue(np.allclose(decode_polyline(self.REFERENCE_POLYLINE), self.REFERENCE_POINTS))
+
+    def test_round_trip_negative_and_multi_chunk_values(self):
+        coordinates = np.array([
+            (-33.86785, 151.20732),  # southern and eastern hemispheres
+            (-0.00001, -0.00001),  # smallest negative step
+            (0.0, 0.0),
+            (89.99999, -179.99999),  # deltas needing six chunks
+            (-89.99999, 179.99999),
+            (-89.99999, 179.99999),  # zero deltas
+        ])
+        encoded = encode_polyline(coordinates)
+        self.assertTrue(np.allclose(decode_polyline(encoded), coordinates, atol=1e-9))
+        self.assertEqual(encode_polyline(decode_polyline(encoded)), encoded)
+
+    def test_merge_keeps_shared_vertex_once(self):
+        first = np.array([(40.0, -100.0), (40.1, -100.1), (40.2, -100.2)])
+        second = np.array([(40.2, -100.2), (40.3, -100.1), (40.4, -100.0)])
+        merged = merge_geometries([first, np.empty((0, 2)), second])
+        self.assertEqual(len(merged), 5)
+        self.assertEqual(sum(np.array_equal(point, (40.2, -100.2)) for point in merged), 1)
+
+        polyline = merge_polylines([encode_polyline(first), encode_polyline(second)])
+        self.assertTrue(np.allclose(decode_polyline(polyline), merged))
+
+    def test_split_at_waypoint_passed_twice(self):
+        # Out past the waypoint, round a block and back through it
+        route = np.array([
+            (0, 0), (0, 0.01), (0, 0.02), (0, 0.03), (0.01, 0.03),
+            (0.01, 0.02), (0, 0.02), (0, 0.01), (-0.01, 0.01)
+        ])
+        waypoint = [(0, 0.02)]
+
+        # The leg lengths tell the passes apart
+        first_pass = split_at_points(route, waypoint, [2, 6])
+        second_pass = split_at_points(route, waypoint, [6, 2])
+        self.assertEqual([len(leg) for leg in first_pass], [3, 7])
+        self.assertEqual([len(leg) for leg in second_pass], [7, 3])
+        for legs in (first_pass, second_pass):
+            self.assertTrue(np.array_equal(legs[0][-1], legs[1][0]))
+            self.assertTrue(np.array_equal(merge_geometries(legs), route))
+
+
+TEST_HOST = {
+    'base_url': 'http://upstream.test',
+    'connect_timeout': 1,
+    'read_timeout': 1,
+    'pool_maxsize': 1,
+    'gzip': False,
+    'retries': 2,
+    'backoff': 0.25,
+    'failure_threshold': 3,
+    'recovery_timeout': 30,
+}
+
+
+class FakeClock:
+    """Stands in for time.monotonic"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@override_settings(UPSTREAM_HOSTS={'test': TEST_HOST})
+class UpstreamTests(SimpleTestCase):
+    """Circuit breaker states and the retry path of upstream calls"""
+
+    def setUp(self):
+        upstream._breakers.pop('test', None)
+        self.clock = FakeClock()
+        self.session = mock.Mock()
+        self.rate_limiter = mock.Mock()
+        patches = [
+            mock.patch('route_planner.upstream.time.monotonic', self.clock),
+            mock.patch('route_planner.upstream.time.sleep'),
+            mock.patch('route_planner.upstream.get_session', return_value=self.session),
+            mock.patch('route_planner.upstream.get_rate_limiter', return_value=self.rate_limiter),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(upstream._breakers.pop, 'test', None)
+        self.breaker = upstream.get_circuit_breaker('test')
+
+    def open_circuit(self):
+        for _ in range(self.breaker.failure_threshold):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+
+    def test_breaker_cycle(self):
+        self.assertFalse(self.breaker.before_call())
+        self.open_circuit()
+        self.clock.now += 10
+        with self.assertRaises(upstream.CircuitOpenError) as raised:
+            self.breaker.before_call()
+        self.assertEqual(raised.exception.retry_after, 20)
+
+        # One trial once the recovery timeout has passed
+        self.clock.now += 20
+        self.assertEqual(self.breaker.state, 'half_open')
+        self.breaker.check()
+        self.assertTrue(self.breaker.before_call())
+        with self.assertRaises(upstream.CircuitOpenError):
+            self.breaker.check()
+        with self.assertRaises(upstream.CircuitOpenError):
+            self.breaker.before_call()
+
+        # A failed trial reopens the circuit for another recovery period
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.clock.now += 30
+        self.assertTrue(self.breaker.before_call())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.get_stats()['state'], 'closed')
+        self.assertEqual(self.breaker.get_stats()['opened'], 2)
+        self.assertEqual(self.breaker.get_stats()['rejected'], 3)
+
+    def test_open_circuit_fails_before_queueing(self):
+        self.open_circuit()
+        with self.assertRaises(upstream.CircuitOpenError):
+            upstream.get('test', '/path')
+        self.rate_limiter.acquire.assert_not_called()
+        self.session.get.assert_not_called()
+
+    def test_trial_released_on_non_http_error(self):
+        self.open_circuit()
+        self.clock.now += 30
+        self.session.get.side_effect = ValueError('bad parameters')
+        with self.assertRaises(ValueError):
+            upstream.get('test', '/path')
+        self.assertFalse(self.breaker.trial_in_flight)
+        self.assertTrue(self.breaker.before_call())
+
+    def test_trial_released_on_cancellation(self):
+        self.open_circuit()
+        self.clock.now += 30
+        client = mock.Mock()
+        client.get = mock.AsyncMock(side_effect=asyncio.CancelledError)
+        self.rate_limiter.aacquire = mock.AsyncMock()
+        with mock.patch('route_planner.upstream.get_async_client', return_value=client):
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(upstream.aget('test', '/path'))
+        self.assertFalse(self.breaker.trial_in_flight)
+        self.assertEqual(self.breaker.state, 'half_open')
+
+    def test_retries_with_jittered_backoff(self):
+        self.session.get.side_effect = [
+            requests.ConnectionError('reset'),
+            mock.Mock(status_code=503),
+            mock.Mock(status_code=200),
+        ]
+        with mock.patch('route_planner.upstream.random.uniform', return_value=0.1) as uniform:
+            response = upstream.get('test', '/path', params={'q': 'x'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(uniform.call_args_list, [mock.call(0, 0.25), mock.call(0, 0.5)])
+        upstream.time.sleep.assert_has_calls([mock.call(0.1), mock.call(0.1)])
+        self.assertEqual(self.rate_limiter.acquire.call_count, 3)
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_gives_up_after_the_last_attempt(self):
+        self.session.get.side_effect = requests.Timeout('slow')
+        with self.assertRaises(upstream.UpstreamError) as raised:
+            upstream.get('test', '/path')
+        self.assertNotIsInstance(raised.exception, upstream.CircuitOpenError)
+        self.assertEqual(self.session.get.call_count, 3)
+        self.assertEqual(upstream.time.sleep.call_count, 2)
+        self.assertEqual(self.breaker.state, 'open')
+
+
+class AsyncClientTests(SimpleTestCase):
+    """Lifetime of the per-loop async clients"""
+
+    def test_lifespan_shutdown_closes_clients(self):
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        async def main():
+            client = upstream.get_async_client('osrm')
+            self.assertIs(upstream.get_async_client('osrm'), client)
+            await asgi_application({'type': 'lifespan'}, receive, send)
+            self.assertNotIn(asyncio.get_running_loop(), upstream._async_clients)
+            return client
+
+        self.assertTrue(asyncio.run(main()).is_closed)
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+
+class MetricsViewTests(SimpleTestCase):
+    """Operational counters are only shown to staff"""
+
+    def test_anonymous_request_is_refused(self):
+        self.assertEqual(self.client.get('/api/metrics').status_code, 403)
+
+    def test_staff_request(self):
+        request = APIRequestFactory().get('/api/metrics')
+        force_authenticate(request, user=mock.Mock(is_staff=True, is_authenticated=True))
+        response = MetricsView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('circuit_breakers', response.data)
+
+
+class SingleFlightTests(SimpleTestCase):
+    """Coalescing of identical calls from tasks on one event loop"""
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        # Stay within the process; the lock table needs a database
+        self.flight._arun_across_workers = lambda key, func: self.flight._acall(func)
+        self.calls = 0
+
+    async def fetch(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return {'calls': self.calls}
+
+    def test_tasks_share_one_call(self):
+        async def main():
+            return await asyncio.gather(*(self.flight.ado('key', self.fetch) for _ in range(3)))
+
+        self.assertEqual(asyncio.run(main()), [{'calls': 1}] * 3)
+        self.assertEqual(self.flight.get_stats()['coalesced_tasks'], 2)
+
+    def test_follower_takes_over_from_cancelled_leader(self):
+        async def main():
+            leader = asyncio.create_task(self.flight.ado('key', self.fetch))
+            await asyncio.sleep(0)
+            followers = [asyncio.create_task(self.flight.ado('key', self.fetch)) for _ in range(2)]
+            await asyncio.sleep(0)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await leader
+            return await asyncio.gather(*followers)
+
+        # One follower repeats the call and the other shares its result
+        self.assertEqual(asyncio.run(main()), [{'calls': 2}] * 2)
+        self.assertEqual(self.flight.get_stats()['in_flight'], 0)
@@ -0,0 +1,416 @@
+"""
+Upstream Client module
+
+This module provides the shared HTTP client used for every call to the
+external mapping services (Nominatim and OSRM). Each upstream host gets
+its own pooled, keep-alive requests.Session with bounded pool size and
+connect/read timeouts configured in settings.UPSTREAM_HOSTS. Hosts with a
+rate_limit are scheduled through a shared token bucket.
+
+Failed calls are retried a bounded number of times with jittered
+exponential backoff, and a per-host circuit breaker fails calls fast
+while the host is down so callers can serve stale data instead.
+
+Async views use aget, which goes through the same breakers and rate
+limiters over a pooled httpx.AsyncClient per host and event loop. The
+ASGI application closes them on lifespan shutdown; clients of a loop
+that goes away without it are dropped along with the loop.
+"""
+
+import asyncio
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .rate_limiter import RateLimiter
+
+
+USER_AGENT = 'TruckingRouteApp/1.0'
+
+# Status codes worth retrying; anything else is returned to the caller
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream service cannot be reached or times out"""
+
+    def __init__(self, host, error):
+        self.host = host
+        super().__init__(f"{host} request failed: {error}")
+
+
+class CircuitOpenError(UpstreamError):
+    """Raised without calling upstream while a host's circuit is open"""
+
+    def __init__(self, host, retry_after):
+        self.retry_after = retry_after
+        super().__init__(host, f"circuit open, retry in {retry_after:.0f}s")
+
+
+class CircuitBreaker:
+    """Per-host circuit breaker (closed -> open -> half-open -> closed)"""
+
+    def __init__(self, host, failure_threshold, recovery_timeout):
+        """
+        Initialize breaker
+
+        Args:
+            host: Name of the upstream host
+            failure_threshold: Consecutive failures that open the circuit
+            recovery_timeout: Seconds before a trial call is let through
+        """
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+        self.stats = {
+            'opened': 0,
+            'rejected': 0,
+        }
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.recovery_timeout:
+            return 'half_open'
+        return 'open'
+
+    def check(self):
+        """
+        Fail fast if a call would be rejected, without claiming the trial
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with
+                              the trial call already in flight
+        """
+        with self._lock:
+            state = self.state
+            if state == 'open' or (state == 'half_open' and self.trial_in_flight):
+                raise self._reject()
+
+    def before_call(self):
+        """
+        Check that a call may go ahead
+
+        Returns:
+            True if the call is the half-open trial, False otherwise
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with
+                              the trial call already in flight
+        """
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return False
+            if state == 'half_open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            raise self._reject()
+
+    def _reject(self):
+        """Count a rejected call and build its error (lock held)"""
+        self.stats['rejected'] += 1
+        retry_after = max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+        return CircuitOpenError(self.host, retry_after)
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def release_trial(self):
+        """Give up the trial call without a verdict, e.g. when it was cancelled"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            # A failed trial re-opens the circuit for another recovery period
+            if self.trial_in_flight or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.stats['opened'] += 1
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+    def get_stats(self):
+        """Return breaker state and counters"""
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                **self.stats
+            }
+
+
+_sessions = {}
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> {host: client}
+_breakers = {}
+_rate_limiters = {}
+_sessions_lock = threading.Lock()
+
+
+def get_host_config(host):
+    """
+    Get the configuration for an upstream host
+
+    Args:
+        host: Name of the upstream host ('nominatim' or 'osrm')
+
+    Returns:
+        Dictionary with base_url, timeouts, pool size and gzip flag
+        (settings.UPSTREAM_HOSTS is the single source of these values)
+    """
+    return settings.UPSTREAM_HOSTS[host]
+
+
+def get_session(host):
+    """
+    Get the shared session for an upstream host, creating it on first use
+
+    Args:
+        host: Name of the upstream host
+
+    Returns:
+        requests.Session with a bounded keep-alive connection pool
+    """
+    session = _sessions.get(host)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        if host not in _sessions:
+            config = get_host_config(host)
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=config['pool_maxsize'],
+                pool_block=True
+            )
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({
+                'User-Agent': USER_AGENT,
+                'Accept-Encoding': 'gzip, deflate' if config['gzip'] else 'identity',
+                'Connection': 'keep-alive'
+            })
+            _sessions[host] = session
+        return _sessions[host]
+
+
+def get_async_client(host):
+    """
+    Get the async client for an upstream host on the running event loop
+
+    Args:
+        host: Name of the upstream host
+
+    Returns:
+        httpx.AsyncClient with a bounded keep-alive connection pool
+    """
+    # Clients are bound to the loop that created their connections
+    loop = asyncio.get_running_loop()
+    with _sessions_lock:
+        clients = _async_clients.setdefault(loop, {})
+        if host not in clients:
+            config = get_host_config(host)
+            clients[host] = httpx.AsyncClient(
+                base_url=config['base_url'],
+                timeout=httpx.Timeout(config['read_timeout'], connect=config['connect_timeout']),
+                limits=httpx.Limits(
+                    max_connections=config.get('async_pool_maxsize', 100),
+                    max_keepalive_connections=config['pool_maxsize']
+                ),
+                headers={
+                    'User-Agent': USER_AGENT,
+                    'Accept-Encoding': 'gzip, deflate' if config['gzip'] else 'identity'
+                }
+            )
+        return clients[host]
+
+
+def get_rate_limiter(host):
+    """
+    Get the request scheduler for a rate-limited upstream host
+
+    Args:
+        host: Name of the upstream host
+
+    Returns:
+        RateLimiter, or None if the host has no rate limit configured
+    """
+    if host in _rate_limiters:
+        return _rate_limiters[host]
+
+    with _sessions_lock:
+        if host not in _rate_limiters:
+            limit = get_host_config(host).get('rate_limit')
+            _rate_limiters[host] = RateLimiter(
+                host,
+                limit['rate'],
+                burst=limit.get('burst', 1),
+                deadlines=limit.get('deadlines'),
+                state_path=limit.get('state_path')
+            ) if limit else None
+        return _rate_limiters[host]
+
+
+def get_circuit_breaker(host):
+    """
+    Get the circuit breaker for an upstream host
+
+    Args:
+        host: Name of the upstream host
+
+    Returns:
+        CircuitBreaker shared by the process
+    """
+    if host in _breakers:
+        return _breakers[host]
+
+    with _sessions_lock:
+        if host not in _breakers:
+            config = get_host_config(host)
+            _breakers[host] = CircuitBreaker(
+                host,
+                config.get('failure_threshold', 5),
+                config.get('recovery_timeout', 30)
+            )
+        return _breakers[host]
+
+
+def get(host, path, params=None, priority='geocode'):
+    """
+    Issue a GET request against an upstream host
+
+    Args:
+        host: Name of the upstream host
+        path: URL path relative to the host's base_url
+        params: Optional dictionary of query parameters
+        priority: Scheduling class for rate-limited hosts
+                  ('route', 'geocode' or 'suggest')
+
+    Returns:
+        requests.Response
+
+    Raises:
+        RateLimitExceeded: If the request could not be scheduled in time
+        CircuitOpenError: If the host's circuit is open
+        UpstreamError: If the request failed or timed out on every attempt
+    """
+    config = get_host_config(host)
+    breaker = get_circuit_breaker(host)
+    rate_limiter = get_rate_limiter(host)
+    attempts = 1 + config.get('retries', 0)
+
+    for attempt in range(attempts):
+        # Fail fast while the circuit is open rather than queueing for a
+        # token, but claim the half-open trial only once a token is
+        # granted so a call that misses its deadline cannot hold it
+        breaker.check()
+        if rate_limiter is not None:
+            rate_limiter.acquire(priority)
+        trial = breaker.before_call()
+
+        try:
+            response = get_session(host).get(
+                config['base_url'] + path,
+                params=params,
+                timeout=(config['connect_timeout'], config['read_timeout'])
+            )
+        except requests.RequestException as e:
+            error = e
+        except BaseException:
+            if trial:
+                breaker.release_trial()
+            raise
+        else:
+            if response.status_code not in RETRY_STATUS_CODES:
+                breaker.record_success()
+                return response
+            error = f"HTTP {response.status_code}"
+
+        breaker.record_failure()
+        if attempt + 1 < attempts:
+            # Full jitter keeps retrying workers from synchronizing
+            time.sleep(random.uniform(0, config.get('backoff', 0.25) * 2 ** attempt))
+
+    raise UpstreamError(host, error)
+
+
+async def aget(host, path, params=None, priority='geocode'):
+    """
+    Issue a GET request against an upstream host without blocking the event loop
+
+    Args:
+        host: Name of the upstream host
+        path: URL path relative to the host's base_url
+        params: Optional dictionary of query parameters
+        priority: Scheduling class for rate-limited hosts
+
+    Returns:
+        httpx.Response (status_code, json() and text as on requests.Response)
+
+    Raises:
+        RateLimitExceeded: If the request could not be scheduled in time
+        CircuitOpenError: If the host's circuit is open
+        UpstreamError: If the request failed or timed out on every attempt
+    """
+    config = get_host_config(host)
+    breaker = get_circuit_breaker(host)
+    rate_limiter = get_rate_limiter(host)
+    attempts = 1 + config.get('retries', 0)
+
+    for attempt in range(attempts):
+        breaker.check()
+        if rate_limiter is not None:
+            await rate_limiter.aacquire(priority)
+        trial = breaker.before_call()
+
+        try:
+            response = await get_async_client(host).get(path, params=params)
+        except httpx.HTTPError as e:
+            error = e
+        except BaseException:
+            # Includes cancellation when the client disconnects
+            if trial:
+                breaker.release_trial()
+            raise
+        else:
+            if response.status_code not in RETRY_STATUS_CODES:
+                breaker.record_success()
+                return response
+            error = f"HTTP {response.status_code}"
+
+        breaker.record_failure()
+        if attempt + 1 < attempts:
+            await asyncio.sleep(random.uniform(0, config.get('backoff', 0.25) * 2 ** attempt))
+
+    raise UpstreamError(host, error)
+
+
+async def aclose_async_clients():
+    """Close the running event loop's async clients (ASGI lifespan shutdown)"""
+    with _sessions_lock:
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
+
+def close_sessions():
+    """Close all pooled sessions (used on shutdown and in tests)"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
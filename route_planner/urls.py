@@ -1,8 +1,22 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if getattr(settings, 'ASYNC_VIEWS', False):
+    # Native async views; serve with an ASGI server (see trucking_app/asgi.py)
+    from . import async_views
+    route_view = async_views.AsyncRouteCalculatorView
+    geocode_view = async_views.AsyncGeocodeView
+    suggestions_view = async_views.AsyncLocationSuggestionsView
+else:
+    route_view = views.RouteCalculatorView
+    geocode_view = views.GeocodeView
+    suggestions_view = views.LocationSuggestionsView
+
 urlpatterns = [
-    path('calculate-route', views.RouteCalculatorView.as_view(), name='calculate_route'),
-    path('geocode', views.GeocodeView.as_view(), name='geocode'),
-    path('location-suggestions', views.LocationSuggestionsView.as_view(), name='location_suggestions'),
+    path('calculate-route', route_view.as_view(), name='calculate_route'),
+    path('matrix', views.MatrixView.as_view(), name='matrix'),
+    path('geocode', geocode_view.as_view(), name='geocode'),
+    path('location-suggestions', suggestions_view.as_view(), name='location_suggestions'),
+    path('metrics', views.MetricsView.as_view(), name='metrics'),
 ]
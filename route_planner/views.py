@@ -1,16 +1,97 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser
 import datetime
-import requests
 import json
 
-from .serializers import TripRequestSerializer, RouteResponseSerializer
-from .route_calculator import calculate_route
-from .hos_calculator import calculate_hos_compliant_schedule
+from .serializers import TripRequestSerializer, RouteResponseSerializer, MatrixRequestSerializer
+from .route_calculator import (
+    calculate_route,
+    calculate_matrix,
+    geocode_address,
+    suggest_locations,
+    GeocodingError,
+    LocationNotFoundError
+)
+from .geocode_cache import geocode_cache
+from .segment_cache import segment_cache
+from .gazetteer import get_gazetteer
+from .poi_index import get_poi_index
+from .singleflight import upstream_flight
+from .reverse_geocoder import enrich_schedule_stops, reverse_geocoder
+from .rate_limiter import RateLimitExceeded
+from . import upstream
+from .upstream import CircuitOpenError, UpstreamError
+from .routing import get_route_detail
+from .hos_calculator import ScheduleBudgetExceeded, build_hos_schedule
 from .log_generator import generate_log_sheets
 
 
+def upstream_unavailable_response(error):
+    """Build the 503 response for an upstream outage or overload"""
+    response = Response(
+        {'error': str(error)},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    if isinstance(error, CircuitOpenError):
+        response['Retry-After'] = str(max(1, round(error.retry_after)))
+    return response
+
+
+def build_route_plan(route_data, current_cycle_hours, enrich_stops=False, steps=False, allow_restart=False,
+                     sleeper_berth=False):
+    """
+    Build the route plan response from calculated route data
+    
+    This is the CPU-bound part of a plan request (HOS schedule, log
+    sheets, serialization), shared by the sync and async views.
+    
+    Args:
+        route_data: Route information from calculate_route
+        current_cycle_hours: Current hours used in the 70-hour/8-day cycle,
+            as a total or per previous day
+        enrich_stops: Whether to name rest, break and fuel stops
+        steps: Whether to include turn-by-turn steps per leg
+        allow_restart: Whether a 34-hour restart may reset the cycle
+        sleeper_berth: Whether to search for faster split sleeper berth rests
+        
+    Returns:
+        Response with the plan
+    """
+    # Calculate HOS-compliant schedule with rest stops
+    schedule = build_hos_schedule(
+        route_data,
+        current_cycle_hours,
+        allow_restart,
+        sleeper_berth
+    )
+    
+    # Optionally replace placeholder stop addresses with place names
+    if enrich_stops:
+        enrich_schedule_stops(schedule)
+    
+    # Generate log sheets based on the schedule
+    log_sheets = generate_log_sheets(schedule)
+    
+    # Combine all data for response
+    response_data = {
+        'total_distance': route_data['total_distance'],
+        'total_duration': route_data['total_duration'],
+        'estimated_start_time': schedule.start_time,
+        'estimated_delivery_time': schedule.end_time,
+        'stops': schedule.stops,
+        'segments': schedule.segments,
+        'logs': log_sheets,
+        'polyline': route_data['polyline'] or ''
+    }
+    if steps:
+        response_data['steps'] = [segment['steps'] for segment in route_data['segments']]
+    
+    # Stops and segments are rendered straight from the schedule objects
+    return Response(RouteResponseSerializer(response_data).data)
+
+
 class RouteCalculatorView(APIView):
     """API view for calculating routes with HOS compliance"""
 
@@ -25,43 +106,47 @@ class RouteCalculatorView(APIView):
         current_location = serializer.validated_data['current_location']
         pickup_location = serializer.validated_data['pickup_location']
         dropoff_location = serializer.validated_data['dropoff_location']
-        current_cycle_hours = serializer.validated_data['current_cycle_hours']
+        current_cycle_hours = serializer.cycle_hours()
+        allow_restart = serializer.validated_data['allow_restart']
+        sleeper_berth = serializer.validated_data['sleeper_berth']
+        enrich_stops = serializer.validated_data['enrich_stops']
+        geometry, steps = get_route_detail(
+            'calculate_route',
+            serializer.validated_data.get('geometry'),
+            serializer.validated_data.get('steps')
+        )
         
         try:
             # Step 1: Calculate basic route information
             route_data = calculate_route(
                 current_location, 
                 pickup_location,
-                dropoff_location
+                dropoff_location,
+                geometry,
+                steps
             )
             
-            # Step 2: Calculate HOS-compliant schedule with rest stops
-            schedule_data = calculate_hos_compliant_schedule(
-                route_data,
-                current_cycle_hours
+            # Steps 2 and 3: HOS schedule and log sheets
+            return build_route_plan(
+                route_data, current_cycle_hours, enrich_stops, steps, allow_restart, sleeper_berth
             )
+                
+        except (UpstreamError, RateLimitExceeded) as e:
+            return upstream_unavailable_response(e)
             
-            # Step 3: Generate log sheets based on the schedule
-            log_sheets = generate_log_sheets(schedule_data)
-            
-            # Combine all data for response
-            response_data = {
-                'total_distance': schedule_data['total_distance'],
-                'total_duration': schedule_data['total_duration'],
-                'estimated_start_time': schedule_data['start_time'],
-                'estimated_delivery_time': schedule_data['end_time'],
-                'stops': schedule_data['stops'],
-                'segments': schedule_data['segments'],
-                'logs': log_sheets,
-                'polyline': route_data['polyline']
-            }
+        except ScheduleBudgetExceeded as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
             
-            # Validate response data
-            response_serializer = RouteResponseSerializer(data=response_data)
-            if response_serializer.is_valid():
-                return Response(response_serializer.validated_data)
-            else:
-                return Response(response_serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        except GeocodingError as e:
+            if isinstance(e.error, (UpstreamError, RateLimitExceeded)):
+                return upstream_unavailable_response(e)
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
                 
         except Exception as e:
             return Response(
@@ -70,6 +155,50 @@ class RouteCalculatorView(APIView):
             )
 
 
+class MatrixView(APIView):
+    """API view for many-to-many travel time and distance matrices"""
+
+    def post(self, request):
+        """Compute durations and distances from every origin to every destination"""
+        serializer = MatrixRequestSerializer(data=request.data)
+        
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            result = calculate_matrix(
+                serializer.validated_data['origins'],
+                serializer.validated_data['destinations'],
+                serializer.validated_data.get('current_cycle_hours')
+            )
+            return Response(result)
+            
+        except (UpstreamError, RateLimitExceeded) as e:
+            return upstream_unavailable_response(e)
+            
+        except ScheduleBudgetExceeded as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+            
+        except GeocodingError as e:
+            if isinstance(e.error, (UpstreamError, RateLimitExceeded)):
+                return upstream_unavailable_response(e)
+            if isinstance(e.error, LocationNotFoundError):
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+            
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
 class GeocodeView(APIView):
     """API view for geocoding addresses"""
     
@@ -84,33 +213,23 @@ class GeocodeView(APIView):
             )
         
         try:
-            # Use OpenStreetMap Nominatim API for geocoding (free)
-            response = requests.get(
-                'https://nominatim.openstreetmap.org/search',
-                params={
-                    'q': address,
-                    'format': 'json',
-                    'limit': 1
-                },
-                headers={'User-Agent': 'TruckingRouteApp/1.0'}
-            )
+            result = geocode_address(address)
+            return Response(result)
             
-            data = response.json()
+        except LocationNotFoundError:
+            return Response(
+                {'error': 'Location not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
             
-            if not data:
-                return Response(
-                    {'error': 'Location not found'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-                
-            result = {
-                'address': address,
-                'lat': float(data[0]['lat']),
-                'lng': float(data[0]['lon']),
-                'display_name': data[0]['display_name']
-            }
+        except RateLimitExceeded as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
             
-            return Response(result)
+        except UpstreamError as e:
+            return upstream_unavailable_response(e)
             
         except Exception as e:
             return Response(
@@ -130,32 +249,47 @@ class LocationSuggestionsView(APIView):
             return Response([])
         
         try:
-            # Use OpenStreetMap Nominatim API for location suggestions
-            response = requests.get(
-                'https://nominatim.openstreetmap.org/search',
-                params={
-                    'q': query,
-                    'format': 'json',
-                    'limit': 5  # Return top 5 suggestions
-                },
-                headers={'User-Agent': 'TruckingRouteApp/1.0'}
-            )
+            suggestions = suggest_locations(query, limit=5)  # Return top 5 suggestions
+            return Response(suggestions)
             
-            data = response.json()
+        except RateLimitExceeded as e:
+            # Dropped in favour of route geocodes; the next keystroke retries
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
             
-            # Format suggestions for frontend
-            suggestions = []
-            for item in data:
-                suggestions.append({
-                    'display_name': item['display_name'],
-                    'lat': float(item['lat']),
-                    'lng': float(item['lon'])
-                })
-                
-            return Response(suggestions)
+        except UpstreamError as e:
+            return upstream_unavailable_response(e)
             
         except Exception as e:
             return Response(
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+class MetricsView(APIView):
+    """API view exposing cache and upstream counters (staff only)"""
+
+    # Upstream hosts, breaker state and queue depths are operational detail
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        """Return current counters for this worker process"""
+        gazetteer = get_gazetteer()
+        poi_index = get_poi_index()
+        rate_limiter = upstream.get_rate_limiter('nominatim')
+        return Response({
+            'geocode_cache': geocode_cache.get_stats(),
+            'segment_cache': segment_cache.get_stats(),
+            'single_flight': upstream_flight.get_stats(),
+            'reverse_geocode': reverse_geocoder.get_stats(),
+            'nominatim_rate_limit': rate_limiter.get_stats() if rate_limiter else None,
+            'circuit_breakers': {
+                host: upstream.get_circuit_breaker(host).get_stats()
+                for host in ('nominatim', 'osrm')
+            },
+            'gazetteer': gazetteer.get_stats() if gazetteer else None,
+            'poi_index': poi_index.get_stats() if poi_index else None
+        })
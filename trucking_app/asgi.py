@@ -1,5 +1,10 @@
 """
 ASGI config for trucking_app project.
+
+Run with an ASGI server so the async views can serve many concurrent
+plans per process, for example:
+
+    gunicorn trucking_app.asgi:application -k uvicorn.workers.UvicornWorker
 """
 
 import os
@@ -7,5 +12,24 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'trucking_app.settings')
+# Native async views pay off here; set ASYNC_VIEWS=false to opt out
+os.environ.setdefault('ASYNC_VIEWS', 'true')
+
+django_application = get_asgi_application()
+
+from route_planner import upstream  # noqa: E402 (needs the app registry)
+
+
+async def application(scope, receive, send):
+    """Serve Django, closing the pooled upstream clients on lifespan shutdown"""
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
 
-application = get_asgi_application()
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await upstream.aclose_async_clients()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -129,3 +129,105 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
     ],
 }
+
+
+# Geocode cache settings
+GEOCODE_CACHE_MAX_SIZE = 1024  # Entries kept in each worker's in-process LRU
+GEOCODE_CACHE_TTL = 60 * 60 * 24 * 30  # 30 days, in seconds
+GEOCODE_NEGATIVE_CACHE_TTL = 60 * 10  # Cache "not found" answers for 10 minutes
+GEOCODE_CACHE_STALE_TTL = 60 * 60 * 24 * 7  # Serve expired answers for a week while refreshing
+GEOCODE_SPATIAL_INDEX_MAX_SIZE = 100000  # Resolved locations indexed by geohash per worker
+GEOCODE_NEARBY_METERS = 100  # Name bare coordinates after a known place this close
+
+# Upstream HTTP client settings (pooled keep-alive session per host)
+UPSTREAM_HOSTS = {
+    'nominatim': {
+        'base_url': os.getenv('NOMINATIM_URL', 'https://nominatim.openstreetmap.org'),
+        'connect_timeout': 3.05,  # seconds
+        'read_timeout': 10,
+        'pool_maxsize': 10,
+        'async_pool_maxsize': 100,  # Connections per event loop for async views
+        'gzip': True,
+        'retries': 2,  # Extra attempts on connection errors, timeouts and 5xx
+        'backoff': 0.25,  # Seconds, doubled per attempt with full jitter
+        'failure_threshold': 5,  # Consecutive failures that open the circuit
+        'recovery_timeout': 30,  # Seconds before a trial call is let through
+        # Nominatim usage policy: about 1 request/second across all workers.
+        # Queued requests past their class deadline (seconds) are dropped.
+        'rate_limit': {
+            'rate': 1.0,
+            'burst': 1,
+            'deadlines': {'route': 15, 'geocode': 10, 'enrich': 5, 'suggest': 1.5},
+        },
+    },
+    'osrm': {
+        'base_url': os.getenv('OSRM_URL', 'http://router.project-osrm.org'),
+        'connect_timeout': 3.05,
+        'read_timeout': 20,
+        'pool_maxsize': 10,
+        'async_pool_maxsize': 100,
+        'gzip': True,
+        'retries': 2,
+        'backoff': 0.25,
+        'failure_threshold': 5,
+        'recovery_timeout': 30,
+    },
+}
+
+# Route segment cache settings (endpoints snapped to a grid)
+ROUTE_SEGMENT_CACHE_GRID_METERS = 50
+ROUTE_SEGMENT_CACHE_MAX_SIZE = 2048
+ROUTE_SEGMENT_CACHE_TTL = 60 * 60 * 24  # 1 day, in seconds
+ROUTE_SEGMENT_CACHE_STALE_TTL = 60 * 60 * 24 * 7
+ROUTE_SEGMENT_SNAP_METERS = 50  # Endpoints this close share a cache key (0 disables); keep near the grid size
+
+# Routing backend: 'osrm' (HTTP API) or 'local' (in-process engine over a
+# graph built with `manage.py build_road_graph`)
+ROUTING_BACKEND = os.getenv('ROUTING_BACKEND', 'osrm')
+ROUTING_GRAPH_DIR = os.getenv('ROUTING_GRAPH_DIR', str(BASE_DIR / 'data' / 'road_graph'))
+
+# Serve the route, geocode and suggestion endpoints with native async views.
+# On by default only when served over ASGI (trucking_app/asgi.py sets it);
+# under WSGI each request would run on its own event loop with no pooling.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'false').lower() in ('1', 'true', 'yes')
+
+# Route detail fetched per endpoint unless the request overrides it.
+# geometry: 'none', 'simplified' or 'full'; steps: turn-by-turn instructions
+ROUTE_DETAIL = {
+    'calculate_route': {'geometry': 'full', 'steps': False},
+}
+
+# Local gazetteer (cities, ZIP centroids, truck stops) consulted before
+# Nominatim. CSV columns: name, kind, lat, lng, display_name, rank
+GAZETTEER_PATH = os.getenv('GAZETTEER_PATH', str(BASE_DIR / 'data' / 'gazetteer.csv'))
+
+# Local index of truck stops, fuel stations, rest areas and truck parking
+# used to place fuel stops and 10-hour rests at real facilities.
+# CSV columns: name, kind, lat, lng, display_name
+POI_PATH = os.getenv('POI_PATH', str(BASE_DIR / 'data' / 'pois.csv'))
+POI_CELL_SIZE = 0.1  # Grid cell size in degrees
+
+# HOS scheduling limits: a plan that takes more steps or seconds than this
+# fails instead of tying up the worker
+HOS_MAX_STEPS = 100000
+HOS_TIME_BUDGET = 2  # Seconds
+SLEEPER_BERTH_TIME_BUDGET = 0.5  # Seconds to search for split rests before settling for the best plan so far
+
+# Single-flight coalescing of identical in-flight upstream calls
+SINGLE_FLIGHT_WAIT_TIMEOUT = 10  # Max seconds to wait on another worker's call
+SINGLE_FLIGHT_RESULT_TTL = 5  # Seconds a finished result stays readable by other workers
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+SINGLE_FLIGHT_REFRESH_WORKERS = 2  # Background stale-while-revalidate refreshes
+
+# Distance/duration matrix endpoint
+MATRIX_MAX_POINTS = 200  # Max origins (and destinations) per request
+MATRIX_MAX_TABLE_SIZE = 100  # Max coordinates per OSRM table request; larger matrices are chunked
+MATRIX_MAX_CONCURRENT_REQUESTS = 4
+
+# Reverse geocoding of computed rest, break and fuel stops
+REVERSE_GEOCODE_GRID_METERS = 500  # Stops in the same cell share one lookup
+REVERSE_GEOCODE_MAX_WORKERS = 4  # Concurrent lookups per plan (still rate limited)
+REVERSE_GEOCODE_ZOOM = 16  # Nominatim detail level (16 = major and minor streets)
+REVERSE_GEOCODE_NEARBY_METERS = 300  # Reuse a geocoded place this close instead of a lookup
+REVERSE_GEOCODE_CACHE_MAX_SIZE = 4096
+REVERSE_GEOCODE_CACHE_TTL = 60 * 60 * 24 * 30  # 30 days, in seconds